@@ -1,6 +1,8 @@
 ﻿# ðŸ“Œ Imports de Bibliotecas Externas
 import os
 import sys
+import threading
+import time
 
 PROJECT_DIR = os.path.abspath(os.path.dirname(__file__))
 VENV_PYTHON = os.path.join(PROJECT_DIR, ".venv", "Scripts", "python.exe")
@@ -12,25 +14,44 @@ if (
 ):
     os.execv(VENV_PYTHON, [VENV_PYTHON, __file__, *sys.argv[1:]])
 
-from flask import Flask, render_template, make_response, request, redirect, url_for, jsonify, flash, session, send_file, abort
+from flask import Flask, render_template, make_response, request, redirect, url_for, jsonify, flash, session, send_file, abort, g, has_app_context, has_request_context, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
+from markupsafe import Markup, escape
 from datetime import datetime, timedelta
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from types import MappingProxyType
 from pytz import timezone
-from sqlalchemy import or_, text
+from PIL import Image
+from sqlalchemy import event, inspect, or_, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import io
+import csv
 import fitz  # PyMuPDF
 import requests
 import base64
 import json
-import subprocess
+import glob
+import hashlib
+import math
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import zipfile
 from itsdangerous import URLSafeSerializer
+import click
 
 from models import db, Orcamento, OrcamentoSalvo, Usuario  # Modelos do SQLAlchemy
-from pricing import CUBA_VALORES_PADRAO, calcular_valor_item
+from pricing import CUBA_VALORES_PADRAO, RegrasPrecificacao
+from blobs import ArmazemBlobs
+from pdf_render import FilaPdfCheia, PoolPdf, renderizar_pdf
 
 # 📌 Importa Configuração Externa
 from config import Config
@@ -118,26 +139,231 @@ def enviar_whatsapp_orcamento(telefone_cliente, codigo_orcamento, nome_cliente='
         print(f'[WhatsApp] Erro ao enviar: {e}')
         return False
 
-def _get_weasyprint_html():
-    try:
-        from weasyprint import HTML
-        return HTML
-    except OSError as exc:
-        raise RuntimeError(
-            "WeasyPrint precisa das bibliotecas nativas GTK/Pango instaladas para gerar PDF no Windows."
-        ) from exc
-
-
-def _resposta_pdf(pdf_bytes, filename):
+def _resposta_pdf(pdf_bytes, filename, etag=None):
     response = make_response(pdf_bytes)
     response.headers["Content-Type"] = "application/pdf"
     response.headers["Content-Disposition"] = f"inline; filename={filename}"
+    if etag:
+        # O navegador revalida a cada acesso e recebe 304 enquanto o PDF não mudar
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.set_etag(etag)
+        return response.make_conditional(request)
     response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
     return response
 
 
+# Aumentar quando a geração do PDF mudar fora do template
+PDF_CACHE_VERSAO = 2
+# Template só de impressão, com o CSS embutido: o PDF não busca nenhum arquivo externo
+PDF_TEMPLATE = "pdf_orcamento.html"
+PDF_ESTILO = "partials/pdf_orcamento.css"
+PDF_CACHE_DIR = Config.PDF_CACHE_DIR
+PDF_CACHE_MAX_BYTES = Config.PDF_CACHE_MAX_MB * 1024 * 1024
+pool_pdf = PoolPdf(processos=Config.PDF_WORKERS, fila_max=Config.PDF_FILA_MAX)
+armazem_blobs = ArmazemBlobs(Config.BLOB_DIR)
+MIME_TEXTO_BLOB = "text/html; charset=utf-8"
+
+# Formatos de imagem aceitos nos desenhos e servidos em /desenhos/<sha>; SVG e o resto não
+MIMES_IMAGEM_DESENHO = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+class DesenhoIndisponivel(LookupError):
+    """O banco referencia um desenho cujo blob não está no armazém."""
+
+
+def mime_imagem_desenho(dados):
+    """Mime do PNG, JPEG ou WebP identificado pelos bytes, ou None para qualquer outro conteúdo."""
+    try:
+        with Image.open(io.BytesIO(dados)) as imagem:
+            return MIMES_IMAGEM_DESENHO.get(imagem.format)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+def imagem_data_uri(valor):
+    """(bytes, mime) de um data URI base64 de PNG, JPEG ou WebP; None para qualquer outro texto.
+
+    O mime sai dos bytes decodificados, não do cabeçalho do data URI.
+    """
+    cabecalho, separador, conteudo = (valor or "").partition(",")
+    cabecalho = cabecalho.lower()
+    if not (separador and cabecalho.startswith("data:image/") and cabecalho.endswith(";base64")):
+        return None
+    try:
+        dados = base64.b64decode("".join(conteudo.split()), validate=True)
+    except ValueError:
+        return None
+    mime = mime_imagem_desenho(dados)
+    return (dados, mime) if mime else None
+
+def guardar_texto_blob(valor):
+    """Grava o texto no armazém de blobs e devolve (hash, mime, tamanho).
+
+    Imagens PNG, JPEG e WebP em data URI são gravadas já decodificadas, com o mime
+    conferido pelo Pillow; o resto vai como texto UTF-8 (MIME_TEXTO_BLOB).
+    """
+    imagem = imagem_data_uri(valor)
+    if imagem:
+        dados, mime = imagem
+    else:
+        mime, dados = MIME_TEXTO_BLOB, valor.encode("utf-8")
+    return armazem_blobs.gravar(dados), mime, len(dados)
+
+def ler_texto_blob(sha, mime):
+    try:
+        dados = armazem_blobs.ler(sha)
+    except OSError as exc:
+        print(f"[Blobs] Blob {sha} indisponível: {exc}")
+        raise DesenhoIndisponivel(sha) from exc
+    if mime == MIME_TEXTO_BLOB:
+        return dados.decode("utf-8")
+    return f"data:{mime};base64,{base64.b64encode(dados).decode('ascii')}"
+
+def _texto_em_blob(coluna, prefixo):
+    """Atributo de texto guardado no armazém de blobs, com hash, mime e tamanho em <prefixo>_*.
+
+    Linhas ainda não migradas continuam lendo o texto da coluna antiga.
+    """
+    carregado = f"_{prefixo}_carregado"
+
+    def ler(self):
+        sha = getattr(self, f"{prefixo}_hash")
+        if not sha:
+            return getattr(self, coluna)
+        cache = getattr(self, carregado, None)
+        if cache is None or cache[0] != sha:
+            cache = (sha, ler_texto_blob(sha, getattr(self, f"{prefixo}_mime")))
+            setattr(self, carregado, cache)
+        return cache[1]
+
+    def gravar(self, valor):
+        sha = mime = tamanho = None
+        if valor:
+            sha, mime, tamanho = guardar_texto_blob(valor)
+            setattr(self, carregado, (sha, valor))
+            valor = ""
+        setattr(self, f"{prefixo}_hash", sha)
+        setattr(self, f"{prefixo}_mime", mime)
+        setattr(self, f"{prefixo}_tamanho", tamanho)
+        setattr(self, coluna, valor)
+
+    return property(ler, gravar)
+
+def _assinatura_arquivo(caminho):
+    try:
+        info = os.stat(caminho)
+    except OSError:
+        return None
+    return [info.st_mtime_ns, info.st_size]
+
+def _dados_item_pdf(orcamento):
+    dados = {coluna.name: getattr(orcamento, coluna.name) for coluna in Orcamento.__table__.columns}
+    cliente = orcamento.cliente
+    material = orcamento.material
+    dados.update({
+        "ambiente": orcamento.ambiente.nome if orcamento.ambiente else None,
+        "descricao": orcamento.descricao.nome if orcamento.descricao else None,
+        "produto": orcamento.produto.nome if orcamento.produto else None,
+        "material": [material.nome, material.valor] if material else None,
+        "cliente": [cliente.nome, cliente.endereco, cliente.telefone] if cliente else None,
+    })
+    return dados
+
+def chave_pdf_orcamento(orcamento_salvo, orcamentos, template, **extras):
+    """Hash de tudo que aparece no PDF: itens, rodapé, pagamentos e identidade da empresa."""
+    conteudo = {
+        "versao": PDF_CACHE_VERSAO,
+        "template": [
+            _assinatura_arquivo(os.path.join(app.root_path, "templates", nome)) for nome in (template, PDF_ESTILO)
+        ],
+        "empresa": config_empresa_snapshot().versao,
+        "orcamento": {
+            campo: getattr(orcamento_salvo, campo)
+            for campo in (
+                "codigo", "data_salvo", "prazo_entrega", "desconto_avista", "desconto_parcelado",
+                "observacoes", "max_parcelas", "valor_minimo_parcela", "pagamentos_config_json",
+                "ordem_linhas_json",
+            )
+        },
+        "itens": [_dados_item_pdf(orcamento) for orcamento in orcamentos],
+        **extras,
+    }
+    serializado = json.dumps(conteudo, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(serializado.encode("utf-8")).hexdigest()
+
+def _caminho_pdf_cache(codigo, chave):
+    return os.path.join(PDF_CACHE_DIR, f"{secure_filename(codigo)}-{chave}.pdf")
+
+def pdf_em_cache(codigo, chave):
+    return os.path.exists(_caminho_pdf_cache(codigo, chave))
+
+def ler_pdf_cache(codigo, chave):
+    caminho = _caminho_pdf_cache(codigo, chave)
+    try:
+        with open(caminho, "rb") as arquivo:
+            pdf_bytes = arquivo.read()
+    except OSError:
+        return None
+    try:
+        # mtime marca o último uso, usado na remoção LRU
+        os.utime(caminho, None)
+    except OSError:
+        pass
+    return pdf_bytes
+
+def gravar_pdf_cache(codigo, chave, pdf_bytes):
+    caminho = _caminho_pdf_cache(codigo, chave)
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        with open(temporario, "wb") as arquivo:
+            arquivo.write(pdf_bytes)
+        os.replace(temporario, caminho)
+    except OSError as exc:
+        print(f"[PDF cache] Falha ao gravar {caminho}: {exc}")
+        if os.path.exists(temporario):
+            os.unlink(temporario)
+        return
+    _limitar_pdf_cache()
+
+def _limitar_pdf_cache():
+    arquivos = []
+    total = 0
+    try:
+        with os.scandir(PDF_CACHE_DIR) as entradas:
+            for entrada in entradas:
+                if not entrada.name.endswith(".pdf"):
+                    continue
+                try:
+                    info = entrada.stat()
+                except OSError:
+                    continue
+                arquivos.append((info.st_mtime, info.st_size, entrada.path))
+                total += info.st_size
+    except OSError:
+        return
+    for _, tamanho, caminho in sorted(arquivos):
+        if total <= PDF_CACHE_MAX_BYTES:
+            break
+        try:
+            os.unlink(caminho)
+        except OSError:
+            continue
+        total -= tamanho
+
+def invalidar_pdf_orcamento(*codigos):
+    for codigo in codigos:
+        if not codigo:
+            continue
+        padrao = os.path.join(PDF_CACHE_DIR, f"{glob.escape(secure_filename(codigo))}-*.pdf")
+        for caminho in glob.glob(padrao):
+            try:
+                os.unlink(caminho)
+            except OSError:
+                pass
+
+
 def _hex_para_rgb01(cor_hex):
     cor = (cor_hex or "#4e73df").strip().lstrip("#")
     if len(cor) != 6:
@@ -395,106 +621,11 @@ def _criar_pdf_orcamento_fallback(
     doc.close()
     return pdf_bytes
 
-def _localizar_navegador_pdf():
-    candidatos = [
-        os.path.join(os.environ.get("PROGRAMFILES", ""), "Google", "Chrome", "Application", "chrome.exe"),
-        os.path.join(os.environ.get("PROGRAMFILES(X86)", ""), "Google", "Chrome", "Application", "chrome.exe"),
-        os.path.join(os.environ.get("LOCALAPPDATA", ""), "Google", "Chrome", "Application", "chrome.exe"),
-        os.path.join(os.environ.get("PROGRAMFILES", ""), "Microsoft", "Edge", "Application", "msedge.exe"),
-        os.path.join(os.environ.get("PROGRAMFILES(X86)", ""), "Microsoft", "Edge", "Application", "msedge.exe"),
-    ]
-    for caminho in candidatos:
-        if caminho and os.path.exists(caminho):
-            return caminho
-    return None
-
-def _absolutizar_assets_html(html, base_url):
-    static_url = "file:///" + os.path.join(PROJECT_DIR, "static").replace("\\", "/") + "/"
-    html = (
-        html
-        .replace('href="/static/', f'href="{static_url}')
-        .replace("href='/static/", f"href='{static_url}")
-        .replace('src="/static/', f'src="{static_url}')
-        .replace("src='/static/", f"src='{static_url}")
-    )
-    base = (base_url or "").rstrip("/")
-    if not base:
-        return html
-    return (
-        html
-        .replace('href="/static/', f'href="{base}/static/')
-        .replace("href='/static/", f"href='{base}/static/")
-        .replace('src="/static/', f'src="{base}/static/')
-        .replace("src='/static/", f"src='{base}/static/")
-    )
-
-def _gerar_pdf_html_com_chrome(rendered_html, base_url):
-    navegador = _localizar_navegador_pdf()
-    if not navegador:
-        raise RuntimeError("Chrome/Edge não encontrado para gerar PDF.")
-
-    import tempfile
-    html = _absolutizar_assets_html(rendered_html, base_url)
-    temp_html_path = None
-    temp_pdf_path = None
-    user_data_dir = None
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".html", mode="w", encoding="utf-8") as temp_html:
-            temp_html.write(html)
-            temp_html_path = temp_html.name
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
-            temp_pdf_path = temp_pdf.name
-
-        user_data_dir = tempfile.mkdtemp(prefix="chrome-pdf-")
-        file_url = "file:///" + temp_html_path.replace("\\", "/")
-        comando = [
-            navegador,
-            "--headless=new",
-            "--disable-gpu",
-            "--disable-software-rasterizer",
-            "--disable-dev-shm-usage",
-            "--disable-background-networking",
-            "--disable-background-timer-throttling",
-            "--disable-client-side-phishing-detection",
-            "--disable-extensions",
-            "--disable-sync",
-            "--metrics-recording-only",
-            "--no-sandbox",
-            "--disable-setuid-sandbox",
-            "--no-first-run",
-            "--no-default-browser-check",
-            "--disable-features=UseSkiaRenderer,VizDisplayCompositor,CanvasOopRasterization",
-            f"--user-data-dir={user_data_dir}",
-            "--print-to-pdf-no-header",
-            f"--print-to-pdf={temp_pdf_path}",
-            file_url,
-        ]
-        resultado = subprocess.run(comando, capture_output=True, text=True, timeout=60)
-        if resultado.returncode != 0:
-            raise RuntimeError((resultado.stderr or resultado.stdout or "Falha ao gerar PDF com Chrome.").strip())
-        with open(temp_pdf_path, "rb") as pdf_file:
-            pdf_bytes = pdf_file.read()
-        if not pdf_bytes.startswith(b"%PDF-"):
-            raise RuntimeError("Chrome não retornou um PDF válido.")
-        return pdf_bytes
-    finally:
-        for caminho in (temp_html_path, temp_pdf_path):
-            if caminho and os.path.exists(caminho):
-                try:
-                    os.unlink(caminho)
-                except OSError:
-                    pass
-        if user_data_dir and os.path.exists(user_data_dir):
-            try:
-                import shutil
-                shutil.rmtree(user_data_dir, ignore_errors=True)
-            except Exception:
-                pass
-
 # ðŸ“Œ Inicializa o Flask
 app = Flask(__name__)
 app.config.from_object(Config)  # Aplica configurações do config.py
+if Config.PROXIES_CONFIAVEIS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.PROXIES_CONFIAVEIS, x_proto=Config.PROXIES_CONFIAVEIS)
 
 # ðŸ“Œ Inicializa o Banco de Dados
 db = SQLAlchemy(app)
@@ -511,6 +642,7 @@ def dados_usuario_layout():
         "empresa_config": config_empresa,
         "empresa_nome": empresa_nome,
         "empresa_logo_url": empresa_logo_url(),
+        "empresa_logo_cabecalho_url": empresa_logo_url(tamanho="cabecalho"),
         "acessorios_texto": acessorios_texto,
         "acessorios_do_orcamento": acessorios_do_orcamento,
         "acabamentos_texto": acabamentos_texto,
@@ -521,6 +653,7 @@ def dados_usuario_layout():
         "texto_saia_produto": texto_saia_produto,
         "texto_fronte_produto": texto_fronte_produto,
         "texto_cuba_produto": texto_cuba_produto,
+        "url_com_parametros": url_com_parametros,
     }
     cpf = session.get('user_cpf')
     if not cpf:
@@ -530,9 +663,16 @@ def dados_usuario_layout():
     dados_layout["usuario_display_nome"] = usuario.nome if usuario and usuario.nome else cpf
     return dados_layout
 
+def url_com_parametros(**alteracoes):
+    """URL da página atual mantendo a query string e trocando os parâmetros informados."""
+    parametros = request.args.to_dict()
+    parametros.update(alteracoes)
+    return url_for(request.endpoint, **(request.view_args or {}), **parametros)
+
 @app.after_request
 def injetar_ordenacao_tabelas(response):
-    if request.endpoint in {"detalhes_orcamento_salvo", "detalhes_orcamento", "gerar_pdf_orcamento"}:
+    # gerar_pdf_orcamento define os próprios cabeçalhos em _resposta_pdf (ETag do cache de PDF)
+    if request.endpoint in {"detalhes_orcamento_salvo", "detalhes_orcamento"}:
         response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
         response.headers["Pragma"] = "no-cache"
         response.headers["Expires"] = "0"
@@ -575,9 +715,9 @@ def atualizar_valor_orcamento_salvo(orcamento_salvo_id):
     """Recalcula o valor total de um orçamento salvo."""
     orcamento_salvo = OrcamentoSalvo.query.get(orcamento_salvo_id)
 
-    if orcamento_salvo and orcamento_salvo.orcamentos_ids:
-        # Obtém os IDs dos orçamentos vinculados, garantindo que sejam válidos
-        orcamentos_ids = [id.strip() for id in orcamento_salvo.orcamentos_ids.split(',') if id.strip().isdigit()]
+    if orcamento_salvo:
+        # Obtém os IDs dos orçamentos vinculados
+        orcamentos_ids = orcamento_salvo.ids_itens
 
         if orcamentos_ids:
             # Busca os orçamentos no banco de dados
@@ -590,24 +730,128 @@ def atualizar_valor_orcamento_salvo(orcamento_salvo_id):
             orcamento_salvo.valor_total = valor_total
             db.session.commit()
 
+def atualizar_valores_orcamentos_salvos(orcamento_ids):
+    """Recalcula num único UPDATE o valor total dos orçamentos salvos que contêm os itens.
+
+    O UPDATE não passa pelo before_flush, então o resumo mensal de vendas é
+    ajustado aqui com os valores de antes e depois. Devolve os códigos afetados.
+    """
+    ids = [int(item_id) for item_id in orcamento_ids]
+    if not ids:
+        return []
+    db.session.flush()
+    tabela = OrcamentoSalvo.__table__
+    afetados = tabela.c.id.in_(
+        db.select(OrcamentoSalvoItem.orcamento_salvo_id).where(OrcamentoSalvoItem.orcamento_id.in_(ids))
+    )
+    campos = [tabela.c[campo] for campo in CAMPOS_RESUMO_VENDAS]
+    conexao = db.session.connection()
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for linha in conexao.execute(db.select(*campos).where(afetados)):
+        _somar_resumo_vendas(deltas, linha._mapping, -1)
+
+    soma_itens = (
+        db.select(db.func.coalesce(db.func.sum(Orcamento.valor_total), 0))
+        .select_from(OrcamentoSalvoItem)
+        .join(Orcamento, Orcamento.id == OrcamentoSalvoItem.orcamento_id)
+        .where(OrcamentoSalvoItem.orcamento_salvo_id == tabela.c.id)
+        .scalar_subquery()
+    )
+    conexao.execute(tabela.update().where(afetados).values(valor_total=soma_itens))
+
+    codigos = []
+    for linha in conexao.execute(db.select(tabela.c.codigo, *campos).where(afetados)):
+        _somar_resumo_vendas(deltas, linha._mapping, 1)
+        codigos.append(linha.codigo)
+    _aplicar_resumo_vendas(conexao, deltas)
+    return codigos
+
 @app.route("/upload_db", methods=["POST"])
 def upload_db():
-    """Endpoint para upload do banco de dados SQLite para o volume persistente no Render."""
+    """Endpoint para upload do banco de dados SQLite para o volume persistente no Render.
+
+    Aceita o .zip gerado em /download_db (banco e desenhos) ou só o orcamentos.db;
+    recusa o banco se ele referenciar desenhos que não vieram no zip nem estão no servidor.
+    """
     file = request.files.get('file')
-    if file and file.filename == 'orcamentos.db':
-        file.save(Config.DATABASE_PATH)
-        return jsonify({"mensagem": "Banco de dados enviado com sucesso!"}), 200
-    return jsonify({"erro": "Arquivo inválido!"}), 400
+    nome = (file.filename or '').lower() if file else ''
+    if nome != 'orcamentos.db' and not nome.endswith('.zip'):
+        return jsonify({"erro": "Arquivo inválido!"}), 400
+
+    # Pasta temporária ao lado do banco, para a troca no fim ser um rename atômico
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(Config.DATABASE_PATH) or None) as pasta:
+        novo = os.path.join(pasta, 'orcamentos.db')
+        restaurados = 0
+        try:
+            if nome.endswith('.zip'):
+                with zipfile.ZipFile(file.stream) as backup:
+                    if 'orcamentos.db' not in backup.namelist():
+                        return jsonify({"erro": "O zip não contém o orcamentos.db."}), 400
+                    with backup.open('orcamentos.db') as origem, open(novo, 'wb') as destino:
+                        shutil.copyfileobj(origem, destino)
+                    for item in backup.namelist():
+                        partes = item.split('/')
+                        if len(partes) != 3 or partes[0] != 'blobs' or not partes[2]:
+                            continue
+                        try:
+                            armazem_blobs.importar(partes[2], backup.read(item))
+                            restaurados += 1
+                        except ValueError as exc:
+                            print(f"[Backup] Desenho ignorado: {exc}")
+            else:
+                file.save(novo)
+            referenciados = _hashes_desenhos_do_arquivo(novo)
+        except (zipfile.BadZipFile, sqlite3.DatabaseError):
+            return jsonify({"erro": "Arquivo inválido!"}), 400
+
+        faltando = [sha for sha in referenciados if not armazem_blobs.existe(sha)]
+        if faltando:
+            return jsonify({
+                "erro": f"O banco referencia {len(faltando)} desenhos que não vieram no arquivo nem estão "
+                        "no servidor. Envie o .zip gerado em /download_db.",
+            }), 400
+
+        os.replace(novo, Config.DATABASE_PATH)
+    # Conexões abertas ainda apontam para o arquivo antigo
+    db.engine.dispose()
+    return jsonify({"mensagem": f"Banco de dados enviado com sucesso! {restaurados} desenhos restaurados."}), 200
 
 @app.route("/download_db")
 def download_db():
+    """Backup em .zip com uma cópia consistente do banco e os desenhos que ele referencia."""
     if not session.get('admin'):
         flash("Acesso restrito a administradores.", "error")
         return redirect(url_for('login'))
-    import os
-    if os.path.exists(Config.DATABASE_PATH):
-        return send_file(Config.DATABASE_PATH, as_attachment=True, download_name='orcamentos.db')
-    return jsonify({"erro": "Banco de dados não encontrado!"}), 404
+    if not os.path.exists(Config.DATABASE_PATH):
+        return jsonify({"erro": "Banco de dados não encontrado!"}), 404
+
+    arquivo = tempfile.TemporaryFile()
+    faltando = []
+    with tempfile.TemporaryDirectory() as pasta:
+        copia = os.path.join(pasta, 'orcamentos.db')
+        # A API de backup do SQLite copia o banco mesmo com o app gravando nele
+        origem = sqlite3.connect(Config.DATABASE_PATH)
+        destino = sqlite3.connect(copia)
+        try:
+            origem.backup(destino)
+        finally:
+            destino.close()
+            origem.close()
+        with zipfile.ZipFile(arquivo, 'w') as backup:
+            backup.write(copia, 'orcamentos.db', compress_type=zipfile.ZIP_DEFLATED)
+            # Os blobs já vêm comprimidos do armazém e entram no formato em que estão no disco
+            for sha in sorted(_hashes_desenhos_do_arquivo(copia)):
+                try:
+                    backup.write(armazem_blobs.caminho(sha), f"blobs/{sha[:2]}/{sha}")
+                except (OSError, ValueError):
+                    faltando.append(sha)
+            if faltando:
+                backup.writestr('blobs_faltando.txt', "\n".join(faltando) + "\n")
+    if faltando:
+        print(f"[Backup] {len(faltando)} desenhos referenciados não estão em {Config.BLOB_DIR}")
+    arquivo.seek(0)
+    nome_arquivo = f"orcamentos_{datetime.now(br_tz):%Y%m%d_%H%M}.zip"
+    return send_file(arquivo, mimetype='application/zip', as_attachment=True, download_name=nome_arquivo)
 
 br_tz = timezone('America/Sao_Paulo')
 
@@ -702,8 +946,105 @@ def obter_config_empresa():
         return None
 
 
-def empresa_config_dict():
-    config = obter_config_empresa()
+ConfigEmpresaSnapshot = namedtuple(
+    "ConfigEmpresaSnapshot",
+    [
+        "versao",
+        "dados",
+        "logo",
+        "logo_filename",
+        "cuba_valores",
+        "acessorios_valores",
+        "acabamentos_valores",
+        "tipos_cliente",
+        "formas_pagamento",
+        "precificacao",
+        "regras_precificacao",
+    ],
+)
+
+# Snapshot da configuração da empresa compartilhado pelo processo. É trocado
+# inteiro quando o config_versao gravado no banco muda (POST em /configuracoes),
+# o que também invalida os outros workers do gunicorn.
+_config_empresa_snapshot = None
+
+
+def _versao_config_empresa():
+    try:
+        return db.session.query(EmpresaConfig.config_versao).order_by(EmpresaConfig.id).limit(1).scalar()
+    except Exception:
+        db.session.rollback()
+        return None
+
+
+def _montar_snapshot_config_empresa(config):
+    dados = _config_empresa_dict_da_config(config)
+    cuba_valores = _cuba_valores_da_config(config)
+    precificacao = _opcoes_precificacao_dos_dados(dados, dict(cuba_valores))
+    return ConfigEmpresaSnapshot(
+        versao=getattr(config, "config_versao", None) if config else None,
+        dados=MappingProxyType(dados),
+        logo=_logo_da_config(config),
+        logo_filename=(config.logo_filename if config else '') or '',
+        cuba_valores=MappingProxyType(cuba_valores),
+        acessorios_valores=MappingProxyType(_acessorios_valores_da_config(config)),
+        acabamentos_valores=MappingProxyType(_acabamentos_valores_da_config(config)),
+        tipos_cliente=tuple(_lista_config_json(config, "vendas_tipos_cliente_json", CATEGORIAS_VENDAS_PADRAO["tipos_cliente"])),
+        formas_pagamento=tuple(_lista_config_json(config, "vendas_formas_pagamento_json", CATEGORIAS_VENDAS_PADRAO["formas_pagamento"])),
+        precificacao=MappingProxyType(precificacao),
+        regras_precificacao=RegrasPrecificacao(**precificacao),
+    )
+
+
+def config_empresa_snapshot():
+    """Configuração da empresa já interpretada, lida uma vez por requisição."""
+    global _config_empresa_snapshot
+    # Na requisição o snapshot fica em g; fora dela só quando fixado por config_empresa_fixa()
+    if has_app_context():
+        snapshot = g.get("config_empresa_snapshot")
+        if snapshot is not None:
+            return snapshot
+
+    versao = _versao_config_empresa()
+    snapshot = _config_empresa_snapshot
+    if snapshot is None or versao is None or snapshot.versao != versao:
+        snapshot = _montar_snapshot_config_empresa(obter_config_empresa())
+        if snapshot.versao is not None:
+            _config_empresa_snapshot = snapshot
+
+    if has_request_context():
+        g.config_empresa_snapshot = snapshot
+    return snapshot
+
+
+def marcar_config_empresa_alterada(config):
+    """Incrementa a versão da configuração; deve ser chamado antes do commit."""
+    global _config_empresa_snapshot
+    config.config_versao = (config.config_versao or 0) + 1
+    _config_empresa_snapshot = None
+    if has_app_context():
+        g.pop("config_empresa_snapshot", None)
+
+
+@contextmanager
+def config_empresa_fixa():
+    """Lê a configuração da empresa uma vez e a mantém até o fim do bloco.
+
+    Fora de requisição cada config_empresa_snapshot() consulta o config_versao;
+    os jobs em segundo plano usam isto para ler a configuração uma vez por lote.
+    """
+    anterior = g.pop("config_empresa_snapshot", None)
+    snapshot = config_empresa_snapshot()
+    g.config_empresa_snapshot = snapshot
+    try:
+        yield snapshot
+    finally:
+        g.pop("config_empresa_snapshot", None)
+        if anterior is not None:
+            g.config_empresa_snapshot = anterior
+
+
+def _config_empresa_dict_da_config(config):
     dados = _config_empresa_fallback()
     if config:
         for chave in dados:
@@ -712,34 +1053,110 @@ def empresa_config_dict():
     return dados
 
 
-def empresa_logo_url(config=None):
-    config = config or obter_config_empresa()
-    if config and getattr(config, 'logo_data', None):
-        mime = getattr(config, 'logo_mime', None) or 'image/png'
-        return f"data:{mime};base64,{config.logo_data}"
-    return 'data:image/svg+xml,%3Csvg xmlns="http://www.w3.org/2000/svg" width="1" height="1"%3E%3C/svg%3E'
+def empresa_config_dict():
+    return dict(config_empresa_snapshot().dados)
+
+
+# Logo decodificado uma vez por versão da configuração; hash vazio quando não há logo
+LogoEmpresa = namedtuple("LogoEmpresa", ["hash", "mime", "dados"])
+LOGO_VAZIO = LogoEmpresa("", "", b"")
+LOGO_VAZIO_URL = 'data:image/svg+xml,%3Csvg xmlns="http://www.w3.org/2000/svg" width="1" height="1"%3E%3C/svg%3E'
+# Lado menor de cada versão reduzida servida em /logo/<hash>/<tamanho>
+TAMANHOS_LOGO = {"cabecalho": Config.LOGO_CABECALHO_PX, "pdf": Config.LOGO_PDF_PX}
+_variantes_logo = {}  # (hash, tamanho) -> (bytes, mime)
+_variantes_logo_lock = threading.Lock()
+
+
+def _logo_da_config(config):
+    if not config or not getattr(config, 'logo_data', None):
+        return LOGO_VAZIO
+    try:
+        dados = base64.b64decode(config.logo_data)
+    except (ValueError, TypeError):
+        return LOGO_VAZIO
+    mime = getattr(config, 'logo_mime', None) or 'image/png'
+    return LogoEmpresa(hashlib.sha256(dados).hexdigest(), mime, dados)
+
+
+def logo_empresa(config=None):
+    if config is None:
+        return config_empresa_snapshot().logo
+    return _logo_da_config(config)
+
+
+def _reduzir_logo(logo, lado):
+    """Bytes e mime do logo com o lado menor limitado a `lado`; o original se já for menor ou não abrir."""
+    try:
+        with Image.open(io.BytesIO(logo.dados)) as imagem:
+            formato = imagem.format
+            escala = lado / min(imagem.size)
+            if escala >= 1:
+                return logo.dados, logo.mime
+            imagem = imagem.resize(
+                (max(1, round(imagem.width * escala)), max(1, round(imagem.height * escala))),
+                Image.Resampling.LANCZOS,
+                reducing_gap=3.0,
+            )
+            saida = io.BytesIO()
+            if formato == "JPEG":
+                imagem.convert("RGB").save(saida, "JPEG", quality=88, optimize=True)
+                return saida.getvalue(), "image/jpeg"
+            if formato == "WEBP":
+                imagem.save(saida, "WEBP", quality=88, method=4)
+                return saida.getvalue(), "image/webp"
+            if imagem.mode not in ("RGB", "RGBA", "L", "LA"):
+                imagem = imagem.convert("RGBA")
+            imagem.save(saida, "PNG", optimize=True)
+            return saida.getvalue(), "image/png"
+    except (OSError, ValueError, ZeroDivisionError, Image.DecompressionBombError) as exc:
+        print(f"[Logo] Versão de {lado}px não gerada: {exc}")
+        return logo.dados, logo.mime
+
+
+def variante_logo(logo, tamanho=None):
+    """Bytes e mime do logo no tamanho pedido, reduzidos uma vez por processo."""
+    if not tamanho:
+        return logo.dados, logo.mime
+    chave = (logo.hash, tamanho)
+    variante = _variantes_logo.get(chave)
+    if variante is None:
+        variante = _reduzir_logo(logo, TAMANHOS_LOGO[tamanho])
+        with _variantes_logo_lock:
+            # Só as versões do logo atual interessam; as de logos trocados saem daqui
+            for antiga in [c for c in _variantes_logo if c[0] != logo.hash]:
+                del _variantes_logo[antiga]
+            _variantes_logo[chave] = variante
+    return variante
+
+
+def empresa_logo_url(config=None, tamanho=None):
+    """URL do logo pelo hash do conteúdo, que o navegador guarda em cache até o logo mudar."""
+    logo = logo_empresa(config)
+    if not logo.hash:
+        return LOGO_VAZIO_URL
+    return url_for('logo_empresa_arquivo', sha=logo.hash, tamanho=tamanho)
 
 
 def empresa_logo_path(config=None):
-    config = config or obter_config_empresa()
-    if config and config.logo_filename:
-        caminho = os.path.join(UPLOADS_DIR, config.logo_filename)
+    logo_filename = config.logo_filename if config is not None else config_empresa_snapshot().logo_filename
+    if logo_filename:
+        caminho = os.path.join(UPLOADS_DIR, logo_filename)
         if os.path.exists(caminho):
             return caminho
     return ''
 
 
-def empresa_logo_data_uri(config=None):
-    config = config or obter_config_empresa()
-    if config and getattr(config, 'logo_data', None):
-        mime = getattr(config, 'logo_mime', None) or 'image/png'
-        return f"data:{mime};base64,{config.logo_data}"
-    return empresa_logo_url(config)
+def empresa_logo_data_uri(config=None, tamanho="pdf"):
+    """Logo embutido em data URI, para o HTML do PDF, que não busca arquivos externos."""
+    logo = logo_empresa(config)
+    if not logo.hash:
+        return LOGO_VAZIO_URL
+    dados, mime = variante_logo(logo, tamanho)
+    return f"data:{mime};base64,{base64.b64encode(dados).decode('ascii')}"
 
 
-def empresa_cuba_valores(config=None):
+def _cuba_valores_da_config(config):
     valores = dict(CUBA_VALORES_PADRAO)
-    config = config or obter_config_empresa()
     if config and config.cuba_valores_json:
         try:
             salvos = json.loads(config.cuba_valores_json)
@@ -750,6 +1167,12 @@ def empresa_cuba_valores(config=None):
     return valores
 
 
+def empresa_cuba_valores(config=None):
+    if config is None:
+        return dict(config_empresa_snapshot().cuba_valores)
+    return _cuba_valores_da_config(config)
+
+
 ACESSORIOS_VALORES_PADRAO = {
     "Cooktop": 50,
     "Lixeira": 0,
@@ -765,9 +1188,8 @@ ACABAMENTOS_VALORES_PADRAO = {
 }
 
 
-def empresa_acessorios_valores(config=None):
+def _acessorios_valores_da_config(config):
     valores = dict(ACESSORIOS_VALORES_PADRAO)
-    config = config or obter_config_empresa()
     if config and getattr(config, "acessorios_valores_json", None):
         try:
             salvos = json.loads(config.acessorios_valores_json)
@@ -780,9 +1202,14 @@ def empresa_acessorios_valores(config=None):
     return valores
 
 
-def empresa_acabamentos_valores(config=None):
+def empresa_acessorios_valores(config=None):
+    if config is None:
+        return dict(config_empresa_snapshot().acessorios_valores)
+    return _acessorios_valores_da_config(config)
+
+
+def _acabamentos_valores_da_config(config):
     valores = dict(ACABAMENTOS_VALORES_PADRAO)
-    config = config or obter_config_empresa()
     if config and getattr(config, "acabamentos_valores_json", None):
         try:
             salvos = json.loads(config.acabamentos_valores_json)
@@ -793,6 +1220,12 @@ def empresa_acabamentos_valores(config=None):
     return valores
 
 
+def empresa_acabamentos_valores(config=None):
+    if config is None:
+        return dict(config_empresa_snapshot().acabamentos_valores)
+    return _acabamentos_valores_da_config(config)
+
+
 def _normalizar_lista_texto(valores, padrao):
     lista = []
     for valor in valores or []:
@@ -814,12 +1247,14 @@ def _lista_config_json(config, atributo, padrao):
 
 
 def empresa_tipos_cliente(config=None):
-    config = config or obter_config_empresa()
+    if config is None:
+        return list(config_empresa_snapshot().tipos_cliente)
     return _lista_config_json(config, "vendas_tipos_cliente_json", CATEGORIAS_VENDAS_PADRAO["tipos_cliente"])
 
 
 def empresa_formas_pagamento_vendas(config=None):
-    config = config or obter_config_empresa()
+    if config is None:
+        return list(config_empresa_snapshot().formas_pagamento)
     return _lista_config_json(config, "vendas_formas_pagamento_json", CATEGORIAS_VENDAS_PADRAO["formas_pagamento"])
 
 
@@ -939,6 +1374,39 @@ def normalizar_saia_fronte(
     return itens
 
 
+# Campos do Orcamento lidos por acessorios/cubas/acabamentos/saia_fronte_do_orcamento
+CAMPOS_LISTAS_ITEM = (
+    "acessorios_json", "tem_cooktop", "cubas_json", "tipo_cuba", "quantidade_cubas", "modelo_cuba",
+    "comprimento_cuba", "largura_cuba", "profundidade_cuba", "acabamentos_json", "saia_fronte_json",
+    "tipo_produto", "comprimento_saia", "largura_saia", "comprimento_fronte", "largura_fronte",
+)
+
+
+def _lista_do_item_em_cache(depende_da_config=False):
+    """Guarda na instância de Orcamento a lista já interpretada das colunas JSON.
+
+    A mesma lista é devolvida nas chamadas seguintes e não deve ser alterada.
+    Gravar um dos CAMPOS_LISTAS_ITEM ou expirar a instância descarta o cache;
+    as listas que usam valores padrão da empresa valem só para o config_versao.
+    """
+    def decorador(funcao):
+        @wraps(funcao)
+        def em_cache(orcamento):
+            if not isinstance(orcamento, Orcamento):
+                return funcao(orcamento)
+            versao = config_empresa_snapshot().versao if depende_da_config else None
+            cache = orcamento.__dict__.setdefault("_listas_item", {})
+            guardada = cache.get(funcao.__name__)
+            if guardada is not None and guardada[0] == versao:
+                return guardada[1]
+            lista = funcao(orcamento)
+            cache[funcao.__name__] = (versao, lista)
+            return lista
+        return em_cache
+    return decorador
+
+
+@_lista_do_item_em_cache(depende_da_config=True)
 def acessorios_do_orcamento(orcamento):
     if not orcamento:
         return []
@@ -957,6 +1425,7 @@ def acessorios_do_orcamento(orcamento):
     return []
 
 
+@_lista_do_item_em_cache()
 def cubas_do_orcamento(orcamento):
     if not orcamento:
         return []
@@ -987,6 +1456,7 @@ def cubas_do_orcamento(orcamento):
     )
 
 
+@_lista_do_item_em_cache(depende_da_config=True)
 def acabamentos_do_orcamento(orcamento):
     if not orcamento or not getattr(orcamento, "acabamentos_json", None):
         return []
@@ -1003,6 +1473,7 @@ def acabamentos_do_orcamento(orcamento):
     return []
 
 
+@_lista_do_item_em_cache()
 def saia_fronte_do_orcamento(orcamento):
     if not orcamento:
         return []
@@ -1110,6 +1581,34 @@ def saia_fronte_total_orcamento(orcamento, valor_material, opts=None):
     )
 
 
+CAMPOS_PRECIFICACAO_ORCAMENTO = (
+    "tipo_produto", "quantidade", "comprimento", "largura", "instalacao", "instalacao_valor", "rt",
+    "rt_percentual", "comprimento_saia", "largura_saia", "comprimento_fronte", "largura_fronte",
+    "tipo_cuba", "quantidade_cubas", "comprimento_cuba", "largura_cuba", "profundidade_cuba",
+    "modelo_cuba", "tem_cooktop", "profundidade_nicho", "tem_fundo", "tem_alisar", "largura_alisar",
+)
+
+
+def colunas_precificacao_orcamentos(orcamentos, valores_material, opts):
+    """Colunas de RegrasPrecificacao.calcular_lote para os itens informados, na mesma ordem."""
+    colunas = {
+        campo: [getattr(orcamento, campo) for orcamento in orcamentos]
+        for campo in CAMPOS_PRECIFICACAO_ORCAMENTO
+    }
+    colunas["valor_material"] = list(valores_material)
+    colunas["cubas_valor_total"] = [
+        cubas_total(cubas_do_orcamento(orcamento), valor_material, opts.get('cuba_valores'))
+        for orcamento, valor_material in zip(orcamentos, valores_material)
+    ]
+    colunas["acessorios_valor_total"] = [acessorios_total(acessorios_do_orcamento(orcamento)) for orcamento in orcamentos]
+    colunas["acabamentos_valor_total"] = [acabamentos_total(acabamentos_do_orcamento(orcamento)) for orcamento in orcamentos]
+    colunas["saia_fronte_valor_total"] = [
+        saia_fronte_total_orcamento(orcamento, valor_material, opts)
+        for orcamento, valor_material in zip(orcamentos, valores_material)
+    ]
+    return colunas
+
+
 def acessorios_texto(orcamento):
     nomes = [item.get("nome") for item in acessorios_do_orcamento(orcamento) if item.get("nome")]
     return ", ".join(nomes) if nomes else "-"
@@ -1232,10 +1731,21 @@ def texto_cuba_produto(produto):
 
 
 def opcoes_precificacao_empresa(config=None):
-    config = config or obter_config_empresa()
-    dados = empresa_config_dict()
+    if config is not None:
+        return _opcoes_precificacao_dos_dados(_config_empresa_dict_da_config(config), _cuba_valores_da_config(config))
+    opcoes = dict(config_empresa_snapshot().precificacao)
+    opcoes['cuba_valores'] = dict(opcoes['cuba_valores'])
+    return opcoes
+
+
+def regras_precificacao_empresa():
+    """Regras de preço compiladas junto com o snapshot, refeitas só quando o config_versao muda."""
+    return config_empresa_snapshot().regras_precificacao
+
+
+def _opcoes_precificacao_dos_dados(dados, cuba_valores):
     return {
-        'cuba_valores': empresa_cuba_valores(config),
+        'cuba_valores': cuba_valores,
         'cooktop_valor': float(dados.get('cooktop_valor') or 50),
         'nicho_mao_obra': float(dados.get('nicho_mao_obra') or 150),
         'nicho_sem_fundo_mao_obra': float(dados.get('nicho_sem_fundo_mao_obra') or 150),
@@ -1281,7 +1791,7 @@ class Cliente(db.Model):
     documento = db.Column(db.String(50), nullable=True)
     dono = db.Column(db.String(14), nullable=False)
 
-    __table_args__ = ()
+    __table_args__ = (db.Index('ix_cliente_dono_telefone', 'dono', 'telefone'),)
     
 class Material(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -1347,6 +1857,7 @@ class EmpresaConfig(db.Model):
     virada_margem = db.Column(db.Float, default=0, nullable=False)
     alisar_margem = db.Column(db.Float, default=0, nullable=False)
     cuba_valores_json = db.Column(db.Text, default='')
+    config_versao = db.Column(db.Integer, default=1, nullable=False)
 
 class Ambiente(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -1405,24 +1916,60 @@ class OrcamentoSalvo(db.Model):
     observacoes = db.Column(db.Text, default="Medidas sujeitas a confirmação no local. Valores válidos por 7 dias.", nullable=False)
     exclude_payments = db.Column(db.String(50), default='')
     desenhos_ordem_servico = db.relationship('DesenhoOrdemServico', backref='orcamento', lazy=True)
-    desenho_ordem_servico = db.Column(db.Text, nullable=True)
+    # O desenho editável fica no armazém de blobs; a coluna antiga guarda só o que não migrou
+    _desenho_ordem_servico = db.Column('desenho_ordem_servico', db.Text, nullable=True)
+    desenho_ordem_servico_hash = db.Column(db.String(64), nullable=True)
+    desenho_ordem_servico_mime = db.Column(db.String(100), nullable=True)
+    desenho_ordem_servico_tamanho = db.Column(db.Integer, nullable=True)
+    desenho_ordem_servico = _texto_em_blob('_desenho_ordem_servico', 'desenho_ordem_servico')
     max_parcelas = db.Column(db.Integer, nullable=True)
     valor_minimo_parcela = db.Column(db.Float, nullable=True)
     pagamentos_config_json = db.Column(db.Text, default='')
     ordem_linhas_json = db.Column(db.Text, default='')
+    cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'), nullable=True, index=True)
+    dono = db.Column(db.String(14), nullable=True, index=True)
+    itens = db.relationship(
+        'OrcamentoSalvoItem',
+        order_by='OrcamentoSalvoItem.posicao',
+        cascade='all, delete-orphan',
+        lazy=True,
+    )
 
-    @property
-    def cliente_nome(self):
-        if not self.orcamentos_ids:
-            return "Não definido"
+    # Relatório de vendas por status; o período dos fechados vem de data_fechamento
+    __table_args__ = (
+        db.Index('ix_orcamento_salvo_status_data_fechamento', 'status', 'data_fechamento'),
+    )
 
-        primeiro_orcamento_id = self.orcamentos_ids.split(",")[0].strip()
+    @property
+    def ids_itens(self):
+        return [item.orcamento_id for item in self.itens]
+
+    def definir_itens(self, ids):
+        """Atualiza a tabela de vínculo e mantém orcamentos_ids espelhado."""
+        ids = [int(item_id) for item_id in ids if str(item_id).strip().isdigit()]
+        self.orcamentos_ids = ','.join(map(str, ids))
+        self.itens = [
+            OrcamentoSalvoItem(orcamento_id=item_id, posicao=posicao)
+            for posicao, item_id in enumerate(ids)
+        ]
+        self.atualizar_cliente()
 
-        if not primeiro_orcamento_id.isdigit():
-            return "Não definido"
+    def atualizar_cliente(self):
+        """Copia cliente e dono do primeiro item, usados no filtro de visibilidade."""
+        cliente = None
+        for item_id in self.ids_itens:
+            orcamento = db.session.get(Orcamento, item_id)
+            if orcamento and orcamento.cliente_id:
+                cliente = db.session.get(Cliente, int(orcamento.cliente_id))
+                if cliente:
+                    break
+        self.cliente_id = cliente.id if cliente else None
+        self.dono = cliente.dono if cliente else None
 
-        primeiro_orcamento = Orcamento.query.get(int(primeiro_orcamento_id))
-        return primeiro_orcamento.cliente.nome if primeiro_orcamento else "Não definido"
+    @property
+    def cliente_nome(self):
+        cliente = db.session.get(Cliente, self.cliente_id) if self.cliente_id else None
+        return cliente.nome if cliente else "Não definido"
 
     def gerar_codigo(self):
         ultimo_codigo = db.session.query(db.func.max(OrcamentoSalvo.codigo)).scalar()
@@ -1432,6 +1979,38 @@ class OrcamentoSalvo(db.Model):
             novo_num = int(ultimo_codigo[1:]) + 1
         self.codigo = f"O{novo_num:06d}"
 
+class OrcamentoSalvoItem(db.Model):
+    __tablename__ = 'orcamento_salvo_item'
+
+    id = db.Column(db.Integer, primary_key=True)
+    orcamento_salvo_id = db.Column(
+        db.Integer, db.ForeignKey('orcamento_salvo.id', ondelete='CASCADE'), nullable=False, index=True
+    )
+    orcamento_id = db.Column(db.Integer, db.ForeignKey('orcamento.id', ondelete='CASCADE'), nullable=False, index=True)
+    posicao = db.Column(db.Integer, default=0, nullable=False)
+
+class VendasResumoMensal(db.Model):
+    __tablename__ = 'vendas_resumo_mensal'
+
+    id = db.Column(db.Integer, primary_key=True)
+    ano = db.Column(db.Integer, nullable=False)
+    mes = db.Column(db.Integer, nullable=False)
+    dono = db.Column(db.String(14), nullable=False, default='')
+    status = db.Column(db.String, nullable=False, default='')
+    forma_pagamento = db.Column(db.String(30), nullable=False, default='')
+    criado_por = db.Column(db.String, nullable=False, default='')
+    tipo_cliente = db.Column(db.String, nullable=False, default='')
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    valor_total = db.Column(db.Float, nullable=False, default=0)
+    valor_considerado = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            'ano', 'mes', 'dono', 'status', 'forma_pagamento', 'criado_por', 'tipo_cliente',
+            name='_unique_resumo_vendas',
+        ),
+    )
+
 class Orcamento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey('cliente.id'))
@@ -1443,7 +2022,7 @@ class Orcamento(db.Model):
     produto_id = db.Column(db.Integer, db.ForeignKey('produto.id'))  # NOVO CAMPO
     produto = db.relationship('Produto', backref=db.backref('orcamentos', lazy=True))  # NOVO CAMPO
     tipo_produto = db.Column(db.String(100), nullable=False)
-    material_id = db.Column(db.Integer, db.ForeignKey('material.id'))
+    material_id = db.Column(db.Integer, db.ForeignKey('material.id'), index=True)
     material = db.relationship('Material', backref=db.backref('orcamentos', lazy=True))
     quantidade = db.Column(db.Integer, nullable=False)
     comprimento = db.Column(db.Float, nullable=False)
@@ -1476,12 +2055,204 @@ class Orcamento(db.Model):
     tem_alisar = db.Column(db.String(50), default="Não")
     largura_alisar = db.Column(db.Float, default=0.0)
 
+    # Cópia normalizada das colunas JSON (e dos campos antigos), mantida pela
+    # escrita dupla em _sincronizar_itens_normalizados para consultas em SQL.
+    itens_cuba = db.relationship('OrcamentoCuba', order_by='OrcamentoCuba.posicao', cascade='all, delete-orphan', lazy=True)
+    itens_acessorio = db.relationship('OrcamentoAcessorio', order_by='OrcamentoAcessorio.posicao', cascade='all, delete-orphan', lazy=True)
+    itens_acabamento = db.relationship('OrcamentoAcabamento', order_by='OrcamentoAcabamento.posicao', cascade='all, delete-orphan', lazy=True)
+    itens_saia_fronte = db.relationship('OrcamentoSaiaFronte', order_by='OrcamentoSaiaFronte.posicao', cascade='all, delete-orphan', lazy=True)
+
+    # Listagem dos itens: por dono (ou todos, para admin) em ordem de data
+    __table_args__ = (
+        db.Index('ix_orcamento_dono_data', 'dono', 'data'),
+        db.Index('ix_orcamento_data', 'data'),
+    )
+
+class OrcamentoCuba(db.Model):
+    __tablename__ = 'orcamento_cuba'
+
+    id = db.Column(db.Integer, primary_key=True)
+    orcamento_id = db.Column(db.Integer, db.ForeignKey('orcamento.id', ondelete='CASCADE'), nullable=False, index=True)
+    posicao = db.Column(db.Integer, default=0, nullable=False)
+    nome = db.Column(db.String(100), nullable=False, index=True)
+    quantidade = db.Column(db.Integer, default=1, nullable=False)
+    modelo = db.Column(db.String(50), default='Normal', nullable=False)
+    comprimento = db.Column(db.Float, default=0.0, nullable=False)
+    largura = db.Column(db.Float, default=0.0, nullable=False)
+    profundidade = db.Column(db.Float, default=0.0, nullable=False)
+
+class OrcamentoAcessorio(db.Model):
+    __tablename__ = 'orcamento_acessorio'
+
+    id = db.Column(db.Integer, primary_key=True)
+    orcamento_id = db.Column(db.Integer, db.ForeignKey('orcamento.id', ondelete='CASCADE'), nullable=False, index=True)
+    posicao = db.Column(db.Integer, default=0, nullable=False)
+    nome = db.Column(db.String(100), nullable=False, index=True)
+    valor = db.Column(db.Float, default=0.0, nullable=False)
+
+class OrcamentoAcabamento(db.Model):
+    __tablename__ = 'orcamento_acabamento'
+
+    id = db.Column(db.Integer, primary_key=True)
+    orcamento_id = db.Column(db.Integer, db.ForeignKey('orcamento.id', ondelete='CASCADE'), nullable=False, index=True)
+    posicao = db.Column(db.Integer, default=0, nullable=False)
+    nome = db.Column(db.String(100), nullable=False, index=True)
+    comprimento = db.Column(db.Float, default=0.0, nullable=False)
+    valor = db.Column(db.Float, default=0.0, nullable=False)
+
+class OrcamentoSaiaFronte(db.Model):
+    __tablename__ = 'orcamento_saia_fronte'
+
+    id = db.Column(db.Integer, primary_key=True)
+    orcamento_id = db.Column(db.Integer, db.ForeignKey('orcamento.id', ondelete='CASCADE'), nullable=False, index=True)
+    posicao = db.Column(db.Integer, default=0, nullable=False)
+    tipo = db.Column(db.String(10), nullable=False, index=True)
+    comprimento = db.Column(db.Float, default=0.0, nullable=False)
+    largura = db.Column(db.Float, default=0.0, nullable=False)
+    virada = db.Column(db.Boolean, default=False, nullable=False)
+    virada_comprimento = db.Column(db.Float, default=0.0, nullable=False)
+    virada_largura = db.Column(db.Float, default=0.0, nullable=False)
+
+ITENS_NORMALIZADOS_ORCAMENTO = (
+    # relacionamento, modelo, lista interpretada, campos copiados do dict da lista
+    ("itens_cuba", OrcamentoCuba, cubas_do_orcamento, ("nome", "quantidade", "modelo", "comprimento", "largura", "profundidade")),
+    ("itens_acessorio", OrcamentoAcessorio, acessorios_do_orcamento, ("nome", "valor")),
+    ("itens_acabamento", OrcamentoAcabamento, acabamentos_do_orcamento, ("nome", "comprimento", "valor")),
+    ("itens_saia_fronte", OrcamentoSaiaFronte, saia_fronte_do_orcamento, ("tipo", "comprimento", "largura", "virada", "virada_comprimento", "virada_largura")),
+)
+
+
+def _linhas_itens_normalizados(orcamento, lista, campos):
+    return [
+        dict({campo: item.get(campo) for campo in campos}, posicao=posicao)
+        for posicao, item in enumerate(lista(orcamento))
+    ]
+
+
+def _sincronizar_itens_normalizados(orcamento):
+    for relacionamento, modelo, lista, campos in ITENS_NORMALIZADOS_ORCAMENTO:
+        setattr(orcamento, relacionamento, [modelo(**linha) for linha in _linhas_itens_normalizados(orcamento, lista, campos)])
+
+
+@event.listens_for(db.session, "before_flush")
+def _escrever_itens_normalizados(sessao, contexto, instancias):
+    """Mantém as tabelas filhas iguais às colunas JSON dos itens novos ou alterados."""
+    for obj in list(sessao.new) + list(sessao.dirty):
+        if not isinstance(obj, Orcamento):
+            continue
+        estado = inspect(obj)
+        if estado.pending or any(estado.attrs[campo].history.has_changes() for campo in CAMPOS_LISTAS_ITEM):
+            _sincronizar_itens_normalizados(obj)
+
+
+def excluir_itens_normalizados(orcamento_ids):
+    """Remove as linhas filhas de itens apagados com DELETE em massa, que não passa pelo ORM."""
+    for _, modelo, _, _ in ITENS_NORMALIZADOS_ORCAMENTO:
+        db.session.execute(modelo.__table__.delete().where(modelo.orcamento_id.in_(orcamento_ids)))
+
+
+def reconstruir_itens_normalizados(lote=500):
+    """Refaz as tabelas filhas de todos os itens a partir das colunas JSON."""
+    for _, modelo, _, _ in ITENS_NORMALIZADOS_ORCAMENTO:
+        db.session.execute(modelo.__table__.delete())
+    total = 0
+    ultimo_id = 0
+    while True:
+        orcamentos = (
+            Orcamento.query.filter(Orcamento.id > ultimo_id)
+            .order_by(Orcamento.id)
+            .limit(lote)
+            .all()
+        )
+        if not orcamentos:
+            break
+        ultimo_id = orcamentos[-1].id
+        for _, modelo, lista, campos in ITENS_NORMALIZADOS_ORCAMENTO:
+            linhas = [
+                dict(linha, orcamento_id=orcamento.id)
+                for orcamento in orcamentos
+                for linha in _linhas_itens_normalizados(orcamento, lista, campos)
+            ]
+            if linhas:
+                db.session.execute(modelo.__table__.insert(), linhas)
+        total += len(orcamentos)
+        db.session.commit()
+    db.session.commit()
+    return total
+
+
+@app.cli.command("reconstruir-itens-normalizados")
+def reconstruir_itens_normalizados_comando():
+    """Refaz orcamento_cuba, orcamento_acessorio, orcamento_acabamento e orcamento_saia_fronte."""
+    total = reconstruir_itens_normalizados()
+    print(f"Tabelas de cubas, acessórios, acabamentos e saia/fronte refeitas para {total} itens")
+
+def _descartar_listas_item(orcamento, *args):
+    orcamento.__dict__.pop("_listas_item", None)
+
+
+for _campo in CAMPOS_LISTAS_ITEM:
+    event.listen(getattr(Orcamento, _campo), "set", _descartar_listas_item)
+event.listen(Orcamento, "expire", _descartar_listas_item)
+event.listen(Orcamento, "refresh", _descartar_listas_item)
+
 class DesenhoOrdemServico(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     orcamento_salvo_codigo = db.Column(db.String, db.ForeignKey('orcamento_salvo.codigo', ondelete='CASCADE'), nullable=False)
-    desenho_data = db.Column(db.Text, nullable=False)
+    _desenho_data = db.Column('desenho_data', db.Text, nullable=False, default='')
+    desenho_hash = db.Column(db.String(64), nullable=True, index=True)
+    desenho_mime = db.Column(db.String(100), nullable=True)
+    desenho_tamanho = db.Column(db.Integer, nullable=True)
+    # Miniatura WebP das imagens; '' quando a imagem não pôde ser reduzida
+    miniatura_hash = db.Column(db.String(64), nullable=True, index=True)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
 
+    desenho_data = _texto_em_blob('_desenho_data', 'desenho')
+
+    @property
+    def eh_imagem(self):
+        """Imagem do configurador, conferida pelo mime sem ler o blob."""
+        if self.desenho_hash:
+            return (self.desenho_mime or '').startswith('image/')
+        return _eh_imagem_configurador(self._desenho_data)
+
+    @property
+    def url(self):
+        return url_for('desenho_blob', sha=self.desenho_hash) if self.desenho_hash else None
+
+    @property
+    def miniatura_url(self):
+        """URL da miniatura, ou da imagem inteira quando não há miniatura."""
+        if self.miniatura_hash:
+            return url_for('desenho_blob', sha=self.miniatura_hash)
+        return self.url
+
+
+def gerar_miniatura_blob(sha):
+    """Grava a miniatura WebP do blob de imagem e devolve o hash dela, ou '' se a imagem não abrir."""
+    lado = Config.MINIATURA_DESENHO_PX
+    try:
+        with Image.open(io.BytesIO(armazem_blobs.ler(sha))) as imagem:
+            imagem.thumbnail((lado, lado))
+            if imagem.mode not in ("RGB", "RGBA"):
+                imagem = imagem.convert("RGBA")
+            saida = io.BytesIO()
+            imagem.save(saida, "WEBP", quality=80, method=4)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        print(f"[Blobs] Miniatura do desenho {sha} não gerada: {exc}")
+        return ''
+    return armazem_blobs.gravar(saida.getvalue())
+
+
+def _miniatura_desenho_ao_gravar(mapper, connection, desenho):
+    # Só refaz a miniatura quando o conteúdo do desenho mudou
+    if desenho.miniatura_hash is not None and not inspect(desenho).attrs.desenho_hash.history.has_changes():
+        return
+    desenho.miniatura_hash = gerar_miniatura_blob(desenho.desenho_hash) if desenho.desenho_hash and desenho.eh_imagem else None
+
+event.listen(DesenhoOrdemServico, "before_insert", _miniatura_desenho_ao_gravar)
+event.listen(DesenhoOrdemServico, "before_update", _miniatura_desenho_ao_gravar)
+
 
 def _eh_imagem_configurador(desenho_data):
     """Identifica imagens data URI legadas, que não são HTML editável da OS."""
@@ -1518,8 +2289,15 @@ def criar_banco():
         _garantir_colunas_empresa_config()
         _garantir_colunas_orcamento()
         _garantir_colunas_usuario()
+        _garantir_indices_cliente()
+        _garantir_colunas_desenho_ordem_servico()
         _atualizar_textos_pagamento_padrao()
+        _migrar_resumo_vendas()
         _migrar_logo_arquivo_para_banco()
+        _migrar_itens_orcamento_salvo()
+        _migrar_cliente_orcamento_salvo()
+        _migrar_itens_normalizados_orcamento()
+        _migrar_desenhos_para_blobs()
 
 def _garantir_coluna(tabela, coluna, definicao):
     colunas = [
@@ -1529,6 +2307,10 @@ def _garantir_coluna(tabela, coluna, definicao):
         db.session.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}"))
         db.session.commit()
 
+def _garantir_indice(nome, tabela, colunas):
+    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({colunas})"))
+    db.session.commit()
+
 def _garantir_colunas_orcamento_salvo():
     colunas = {
         "valor_venda": "FLOAT",
@@ -1543,9 +2325,17 @@ def _garantir_colunas_orcamento_salvo():
         "valor_minimo_parcela": "FLOAT",
         "pagamentos_config_json": "TEXT",
         "ordem_linhas_json": "TEXT",
+        "cliente_id": "INTEGER REFERENCES cliente(id)",
+        "dono": "VARCHAR(14)",
+        "desenho_ordem_servico_hash": "VARCHAR(64)",
+        "desenho_ordem_servico_mime": "VARCHAR(100)",
+        "desenho_ordem_servico_tamanho": "INTEGER",
     }
     for coluna, definicao in colunas.items():
         _garantir_coluna("orcamento_salvo", coluna, definicao)
+    _garantir_indice("ix_orcamento_salvo_cliente_id", "orcamento_salvo", "cliente_id")
+    _garantir_indice("ix_orcamento_salvo_dono", "orcamento_salvo", "dono")
+    _garantir_indice("ix_orcamento_salvo_status_data_fechamento", "orcamento_salvo", "status, data_fechamento")
 
 
 def _garantir_colunas_empresa_config():
@@ -1585,6 +2375,7 @@ def _garantir_colunas_empresa_config():
         "fronte_margem": "FLOAT DEFAULT 0 NOT NULL",
         "virada_margem": "FLOAT DEFAULT 0 NOT NULL",
         "alisar_margem": "FLOAT DEFAULT 0 NOT NULL",
+        "config_versao": "INTEGER DEFAULT 1 NOT NULL",
     }
     for coluna, definicao in colunas.items():
         _garantir_coluna("empresa_config", coluna, definicao)
@@ -1599,6 +2390,13 @@ def _garantir_colunas_orcamento():
     _garantir_coluna("orcamento", "acabamentos_json", "TEXT DEFAULT ''")
     _garantir_coluna("orcamento", "saia_fronte_json", "TEXT DEFAULT ''")
     _garantir_coluna("orcamento", "cubas_json", "TEXT DEFAULT ''")
+    _garantir_indice("ix_orcamento_material_id", "orcamento", "material_id")
+    _garantir_indice("ix_orcamento_dono_data", "orcamento", "dono, data")
+    _garantir_indice("ix_orcamento_data", "orcamento", "data")
+
+
+def _garantir_indices_cliente():
+    _garantir_indice("ix_cliente_dono_telefone", "cliente", "dono, telefone")
 
 
 def _atualizar_textos_pagamento_padrao():
@@ -1620,12 +2418,16 @@ def _atualizar_textos_pagamento_padrao():
             ["80% de entrada e 20% na entrega"],
         ),
     }
+    alterados = 0
     for coluna, (novo_valor, valores_antigos) in atualizacoes.items():
         for valor_antigo in valores_antigos:
-            db.session.execute(
+            resultado = db.session.execute(
                 text(f"UPDATE empresa_config SET {coluna} = :novo WHERE {coluna} = :antigo"),
                 {"novo": novo_valor, "antigo": valor_antigo},
             )
+            alterados += resultado.rowcount or 0
+    if alterados:
+        db.session.execute(text("UPDATE empresa_config SET config_versao = config_versao + 1"))
     db.session.commit()
 
 
@@ -1651,14 +2453,217 @@ def _migrar_logo_arquivo_para_banco():
         with open(caminho, "rb") as arquivo:
             config.logo_data = base64.b64encode(arquivo.read()).decode("ascii")
         config.logo_mime = _mime_logo_por_extensao(caminho)
+        marcar_config_empresa_alterada(config)
         db.session.commit()
     except OSError:
         db.session.rollback()
 
+def _migrar_itens_orcamento_salvo():
+    vinculados = db.session.query(OrcamentoSalvoItem.orcamento_salvo_id)
+    pendentes = OrcamentoSalvo.query.filter(
+        ~OrcamentoSalvo.id.in_(vinculados),
+        OrcamentoSalvo.orcamentos_ids != '',
+    ).all()
+    if not pendentes:
+        return
+    for orcamento_salvo in pendentes:
+        ids = [item.strip() for item in (orcamento_salvo.orcamentos_ids or '').split(',')]
+        orcamento_salvo.definir_itens(ids)
+    db.session.commit()
+    print(f"Vínculos de itens criados para {len(pendentes)} orçamentos salvos")
+
+def _migrar_itens_normalizados_orcamento():
+    preenchidas = any(
+        db.session.query(modelo.id).first() for _, modelo, _, _ in ITENS_NORMALIZADOS_ORCAMENTO
+    )
+    if preenchidas or not Orcamento.query.first():
+        return
+    total = reconstruir_itens_normalizados()
+    print(f"Cubas, acessórios, acabamentos e saia/fronte copiados para tabelas próprias em {total} itens")
+
+def _garantir_colunas_desenho_ordem_servico():
+    colunas = {
+        "desenho_hash": "VARCHAR(64)",
+        "desenho_mime": "VARCHAR(100)",
+        "desenho_tamanho": "INTEGER",
+    }
+    for coluna, definicao in colunas.items():
+        _garantir_coluna("desenho_ordem_servico", coluna, definicao)
+    _garantir_coluna("desenho_ordem_servico", "miniatura_hash", "VARCHAR(64)")
+    _garantir_indice("ix_desenho_ordem_servico_desenho_hash", "desenho_ordem_servico", "desenho_hash")
+    _garantir_indice("ix_desenho_ordem_servico_miniatura_hash", "desenho_ordem_servico", "miniatura_hash")
+
+# Tabela, coluna antiga do texto e prefixo das colunas de hash, mime e tamanho
+COLUNAS_DESENHO_BLOB = (
+    ("desenho_ordem_servico", "desenho_data", "desenho"),
+    ("orcamento_salvo", "desenho_ordem_servico", "desenho_ordem_servico"),
+)
+
+def migrar_desenhos_para_blobs(lote=50):
+    """Move para o armazém de blobs os desenhos ainda guardados no banco.
+
+    Lê `lote` linhas por vez e grava cada lote na própria transação, para não
+    carregar todos os desenhos na memória nem segurar o banco. Devolve quantos moveu.
+    """
+    total = 0
+    for tabela, coluna, prefixo in COLUNAS_DESENHO_BLOB:
+        ultimo_id = 0
+        while True:
+            linhas = db.session.execute(text(f"""
+                SELECT id, {coluna} FROM {tabela}
+                WHERE id > :ultimo_id AND {prefixo}_hash IS NULL AND {coluna} IS NOT NULL AND {coluna} != ''
+                ORDER BY id LIMIT :lote
+            """), {"ultimo_id": ultimo_id, "lote": lote}).fetchall()
+            if not linhas:
+                break
+            valores = []
+            for id_linha, valor in linhas:
+                sha, mime, tamanho = guardar_texto_blob(valor)
+                valores.append({"id": id_linha, "sha": sha, "mime": mime, "tamanho": tamanho})
+            db.session.execute(text(f"""
+                UPDATE {tabela}
+                SET {prefixo}_hash = :sha, {prefixo}_mime = :mime, {prefixo}_tamanho = :tamanho, {coluna} = ''
+                WHERE id = :id
+            """), valores)
+            db.session.commit()
+            total += len(linhas)
+            ultimo_id = linhas[-1][0]
+    return total
+
+def gerar_miniaturas_pendentes(lote=50):
+    """Gera as miniaturas das imagens do configurador que ainda não têm, `lote` desenhos por transação."""
+    miniaturas = {}  # hash da imagem -> hash da miniatura, para imagens repetidas
+    total = 0
+    ultimo_id = 0
+    while True:
+        linhas = db.session.execute(text("""
+            SELECT id, desenho_hash FROM desenho_ordem_servico
+            WHERE id > :ultimo_id AND miniatura_hash IS NULL AND desenho_hash IS NOT NULL AND desenho_mime LIKE 'image/%'
+            ORDER BY id LIMIT :lote
+        """), {"ultimo_id": ultimo_id, "lote": lote}).fetchall()
+        if not linhas:
+            break
+        valores = []
+        for id_linha, sha in linhas:
+            if sha not in miniaturas:
+                miniaturas[sha] = gerar_miniatura_blob(sha)
+            valores.append({"id": id_linha, "miniatura": miniaturas[sha]})
+        db.session.execute(
+            text("UPDATE desenho_ordem_servico SET miniatura_hash = :miniatura WHERE id = :id"), valores
+        )
+        db.session.commit()
+        total += len(linhas)
+        ultimo_id = linhas[-1][0]
+    return total
+
+def _migrar_desenhos_para_blobs():
+    total = migrar_desenhos_para_blobs()
+    if total:
+        print(f"{total} desenhos movidos do banco para {Config.BLOB_DIR}; rode 'flask migrar-desenhos' para compactar o banco")
+    miniaturas = gerar_miniaturas_pendentes()
+    if miniaturas:
+        print(f"Miniaturas geradas para {miniaturas} desenhos do configurador")
+
+def _consultas_hashes_desenhos():
+    for tabela, _, prefixo in COLUNAS_DESENHO_BLOB:
+        yield f"SELECT DISTINCT {prefixo}_hash FROM {tabela} WHERE {prefixo}_hash IS NOT NULL AND {prefixo}_hash != ''"
+    yield "SELECT DISTINCT miniatura_hash FROM desenho_ordem_servico WHERE miniatura_hash IS NOT NULL AND miniatura_hash != ''"
+
+def _hashes_desenhos_referenciados():
+    hashes = set()
+    for consulta in _consultas_hashes_desenhos():
+        hashes.update(db.session.execute(text(consulta)).scalars())
+    return hashes
+
+def _hashes_desenhos_do_arquivo(caminho):
+    """Hashes de desenho referenciados por um arquivo de banco (cópia de backup ou upload)."""
+    hashes = set()
+    conexao = sqlite3.connect(caminho)
+    try:
+        conexao.execute("SELECT count(*) FROM sqlite_master").fetchone()  # levanta se não for SQLite
+        for consulta in _consultas_hashes_desenhos():
+            try:
+                hashes.update(linha[0] for linha in conexao.execute(consulta))
+            except sqlite3.OperationalError:
+                continue  # banco anterior às colunas de hash dos desenhos
+    finally:
+        conexao.close()
+    return hashes
+
+@app.cli.command("migrar-desenhos")
+def migrar_desenhos_comando():
+    """Move os desenhos restantes para o armazém de blobs e compacta o banco com VACUUM."""
+    tamanho_antes = os.path.getsize(Config.DATABASE_PATH)
+    total = migrar_desenhos_para_blobs()
+    gerar_miniaturas_pendentes()
+    db.session.execute(text("VACUUM"))
+    tamanho_depois = os.path.getsize(Config.DATABASE_PATH)
+    print(f"{total} desenhos movidos; banco de {tamanho_antes / 1e6:.1f} MB para {tamanho_depois / 1e6:.1f} MB")
+
+@app.cli.command("limpar-blobs")
+@click.option("--idade-minima", default=3600, show_default=True, help="Segundos desde a gravação para um blob sem referência ser apagado.")
+def limpar_blobs_comando(idade_minima):
+    """Apaga do armazém os blobs que nenhum desenho referencia mais."""
+    referenciados = _hashes_desenhos_referenciados()
+    agora = time.time()
+    apagados = liberados = 0
+    for sha, tamanho, mtime in armazem_blobs.listar():
+        # Blobs recentes podem ser de uma transação que ainda não fez commit
+        if sha in referenciados or agora - mtime < idade_minima:
+            continue
+        armazem_blobs.remover(sha)
+        apagados += 1
+        liberados += tamanho
+    print(f"{apagados} blobs sem referência apagados ({liberados / 1e6:.1f} MB)")
+
+def _migrar_cliente_orcamento_salvo():
+    resultado = db.session.execute(text("""
+        UPDATE orcamento_salvo SET cliente_id = (
+            SELECT orcamento.cliente_id
+            FROM orcamento_salvo_item
+            JOIN orcamento ON orcamento.id = orcamento_salvo_item.orcamento_id
+            WHERE orcamento_salvo_item.orcamento_salvo_id = orcamento_salvo.id
+              AND orcamento.cliente_id IS NOT NULL
+            ORDER BY orcamento_salvo_item.posicao
+            LIMIT 1
+        )
+        WHERE cliente_id IS NULL
+    """))
+    donos = db.session.execute(text("""
+        UPDATE orcamento_salvo SET dono = (
+            SELECT cliente.dono FROM cliente WHERE cliente.id = orcamento_salvo.cliente_id
+        )
+        WHERE dono IS NULL AND cliente_id IS NOT NULL
+    """))
+    db.session.commit()
+    # O UPDATE acima não passa pelo ORM, então o resumo de vendas é refeito
+    if donos.rowcount:
+        reconstruir_resumo_vendas()
+
+# PRAGMA user_version a partir do qual o resumo de vendas já foi montado ou corrigido
+VERSAO_RESUMO_VENDAS = 1
+
+def _migrar_resumo_vendas():
+    """Monta ou corrige o resumo mensal uma única vez por banco, marcando o user_version.
+
+    A conferência completa fica no comando reconstruir-resumo-vendas --se-divergente,
+    para o boot de cada worker não varrer orcamento_salvo.
+    """
+    if db.session.execute(text("PRAGMA user_version")).scalar() >= VERSAO_RESUMO_VENDAS:
+        return
+    if OrcamentoSalvo.query.first():
+        # Vazio: banco anterior ao resumo. Preenchido: mantido antes de os defaults de
+        # status e tipo_cliente entrarem no hook, com orçamentos novos contados sob ''
+        acao = "reconstruído" if VendasResumoMensal.query.first() else "criado"
+        grupos = reconstruir_resumo_vendas()
+        print(f"Resumo mensal de vendas {acao} com {grupos} grupos")
+    db.session.execute(text(f"PRAGMA user_version = {VERSAO_RESUMO_VENDAS}"))
+    db.session.commit()
+
 @app.route('/orcamento')
 def configurador_3d():
     logado = 'user_cpf' in session
-    return render_template('configurador_3d.html', logado=logado, empresa_logo_url=empresa_logo_url())
+    return render_template('configurador_3d.html', logado=logado, empresa_logo_url=empresa_logo_url(tamanho="cabecalho"))
 
 @app.route('/api/materiais')
 def api_materiais():
@@ -1666,11 +2671,10 @@ def api_materiais():
     return jsonify([{'id': m.id, 'nome': m.nome} for m in materiais])
 
 def _gerar_pdf_bytes(codigo):
-    import tempfile
     orcamento_salvo = OrcamentoSalvo.query.filter_by(codigo=codigo).first()
     if not orcamento_salvo:
         return None
-    ids = [int(id) for id in orcamento_salvo.orcamentos_ids.split(",")]
+    ids = orcamento_salvo.ids_itens
     orcamentos = Orcamento.query.filter(Orcamento.id.in_(ids)).all()
     ambientes_agrupados = {}
     for orcamento in orcamentos:
@@ -1696,8 +2700,8 @@ def _gerar_pdf_bytes(codigo):
     exclude_payments = orcamento_salvo.exclude_payments.split(',') if orcamento_salvo.exclude_payments else []
     pagamentos_config = pagamentos_config_orcamento(orcamento_salvo)
     rendered_html = render_template(
-        "detalhes_orcamento_salvo.html",
-        logo_url=empresa_logo_data_uri(),
+        PDF_TEMPLATE,
+        empresa_logo_url=empresa_logo_data_uri(),
         codigo_orcamento=orcamento_salvo.codigo,
         data_salvo=orcamento_salvo.data_salvo,
         cliente_nome=orcamentos[0].cliente.nome if orcamentos else "Desconhecido",
@@ -1710,7 +2714,6 @@ def _gerar_pdf_bytes(codigo):
         desconto_avista=desconto_avista,
         desconto_parcelado=desconto_parcelado,
         observacoes=observacoes,
-        pdf=True,
         exclude_payments=exclude_payments,
         pagamentos_config=pagamentos_config,
         max_parcelas=max_parcelas,
@@ -1718,585 +2721,841 @@ def _gerar_pdf_bytes(codigo):
         parcelas_orcamento=parcelas_orcamento,
         linhas_ordenadas=linhas_ordenadas_por_tabela(ambientes_agrupados, orcamento_salvo)
     )
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-        temp_pdf_path = temp_pdf.name
-    _get_weasyprint_html()(string=rendered_html, base_url=request.url_root).write_pdf(temp_pdf_path)
-    with open(temp_pdf_path, "rb") as f:
-        pdf_bytes = f.read()
-    os.unlink(temp_pdf_path)
-    return pdf_bytes
+    return renderizar_pdf(rendered_html, request.url_root)
 
-@app.route('/api/configurador-orcamento', methods=['POST'])
-def api_configurador_orcamento():
+def _id_inteiro(valor):
     try:
-        cfg = request.get_json()
-        if not cfg:
-            return jsonify({'success': False, 'error': 'Dados inválidos'}), 400
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
 
-        nome = (cfg.get('clienteNome') or '').strip()
-        telefone = (cfg.get('clienteTelefone') or '').strip()
-        endereco = (cfg.get('clienteEndereco') or '').strip()
-        material_id = cfg.get('materialId')
+def _materiais_por_id(ids):
+    ids = {id_material for id_material in map(_id_inteiro, ids) if id_material is not None}
+    if not ids:
+        return {}
+    return {material.id: material for material in Material.query.filter(Material.id.in_(ids))}
+
+def validar_payload_configurador(cfg):
+    """Conferência rápida feita antes de enfileirar; devolve a mensagem de erro ou None."""
+    if not cfg or not isinstance(cfg, dict):
+        return 'Dados inválidos'
+    extras = cfg.get('produtosExtras', [])
+    if not isinstance(extras, list) or not all(isinstance(extra, dict) for extra in extras):
+        return 'Dados inválidos'
+    if not (cfg.get('clienteNome') or '').strip() or not (cfg.get('clienteTelefone') or '').strip() or not cfg.get('materialId'):
+        return 'Nome, telefone e material são obrigatórios'
+    material_id = _id_inteiro(cfg.get('materialId'))
+    if material_id is None or db.session.get(Material, material_id) is None:
+        return 'Material não encontrado'
+    return None
 
-        if not nome or not telefone or not material_id:
-            return jsonify({'success': False, 'error': 'Nome, telefone e material são obrigatórios'}), 400
+def gravar_orcamento_configurador(cfg, dono_cpf):
+    """Grava cliente, itens, orçamento salvo e desenhos do configurador; devolve o OrcamentoSalvo.
 
-        material = Material.query.get(material_id)
-        if not material:
-            return jsonify({'success': False, 'error': 'Material não encontrado'}), 400
+    Levanta ValueError com a mensagem para o cliente quando o pedido não gera orçamento.
+    """
+    nome = (cfg.get('clienteNome') or '').strip()
+    telefone = (cfg.get('clienteTelefone') or '').strip()
+    endereco = (cfg.get('clienteEndereco') or '').strip()
+    material_id = cfg.get('materialId')
+
+    # Materiais de todas as peças em uma consulta só
+    produtos_cfg = [cfg] + [extra for extra in cfg.get('produtosExtras', []) if extra.get('produto')]
+    materiais = _materiais_por_id([material_id] + [pcfg.get('materialId') for pcfg in produtos_cfg])
+    material = materiais.get(_id_inteiro(material_id))
+    if not material:
+        raise ValueError('Material não encontrado')
 
-        pricing_opts = opcoes_precificacao_empresa()
-        dono_cpf = session.get('user_cpf', '12233344441')
+    pricing_opts = opcoes_precificacao_empresa()
 
-        cliente = Cliente.query.filter_by(telefone=telefone, dono=dono_cpf).first()
-        if not cliente:
-            cliente = Cliente(nome=nome, telefone=telefone, endereco=endereco, dono=dono_cpf)
-            db.session.add(cliente)
-            db.session.flush()
-
-        orcamento_ids = []
-
-        def get_or_create_produto(nome_prod):
-            prod = Produto.query.filter_by(nome=nome_prod, dono=dono_cpf).first()
-            if not prod:
-                prod = Produto(nome=nome_prod, dono=dono_cpf)
-                db.session.add(prod)
-                db.session.flush()
-            return prod.id
-
-        def calc_saia_fronte(sides_dims, bordas_cfg, alts, saia_largs):
-            comp_saia = 0
-            larg_saia = 0
-            comp_fronte = 0
-            larg_fronte = 0
-            ilhargas = []
-            for side, dim in sides_dims:
-                bt = bordas_cfg.get(side, 'livre')
-                if bt == 'saia':
-                    comp_saia += dim
-                    larg_saia = max(larg_saia, saia_largs.get(side, 10))
-                elif bt == 'fronte':
-                    comp_fronte += dim
-                    larg_fronte = max(larg_fronte, alts.get(side, 10))
-                elif bt == 'ilharga':
-                    ilhargas.append((side, dim, alts.get(side, 92)))
-            return comp_saia, larg_saia, comp_fronte, larg_fronte, ilhargas
-
-        def processar_produto_cfg(pcfg):
-            produto = pcfg.get('produto', 'bancada')
-            bordas = pcfg.get('bordas', {})
-            borda_alts = pcfg.get('bordaAlts', {})
-            borda_saia_larg = pcfg.get('bordaSaiaLarg', {})
-
-            mat_id = pcfg.get('materialId', material.id)
-            mat = Material.query.get(mat_id) or material
-
-            def criar_item_p(tipo_produto, comprimento, largura, comp_saia, larg_saia, comp_fronte, larg_fronte,
-                           tipo_cuba='', qtd_cubas=0, comp_cuba=0, larg_cuba=0, prof_cuba=0,
-                           tem_cooktop='Não', prof_nicho=0, tem_fundo='Sim', tem_alisar='Não', larg_alisar=0,
-                           produto_nome='', quantidade=1, cubas_lista=None):
-                comprimento_cal = max(comprimento, 10)
-                largura_cal = max(largura, 10)
-                valor_base = mat.valor * (comprimento_cal * largura_cal / 10000)
-
-                if tipo_produto in ['Bancada', 'Lavatorio']:
-                    if mat.valor < 1000:
-                        valor_base *= 1.3
-                    elif mat.valor < 2000:
-                        valor_base *= 1.15
-                    elif mat.valor < 1000000:
-                        valor_base *= 1.1
-
-                if tipo_produto in ['Ilharga Bipolida', 'Pedra Bipolida com Saia', 'Pedra Bipolida'] and valor_base < 1000000:
-                    margem_bipolida = pricing_opts.get('ilharga_bipolida_margem', 15)
-                    if tipo_produto == 'Pedra Bipolida com Saia':
-                        margem_bipolida = pricing_opts.get('pedra_bipolida_com_saia_margem', 15)
-                    elif tipo_produto == 'Pedra Bipolida':
-                        margem_bipolida = pricing_opts.get('pedra_bipolida_margem', 15)
-                    valor_base *= 1 + (float(margem_bipolida or 0) / 100)
-
-                valor_total = valor_base
-                if cubas_lista is not None:
-                    cubas_item = normalizar_cubas(
-                        [item.get('nome') for item in cubas_lista],
-                        [item.get('quantidade') for item in cubas_lista],
-                        [item.get('modelo') for item in cubas_lista],
-                        [item.get('comprimento') for item in cubas_lista],
-                        [item.get('largura') for item in cubas_lista],
-                        [item.get('profundidade') for item in cubas_lista],
-                    )
-                else:
-                    cubas_item = normalizar_cubas(
-                        [tipo_cuba] if tipo_cuba else [],
-                        [qtd_cubas],
-                        ['Normal'],
-                        [comp_cuba],
-                        [larg_cuba],
-                        [prof_cuba],
-                    )
-                primeira_cuba = cubas_item[0] if cubas_item else {}
-                tipo_cuba_cap = primeira_cuba.get('nome', '')
-                qtd_cubas = int(primeira_cuba.get('quantidade') or 0)
-                comp_cuba = float(primeira_cuba.get('comprimento') or 0)
-                larg_cuba = float(primeira_cuba.get('largura') or 0)
-                prof_cuba = float(primeira_cuba.get('profundidade') or 0)
-
-                if tipo_produto == 'Nicho':
-                    comp_cal = max(comprimento, 10)
-                    larg_cal = max(largura, 10)
-                    prof_nicho_cal = max(prof_nicho, 10) if prof_nicho > 0 else 0
-                    if tem_fundo == 'Sim':
-                        area = ((comp_cal+4)*(larg_cal+4))+(((comp_cal+4)*prof_nicho_cal)*2)+(((larg_cal+4)*prof_nicho_cal)*2)
-                    else:
-                        area = ((comp_cal+4)+(larg_cal+4))*prof_nicho_cal*2
-                    if tem_alisar == 'Sim' and larg_alisar > 0:
-                        la = max(larg_alisar, 10)
-                        area += ((comp_cal+(la*2))*la*2)+((larg_cal+(la*2))*la*2)
-                    valor_total = (area/10000)*mat.valor + 150
-
-                if comp_saia > 0 and larg_saia > 0:
-                    cs_cal = max(comp_saia, 10)
-                    ls_cal = max(larg_saia, 10)
-                    valor_total += cs_cal * ls_cal * mat.valor / 10000
-
-                if comp_fronte > 0 and larg_fronte > 0:
-                    cf_cal = max(comp_fronte, 10)
-                    lf_cal = max(larg_fronte, 10)
-                    valor_total += cf_cal * lf_cal * mat.valor / 10000
-
-                if tem_cooktop == 'Sim':
-                    valor_total += pricing_opts.get('cooktop_valor', 50)
-
-                valor_total = calcular_valor_item(
-                    tipo_produto=tipo_produto,
-                    valor_material=mat.valor,
-                    quantidade=max(quantidade, 1),
-                    comprimento=comprimento,
-                    largura=largura,
-                    comprimento_saia=comp_saia,
-                    largura_saia=larg_saia,
-                    comprimento_fronte=comp_fronte,
-                    largura_fronte=larg_fronte,
-                    tipo_cuba=tipo_cuba_cap,
-                    quantidade_cubas=max(qtd_cubas, 1) if tipo_cuba_cap else 0,
-                    comprimento_cuba=comp_cuba,
-                    largura_cuba=larg_cuba,
-                    profundidade_cuba=prof_cuba,
-                    modelo_cuba='Normal',
-                    cubas_valor_total=cubas_total(cubas_item, mat.valor, pricing_opts.get('cuba_valores')),
-                    tem_cooktop=tem_cooktop,
-                    acessorios_valor_total=0,
-                    profundidade_nicho=prof_nicho,
-                    tem_fundo=tem_fundo,
-                    tem_alisar=tem_alisar,
-                    largura_alisar=larg_alisar,
-                    **pricing_opts,
-                )
+    cliente = Cliente.query.filter_by(telefone=telefone, dono=dono_cpf).first()
+    if not cliente:
+        cliente = Cliente(nome=nome, telefone=telefone, endereco=endereco, dono=dono_cpf)
+        db.session.add(cliente)
+        db.session.flush()
 
-                prod_id = get_or_create_produto(produto_nome) if produto_nome else None
-
-                orc = Orcamento(
-                    cliente_id=cliente.id, ambiente_id=None,
-                    descricao_id=None, produto_id=prod_id,
-                    tipo_produto=tipo_produto, material_id=mat.id,
-                    quantidade=max(quantidade, 1), comprimento=comprimento, largura=largura,
-                    instalacao='Não', instalacao_valor=0, rt='Sim', rt_percentual=10,
-                    comprimento_saia=comp_saia, largura_saia=larg_saia,
-                    comprimento_fronte=comp_fronte, largura_fronte=larg_fronte,
-                    tipo_cuba=tipo_cuba_cap,
-                    quantidade_cubas=qtd_cubas,
-                    comprimento_cuba=comp_cuba, largura_cuba=larg_cuba, profundidade_cuba=prof_cuba,
-                    modelo_cuba='Normal',
-                    cubas_json=json.dumps(cubas_item, ensure_ascii=False) if cubas_item else '',
-                    tem_cooktop=tem_cooktop,
-                    profundidade_nicho=prof_nicho,
-                    tem_fundo=tem_fundo, tem_alisar=tem_alisar, largura_alisar=larg_alisar,
-                    valor_total=valor_total, dono=dono_cpf
+    # Itens montados em memória com o nome do produto; gravados juntos no fim
+    itens_gerados = []
+
+    def calc_saia_fronte(sides_dims, bordas_cfg, alts, saia_largs):
+        comp_saia = 0
+        larg_saia = 0
+        comp_fronte = 0
+        larg_fronte = 0
+        ilhargas = []
+        for side, dim in sides_dims:
+            bt = bordas_cfg.get(side, 'livre')
+            if bt == 'saia':
+                comp_saia += dim
+                larg_saia = max(larg_saia, saia_largs.get(side, 10))
+            elif bt == 'fronte':
+                comp_fronte += dim
+                larg_fronte = max(larg_fronte, alts.get(side, 10))
+            elif bt == 'ilharga':
+                ilhargas.append((side, dim, alts.get(side, 92)))
+        return comp_saia, larg_saia, comp_fronte, larg_fronte, ilhargas
+
+    def processar_produto_cfg(pcfg):
+        produto = pcfg.get('produto', 'bancada')
+        bordas = pcfg.get('bordas', {})
+        borda_alts = pcfg.get('bordaAlts', {})
+        borda_saia_larg = pcfg.get('bordaSaiaLarg', {})
+
+        mat = materiais.get(_id_inteiro(pcfg.get('materialId', material.id))) or material
+
+        def criar_item_p(tipo_produto, comprimento, largura, comp_saia, larg_saia, comp_fronte, larg_fronte,
+                       tipo_cuba='', qtd_cubas=0, comp_cuba=0, larg_cuba=0, prof_cuba=0,
+                       tem_cooktop='Não', prof_nicho=0, tem_fundo='Sim', tem_alisar='Não', larg_alisar=0,
+                       produto_nome='', quantidade=1, cubas_lista=None):
+            comprimento_cal = max(comprimento, 10)
+            largura_cal = max(largura, 10)
+            valor_base = mat.valor * (comprimento_cal * largura_cal / 10000)
+
+            if tipo_produto in ['Bancada', 'Lavatorio']:
+                if mat.valor < 1000:
+                    valor_base *= 1.3
+                elif mat.valor < 2000:
+                    valor_base *= 1.15
+                elif mat.valor < 1000000:
+                    valor_base *= 1.1
+
+            if tipo_produto in ['Ilharga Bipolida', 'Pedra Bipolida com Saia', 'Pedra Bipolida'] and valor_base < 1000000:
+                margem_bipolida = pricing_opts.get('ilharga_bipolida_margem', 15)
+                if tipo_produto == 'Pedra Bipolida com Saia':
+                    margem_bipolida = pricing_opts.get('pedra_bipolida_com_saia_margem', 15)
+                elif tipo_produto == 'Pedra Bipolida':
+                    margem_bipolida = pricing_opts.get('pedra_bipolida_margem', 15)
+                valor_base *= 1 + (float(margem_bipolida or 0) / 100)
+
+            valor_total = valor_base
+            if cubas_lista is not None:
+                cubas_item = normalizar_cubas(
+                    [item.get('nome') for item in cubas_lista],
+                    [item.get('quantidade') for item in cubas_lista],
+                    [item.get('modelo') for item in cubas_lista],
+                    [item.get('comprimento') for item in cubas_lista],
+                    [item.get('largura') for item in cubas_lista],
+                    [item.get('profundidade') for item in cubas_lista],
                 )
-                db.session.add(orc)
-                db.session.flush()
-                orcamento_ids.append(str(orc.id))
-
-            if produto == 'bancada':
-                modelo = pcfg.get('modelo', '')
-                has_molhada = modelo != 'toda_seca'
-                has_seca = modelo != 'toda_molhada'
-                is_l = modelo.startswith('l_')
-
-                def cubas_na_secao(*secoes):
-                    if not pcfg.get('cuba'):
-                        return []
-                    qtd = pcfg.get('cubaQtd', 1)
-                    c1_here = pcfg.get('cubaLocal') in secoes
-                    c2_here = qtd >= 2 and pcfg.get('cuba2Local') in secoes
-                    cubas_secao = []
-                    if c1_here:
-                        cubas_secao.append({
-                            "nome": pcfg.get('tipoCuba', ''),
-                            "quantidade": 1,
-                            "modelo": pcfg.get('modeloCuba', 'Normal'),
-                            "comprimento": pcfg.get('cubaComp', 0),
-                            "largura": pcfg.get('cubaLarg', 0),
-                            "profundidade": pcfg.get('cubaAlt', 0),
-                        })
-                    if c2_here:
-                        cubas_secao.append({
-                            "nome": pcfg.get('tipoCuba2', pcfg.get('tipoCuba', '')),
-                            "quantidade": 1,
-                            "modelo": pcfg.get('modeloCuba2', pcfg.get('modeloCuba', 'Normal')),
-                            "comprimento": pcfg.get('cubaComp2', 0),
-                            "largura": pcfg.get('cubaLarg2', 0),
-                            "profundidade": pcfg.get('cubaAlt2', 0),
-                        })
-                    return cubas_secao
-
-                prof_m_val = pcfg.get('profMolhada', 60)
-                prof_s_val = pcfg.get('profSeca', 60)
-                mainD = max(prof_m_val, prof_s_val)
-
-                # DENTE DE FUNDO PARA ORÇAMENTO
-                # Quando bancadas lado a lado têm larguras/profundidades diferentes,
-                # o dente é a diferença entre elas. Esse trecho deve ser cobrado no
-                # mesmo acabamento do fundo e atribuído à bancada de maior largura.
-                dente_fundo_molhada = 0
-                dente_fundo_seca = 0
-                dente_fundo_seca_esq = 0
-                dente_fundo_seca_dir = 0
-                dente_fundo_molhada_esq = 0
-                dente_fundo_molhada_dir = 0
-
-                def acumular_dente(prof_a, prof_b):
-                    d = abs((prof_a or 0) - (prof_b or 0))
-                    return d if d > 0 else 0
-
-                if has_molhada and has_seca:
-                    if modelo in ['molhada_esq_seca_dir', 'molhada_dir_seca_esq', 'l_seca_molhada', 'l_seca_molhada_seca']:
-                        d = acumular_dente(prof_m_val, prof_s_val)
-                        if prof_m_val > prof_s_val:
-                            dente_fundo_molhada += d
-                        elif prof_s_val > prof_m_val:
-                            dente_fundo_seca += d
-                    elif modelo == 'molhada_centro_seca_lat':
-                        prof_seca_esq = pcfg.get('profSecaEsq', prof_s_val)
-                        prof_seca_dir = pcfg.get('profSecaDir', prof_s_val)
-                        d = acumular_dente(prof_m_val, prof_seca_esq)
-                        if prof_m_val > prof_seca_esq:
-                            dente_fundo_molhada += d
-                        elif prof_seca_esq > prof_m_val:
-                            dente_fundo_seca_esq += d
-                        d = acumular_dente(prof_m_val, prof_seca_dir)
-                        if prof_m_val > prof_seca_dir:
-                            dente_fundo_molhada += d
-                        elif prof_seca_dir > prof_m_val:
-                            dente_fundo_seca_dir += d
-                    elif modelo == 'seca_centro_molhada_lat':
-                        prof_molhada_esq = pcfg.get('profMolhadaEsq', prof_m_val)
-                        prof_molhada_dir = pcfg.get('profMolhadaDir', prof_m_val)
-                        d = acumular_dente(prof_s_val, prof_molhada_esq)
-                        if prof_s_val > prof_molhada_esq:
-                            dente_fundo_seca += d
-                        elif prof_molhada_esq > prof_s_val:
-                            dente_fundo_molhada_esq += d
-                        d = acumular_dente(prof_s_val, prof_molhada_dir)
-                        if prof_s_val > prof_molhada_dir:
-                            dente_fundo_seca += d
-                        elif prof_molhada_dir > prof_s_val:
-                            dente_fundo_molhada_dir += d
-
-                if has_molhada and modelo != 'seca_centro_molhada_lat':
-                    comp_m = pcfg.get('compMolhada', 120)
-                    prof_m = prof_m_val
-                    sides_m = [('fundo', comp_m)]
-                    frente_m = comp_m
-                    if is_l and modelo == 'l_seca_molhada':
-                        frente_m = comp_m - pcfg.get('profL', 60)
-                    sides_m.append(('frente', frente_m))
-                    if modelo not in ['molhada_centro_seca_lat', 'l_seca_molhada_seca']:
-                        sides_m.append(('esquerda', prof_m))
-                    if not has_seca:
-                        sides_m.append(('direita', prof_m))
-                    if dente_fundo_molhada > 0:
-                        sides_m.append(('fundo', dente_fundo_molhada))
-                    cs, ls, cf, lf, _ilh = calc_saia_fronte(sides_m, bordas, borda_alts, borda_saia_larg)
-                    criar_item_p('Bancada', comp_m, prof_m, cs, ls, cf, lf,
-                              cubas_lista=cubas_na_secao('molhada'),
-                              produto_nome='Bancada Molhada')
-
-                if has_seca and modelo != 'molhada_centro_seca_lat':
-                    comp_s = pcfg.get('compSeca', 120)
-                    prof_s = prof_s_val
-                    sides_s = [('fundo', comp_s), ('frente', comp_s)]
-                    if modelo not in ['seca_centro_molhada_lat', 'molhada_centro_seca_lat']:
-                        sides_s.append(('direita', prof_s))
-                    if not has_molhada:
-                        sides_s.append(('esquerda', prof_s))
-                    if dente_fundo_seca > 0:
-                        sides_s.append(('fundo', dente_fundo_seca))
-                    cs, ls, cf, lf, _ilh = calc_saia_fronte(sides_s, bordas, borda_alts, borda_saia_larg)
-                    cook = 'Sim' if pcfg.get('cooktop') else 'Não'
-                    criar_item_p('Bancada', comp_s, prof_s, cs, ls, cf, lf,
-                              cubas_lista=cubas_na_secao('seca'),
+            else:
+                cubas_item = normalizar_cubas(
+                    [tipo_cuba] if tipo_cuba else [],
+                    [qtd_cubas],
+                    ['Normal'],
+                    [comp_cuba],
+                    [larg_cuba],
+                    [prof_cuba],
+                )
+            primeira_cuba = cubas_item[0] if cubas_item else {}
+            tipo_cuba_cap = primeira_cuba.get('nome', '')
+            qtd_cubas = int(primeira_cuba.get('quantidade') or 0)
+            comp_cuba = float(primeira_cuba.get('comprimento') or 0)
+            larg_cuba = float(primeira_cuba.get('largura') or 0)
+            prof_cuba = float(primeira_cuba.get('profundidade') or 0)
+
+            if tipo_produto == 'Nicho':
+                comp_cal = max(comprimento, 10)
+                larg_cal = max(largura, 10)
+                prof_nicho_cal = max(prof_nicho, 10) if prof_nicho > 0 else 0
+                if tem_fundo == 'Sim':
+                    area = ((comp_cal+4)*(larg_cal+4))+(((comp_cal+4)*prof_nicho_cal)*2)+(((larg_cal+4)*prof_nicho_cal)*2)
+                else:
+                    area = ((comp_cal+4)+(larg_cal+4))*prof_nicho_cal*2
+                if tem_alisar == 'Sim' and larg_alisar > 0:
+                    la = max(larg_alisar, 10)
+                    area += ((comp_cal+(la*2))*la*2)+((larg_cal+(la*2))*la*2)
+                valor_total = (area/10000)*mat.valor + 150
+
+            if comp_saia > 0 and larg_saia > 0:
+                cs_cal = max(comp_saia, 10)
+                ls_cal = max(larg_saia, 10)
+                valor_total += cs_cal * ls_cal * mat.valor / 10000
+
+            if comp_fronte > 0 and larg_fronte > 0:
+                cf_cal = max(comp_fronte, 10)
+                lf_cal = max(larg_fronte, 10)
+                valor_total += cf_cal * lf_cal * mat.valor / 10000
+
+            if tem_cooktop == 'Sim':
+                valor_total += pricing_opts.get('cooktop_valor', 50)
+
+            valor_total = regras_precificacao_empresa().funcao(tipo_produto)(mat.valor, dict(
+                quantidade=max(quantidade, 1),
+                comprimento=comprimento,
+                largura=largura,
+                comprimento_saia=comp_saia,
+                largura_saia=larg_saia,
+                comprimento_fronte=comp_fronte,
+                largura_fronte=larg_fronte,
+                tipo_cuba=tipo_cuba_cap,
+                quantidade_cubas=max(qtd_cubas, 1) if tipo_cuba_cap else 0,
+                comprimento_cuba=comp_cuba,
+                largura_cuba=larg_cuba,
+                profundidade_cuba=prof_cuba,
+                modelo_cuba='Normal',
+                cubas_valor_total=cubas_total(cubas_item, mat.valor, pricing_opts.get('cuba_valores')),
+                tem_cooktop=tem_cooktop,
+                acessorios_valor_total=0,
+                profundidade_nicho=prof_nicho,
+                tem_fundo=tem_fundo,
+                tem_alisar=tem_alisar,
+                largura_alisar=larg_alisar,
+            ))
+
+            orc = Orcamento(
+                cliente_id=cliente.id, ambiente_id=None,
+                descricao_id=None,
+                tipo_produto=tipo_produto, material_id=mat.id,
+                quantidade=max(quantidade, 1), comprimento=comprimento, largura=largura,
+                instalacao='Não', instalacao_valor=0, rt='Sim', rt_percentual=10,
+                comprimento_saia=comp_saia, largura_saia=larg_saia,
+                comprimento_fronte=comp_fronte, largura_fronte=larg_fronte,
+                tipo_cuba=tipo_cuba_cap,
+                quantidade_cubas=qtd_cubas,
+                comprimento_cuba=comp_cuba, largura_cuba=larg_cuba, profundidade_cuba=prof_cuba,
+                modelo_cuba='Normal',
+                cubas_json=json.dumps(cubas_item, ensure_ascii=False) if cubas_item else '',
+                tem_cooktop=tem_cooktop,
+                profundidade_nicho=prof_nicho,
+                tem_fundo=tem_fundo, tem_alisar=tem_alisar, largura_alisar=larg_alisar,
+                valor_total=valor_total, dono=dono_cpf
+            )
+            itens_gerados.append((orc, produto_nome))
+
+        if produto == 'bancada':
+            modelo = pcfg.get('modelo', '')
+            has_molhada = modelo != 'toda_seca'
+            has_seca = modelo != 'toda_molhada'
+            is_l = modelo.startswith('l_')
+
+            def cubas_na_secao(*secoes):
+                if not pcfg.get('cuba'):
+                    return []
+                qtd = pcfg.get('cubaQtd', 1)
+                c1_here = pcfg.get('cubaLocal') in secoes
+                c2_here = qtd >= 2 and pcfg.get('cuba2Local') in secoes
+                cubas_secao = []
+                if c1_here:
+                    cubas_secao.append({
+                        "nome": pcfg.get('tipoCuba', ''),
+                        "quantidade": 1,
+                        "modelo": pcfg.get('modeloCuba', 'Normal'),
+                        "comprimento": pcfg.get('cubaComp', 0),
+                        "largura": pcfg.get('cubaLarg', 0),
+                        "profundidade": pcfg.get('cubaAlt', 0),
+                    })
+                if c2_here:
+                    cubas_secao.append({
+                        "nome": pcfg.get('tipoCuba2', pcfg.get('tipoCuba', '')),
+                        "quantidade": 1,
+                        "modelo": pcfg.get('modeloCuba2', pcfg.get('modeloCuba', 'Normal')),
+                        "comprimento": pcfg.get('cubaComp2', 0),
+                        "largura": pcfg.get('cubaLarg2', 0),
+                        "profundidade": pcfg.get('cubaAlt2', 0),
+                    })
+                return cubas_secao
+
+            prof_m_val = pcfg.get('profMolhada', 60)
+            prof_s_val = pcfg.get('profSeca', 60)
+            mainD = max(prof_m_val, prof_s_val)
+
+            # DENTE DE FUNDO PARA ORÇAMENTO
+            # Quando bancadas lado a lado têm larguras/profundidades diferentes,
+            # o dente é a diferença entre elas. Esse trecho deve ser cobrado no
+            # mesmo acabamento do fundo e atribuído à bancada de maior largura.
+            dente_fundo_molhada = 0
+            dente_fundo_seca = 0
+            dente_fundo_seca_esq = 0
+            dente_fundo_seca_dir = 0
+            dente_fundo_molhada_esq = 0
+            dente_fundo_molhada_dir = 0
+
+            def acumular_dente(prof_a, prof_b):
+                d = abs((prof_a or 0) - (prof_b or 0))
+                return d if d > 0 else 0
+
+            if has_molhada and has_seca:
+                if modelo in ['molhada_esq_seca_dir', 'molhada_dir_seca_esq', 'l_seca_molhada', 'l_seca_molhada_seca']:
+                    d = acumular_dente(prof_m_val, prof_s_val)
+                    if prof_m_val > prof_s_val:
+                        dente_fundo_molhada += d
+                    elif prof_s_val > prof_m_val:
+                        dente_fundo_seca += d
+                elif modelo == 'molhada_centro_seca_lat':
+                    prof_seca_esq = pcfg.get('profSecaEsq', prof_s_val)
+                    prof_seca_dir = pcfg.get('profSecaDir', prof_s_val)
+                    d = acumular_dente(prof_m_val, prof_seca_esq)
+                    if prof_m_val > prof_seca_esq:
+                        dente_fundo_molhada += d
+                    elif prof_seca_esq > prof_m_val:
+                        dente_fundo_seca_esq += d
+                    d = acumular_dente(prof_m_val, prof_seca_dir)
+                    if prof_m_val > prof_seca_dir:
+                        dente_fundo_molhada += d
+                    elif prof_seca_dir > prof_m_val:
+                        dente_fundo_seca_dir += d
+                elif modelo == 'seca_centro_molhada_lat':
+                    prof_molhada_esq = pcfg.get('profMolhadaEsq', prof_m_val)
+                    prof_molhada_dir = pcfg.get('profMolhadaDir', prof_m_val)
+                    d = acumular_dente(prof_s_val, prof_molhada_esq)
+                    if prof_s_val > prof_molhada_esq:
+                        dente_fundo_seca += d
+                    elif prof_molhada_esq > prof_s_val:
+                        dente_fundo_molhada_esq += d
+                    d = acumular_dente(prof_s_val, prof_molhada_dir)
+                    if prof_s_val > prof_molhada_dir:
+                        dente_fundo_seca += d
+                    elif prof_molhada_dir > prof_s_val:
+                        dente_fundo_molhada_dir += d
+
+            if has_molhada and modelo != 'seca_centro_molhada_lat':
+                comp_m = pcfg.get('compMolhada', 120)
+                prof_m = prof_m_val
+                sides_m = [('fundo', comp_m)]
+                frente_m = comp_m
+                if is_l and modelo == 'l_seca_molhada':
+                    frente_m = comp_m - pcfg.get('profL', 60)
+                sides_m.append(('frente', frente_m))
+                if modelo not in ['molhada_centro_seca_lat', 'l_seca_molhada_seca']:
+                    sides_m.append(('esquerda', prof_m))
+                if not has_seca:
+                    sides_m.append(('direita', prof_m))
+                if dente_fundo_molhada > 0:
+                    sides_m.append(('fundo', dente_fundo_molhada))
+                cs, ls, cf, lf, _ilh = calc_saia_fronte(sides_m, bordas, borda_alts, borda_saia_larg)
+                criar_item_p('Bancada', comp_m, prof_m, cs, ls, cf, lf,
+                          cubas_lista=cubas_na_secao('molhada'),
+                          produto_nome='Bancada Molhada')
+
+            if has_seca and modelo != 'molhada_centro_seca_lat':
+                comp_s = pcfg.get('compSeca', 120)
+                prof_s = prof_s_val
+                sides_s = [('fundo', comp_s), ('frente', comp_s)]
+                if modelo not in ['seca_centro_molhada_lat', 'molhada_centro_seca_lat']:
+                    sides_s.append(('direita', prof_s))
+                if not has_molhada:
+                    sides_s.append(('esquerda', prof_s))
+                if dente_fundo_seca > 0:
+                    sides_s.append(('fundo', dente_fundo_seca))
+                cs, ls, cf, lf, _ilh = calc_saia_fronte(sides_s, bordas, borda_alts, borda_saia_larg)
+                cook = 'Sim' if pcfg.get('cooktop') else 'Não'
+                criar_item_p('Bancada', comp_s, prof_s, cs, ls, cf, lf,
+                          cubas_lista=cubas_na_secao('seca'),
+                          tem_cooktop=cook,
+                          produto_nome='Bancada Seca')
+
+            if modelo == 'molhada_centro_seca_lat':
+                cooktop_idx = pcfg.get('cooktopLocal', 0)
+                for idx, (side_key, comp_key, prof_key, nome, cuba_local) in enumerate([
+                    ('esquerda', 'compSecaEsq', 'profSecaEsq', 'Bancada Seca Esquerda', 'seca_esq'),
+                    ('direita', 'compSecaDir', 'profSecaDir', 'Bancada Seca Direita', 'seca_dir'),
+                ]):
+                    comp_sl = pcfg.get(comp_key, pcfg.get('compSecaLat', 60))
+                    prof_sl = pcfg.get(prof_key, prof_s_val)
+                    sides_sl = [('fundo', comp_sl), ('frente', comp_sl), (side_key, prof_sl)]
+                    dente_lateral = dente_fundo_seca_esq if side_key == 'esquerda' else dente_fundo_seca_dir
+                    if dente_lateral > 0:
+                        sides_sl.append(('fundo', dente_lateral))
+                    cs, ls, cf, lf, _ilh = calc_saia_fronte(sides_sl, bordas, borda_alts, borda_saia_larg)
+                    cook = 'Sim' if pcfg.get('cooktop') and cooktop_idx == idx else 'Não'
+                    criar_item_p('Bancada', comp_sl, prof_sl, cs, ls, cf, lf,
+                              cubas_lista=cubas_na_secao(cuba_local),
                               tem_cooktop=cook,
-                              produto_nome='Bancada Seca')
-
-                if modelo == 'molhada_centro_seca_lat':
-                    cooktop_idx = pcfg.get('cooktopLocal', 0)
-                    for idx, (side_key, comp_key, prof_key, nome, cuba_local) in enumerate([
-                        ('esquerda', 'compSecaEsq', 'profSecaEsq', 'Bancada Seca Esquerda', 'seca_esq'),
-                        ('direita', 'compSecaDir', 'profSecaDir', 'Bancada Seca Direita', 'seca_dir'),
-                    ]):
-                        comp_sl = pcfg.get(comp_key, pcfg.get('compSecaLat', 60))
-                        prof_sl = pcfg.get(prof_key, prof_s_val)
-                        sides_sl = [('fundo', comp_sl), ('frente', comp_sl), (side_key, prof_sl)]
-                        dente_lateral = dente_fundo_seca_esq if side_key == 'esquerda' else dente_fundo_seca_dir
-                        if dente_lateral > 0:
-                            sides_sl.append(('fundo', dente_lateral))
-                        cs, ls, cf, lf, _ilh = calc_saia_fronte(sides_sl, bordas, borda_alts, borda_saia_larg)
-                        cook = 'Sim' if pcfg.get('cooktop') and cooktop_idx == idx else 'Não'
-                        criar_item_p('Bancada', comp_sl, prof_sl, cs, ls, cf, lf,
-                                  cubas_lista=cubas_na_secao(cuba_local),
-                                  tem_cooktop=cook,
-                                  produto_nome=nome)
-
-                if modelo == 'seca_centro_molhada_lat':
-                    for side_key, comp_key, prof_key, nome, cuba_local in [
-                        ('esquerda', 'compMolhadaEsq', 'profMolhadaEsq', 'Bancada Molhada Esquerda', 'molhada_esq'),
-                        ('direita', 'compMolhadaDir', 'profMolhadaDir', 'Bancada Molhada Direita', 'molhada_dir'),
-                    ]:
-                        comp_ml = pcfg.get(comp_key, pcfg.get('compMolhadaLat', 60))
-                        prof_ml = pcfg.get(prof_key, prof_m_val)
-                        sides_ml = [('fundo', comp_ml), ('frente', comp_ml), (side_key, prof_ml)]
-                        dente_lateral = dente_fundo_molhada_esq if side_key == 'esquerda' else dente_fundo_molhada_dir
-                        if dente_lateral > 0:
-                            sides_ml.append(('fundo', dente_lateral))
-                        cs, ls, cf, lf, _ilh = calc_saia_fronte(sides_ml, bordas, borda_alts, borda_saia_larg)
-                        criar_item_p('Bancada', comp_ml, prof_ml, cs, ls, cf, lf,
-                                  cubas_lista=cubas_na_secao(cuba_local),
-                                  produto_nome=nome)
-
-                if is_l:
-                    comp_l = pcfg.get('compL', 120)
-                    prof_l = pcfg.get('profL', 60)
-                    sides_l = [('l_esquerda', prof_l)]
-                    if modelo == 'l_seca_molhada':
-                        sides_l.append(('l_fundo', comp_l))
-                    if modelo == 'l_seca_molhada':
-                        inner_h = mainD + comp_l - prof_m_val
+                              produto_nome=nome)
+
+            if modelo == 'seca_centro_molhada_lat':
+                for side_key, comp_key, prof_key, nome, cuba_local in [
+                    ('esquerda', 'compMolhadaEsq', 'profMolhadaEsq', 'Bancada Molhada Esquerda', 'molhada_esq'),
+                    ('direita', 'compMolhadaDir', 'profMolhadaDir', 'Bancada Molhada Direita', 'molhada_dir'),
+                ]:
+                    comp_ml = pcfg.get(comp_key, pcfg.get('compMolhadaLat', 60))
+                    prof_ml = pcfg.get(prof_key, prof_m_val)
+                    sides_ml = [('fundo', comp_ml), ('frente', comp_ml), (side_key, prof_ml)]
+                    dente_lateral = dente_fundo_molhada_esq if side_key == 'esquerda' else dente_fundo_molhada_dir
+                    if dente_lateral > 0:
+                        sides_ml.append(('fundo', dente_lateral))
+                    cs, ls, cf, lf, _ilh = calc_saia_fronte(sides_ml, bordas, borda_alts, borda_saia_larg)
+                    criar_item_p('Bancada', comp_ml, prof_ml, cs, ls, cf, lf,
+                              cubas_lista=cubas_na_secao(cuba_local),
+                              produto_nome=nome)
+
+            if is_l:
+                comp_l = pcfg.get('compL', 120)
+                prof_l = pcfg.get('profL', 60)
+                sides_l = [('l_esquerda', prof_l)]
+                if modelo == 'l_seca_molhada':
+                    sides_l.append(('l_fundo', comp_l))
+                if modelo == 'l_seca_molhada':
+                    inner_h = mainD + comp_l - prof_m_val
+                else:
+                    inner_h = comp_l - mainD
+                if inner_h > 0:
+                    sides_l.append(('frente', inner_h))
+                cs, ls, cf, lf, _ilh = calc_saia_fronte(sides_l, bordas, borda_alts, borda_saia_larg)
+                criar_item_p('Bancada', comp_l, prof_l, cs, ls, cf, lf,
+                          produto_nome='Bancada em L')
+
+            for side_key in ['esquerda', 'direita', 'l_esquerda', 'l_fundo']:
+                if bordas.get(side_key) == 'ilharga':
+                    alt = borda_alts.get(side_key, 92)
+                    if side_key == 'l_fundo':
+                        comp_l = pcfg.get('compL', 120)
+                        saia_lesq = borda_saia_larg.get('l_esquerda', 10) if bordas.get('l_esquerda') == 'saia' else 0
+                        saia_esq = borda_saia_larg.get('esquerda', 10) if bordas.get('esquerda') == 'saia' else 0
+                        n_saias = (1 if saia_lesq > 0 else 0) + (1 if saia_esq > 0 else 0)
+                        cs_ilh = alt * n_saias
+                        ls_ilh = max(saia_lesq, saia_esq) if cs_ilh > 0 else 0
+                        criar_item_p('Ilharga', comp_l, alt, cs_ilh, ls_ilh, 0, 0,
+                                  produto_nome='Ilharga')
+                    elif side_key == 'l_esquerda':
+                        prof_l = pcfg.get('profL', 60)
+                        saia_lfundo = borda_saia_larg.get('l_fundo', 10) if bordas.get('l_fundo') == 'saia' else 0
+                        saia_frente = borda_saia_larg.get('frente', 10) if bordas.get('frente') == 'saia' else 0
+                        n_saias = (1 if saia_lfundo > 0 else 0) + (1 if saia_frente > 0 else 0)
+                        cs_ilh = alt * n_saias
+                        ls_ilh = max(saia_lfundo, saia_frente) if cs_ilh > 0 else 0
+                        criar_item_p('Ilharga', alt, prof_l, cs_ilh, ls_ilh, 0, 0,
+                                  produto_nome='Ilharga')
                     else:
-                        inner_h = comp_l - mainD
-                    if inner_h > 0:
-                        sides_l.append(('frente', inner_h))
-                    cs, ls, cf, lf, _ilh = calc_saia_fronte(sides_l, bordas, borda_alts, borda_saia_larg)
-                    criar_item_p('Bancada', comp_l, prof_l, cs, ls, cf, lf,
-                              produto_nome='Bancada em L')
-
-                for side_key in ['esquerda', 'direita', 'l_esquerda', 'l_fundo']:
+                        def profundidade_ilharga_lateral(side):
+                            # A largura/profundidade da ilharga lateral deve seguir a bancada
+                            # onde aquela lateral está encostada. Ex.: molhada 60 e seca 50
+                            # => ilharga esquerda 60, ilharga direita 50 quando a molhada está à esquerda.
+                            prof_m_base = pcfg.get('profMolhada', 60)
+                            prof_s_base = pcfg.get('profSeca', 60)
+
+                            if modelo == 'toda_molhada':
+                                return prof_m_base
+                            if modelo == 'toda_seca':
+                                return prof_s_base
+
+                            if modelo == 'molhada_esq_seca_dir':
+                                return prof_m_base if side == 'esquerda' else prof_s_base
+                            if modelo == 'molhada_dir_seca_esq':
+                                return prof_s_base if side == 'esquerda' else prof_m_base
+
+                            if modelo == 'molhada_centro_seca_lat':
+                                return pcfg.get('profSecaEsq', prof_s_base) if side == 'esquerda' else pcfg.get('profSecaDir', prof_s_base)
+                            if modelo == 'seca_centro_molhada_lat':
+                                return pcfg.get('profMolhadaEsq', prof_m_base) if side == 'esquerda' else pcfg.get('profMolhadaDir', prof_m_base)
+
+                            # Modelos em L: a lateral externa padrão acompanha a peça seca do braço/lateral.
+                            # As laterais específicas do L continuam tratadas em l_esquerda/l_fundo acima.
+                            if modelo in ['l_seca_molhada', 'l_seca_molhada_seca']:
+                                if side == 'esquerda':
+                                    return pcfg.get('profL', prof_s_base)
+                                return prof_s_base if has_seca else prof_m_base
+
+                            return prof_m_base if has_molhada else prof_s_base
+
+                        prof_ilh = profundidade_ilharga_lateral(side_key)
+                        saia_frente = borda_saia_larg.get('frente', 10) if bordas.get('frente') in ['saia'] else 0
+                        saia_fundo = borda_saia_larg.get('fundo', 10) if bordas.get('fundo') in ['saia'] else 0
+                        n_saias = (1 if saia_frente > 0 else 0) + (1 if saia_fundo > 0 else 0)
+                        cs_ilh = alt * n_saias
+                        ls_ilh = max(saia_frente, saia_fundo) if cs_ilh > 0 else 0
+                        criar_item_p('Ilharga', alt, prof_ilh, cs_ilh, ls_ilh, 0, 0,
+                                  produto_nome='Ilharga')
+
+            for side_key in ['frente', 'fundo']:
+                if bordas.get(side_key) == 'ilharga':
+                    alt = borda_alts.get(side_key, 92)
+                    comp_total = 0
+                    if has_molhada:
+                        comp_total += pcfg.get('compMolhada', 120)
+                    if has_seca:
+                        comp_total += pcfg.get('compSeca', 120)
+                    if not comp_total:
+                        comp_total = 120
+                    saia_esq = borda_saia_larg.get('esquerda', 10) if bordas.get('esquerda') == 'saia' else 0
+                    saia_dir = borda_saia_larg.get('direita', 10) if bordas.get('direita') == 'saia' else 0
+                    n_saias = (1 if saia_esq > 0 else 0) + (1 if saia_dir > 0 else 0)
+                    cs_ilh = alt * n_saias
+                    ls_ilh = max(saia_esq, saia_dir) if cs_ilh > 0 else 0
+                    criar_item_p('Ilharga', comp_total, alt, cs_ilh, ls_ilh, 0, 0,
+                              produto_nome='Ilharga')
+
+        elif produto == 'lavatorio':
+            comp = pcfg.get('compGen', 120)
+            prof = pcfg.get('profGen', 55)
+            lav_modelo = pcfg.get('lavModelo', 'retangular')
+            if lav_modelo == 'violao':
+                rec_larg = pcfg.get('lavRecorteLarg', 70)
+                rec_alt = pcfg.get('lavRecorteAlt', 35)
+                espelhar = pcfg.get('espelhar', False)
+                if espelhar:
+                    esq_dim = prof - rec_alt
+                    dir_dim = prof
+                else:
+                    esq_dim = prof
+                    dir_dim = prof - rec_alt
+                lav_sides = [
+                    ('fundo', comp),
+                    ('frente', comp),
+                    ('esquerda', esq_dim),
+                    ('direita', dir_dim),
+                    ('direita2', rec_alt),
+                ]
+            else:
+                lav_sides = [('fundo', comp), ('frente', comp), ('esquerda', prof), ('direita', prof)]
+            cs, ls, cf, lf, _ilh = calc_saia_fronte(lav_sides, bordas, borda_alts, borda_saia_larg)
+            tc = pcfg.get('tipoCuba', '') if pcfg.get('cuba') else ''
+            qc = pcfg.get('cubaQtd', 1) if tc else 0
+            lav_modelo = pcfg.get('lavModelo', 'retangular')
+            lav_nome = 'Lavatorio Violao' if lav_modelo == 'violao' else 'Lavatorio Retangular'
+            criar_item_p('Lavatorio', comp, prof, cs, ls, cf, lf,
+                      tipo_cuba=tc, qtd_cubas=qc,
+                      comp_cuba=pcfg.get('cubaComp',0), larg_cuba=pcfg.get('cubaLarg',0), prof_cuba=pcfg.get('cubaAlt',0),
+                      produto_nome=lav_nome)
+
+            if lav_modelo != 'violao':
+                for side_key in ['esquerda', 'direita']:
                     if bordas.get(side_key) == 'ilharga':
                         alt = borda_alts.get(side_key, 92)
-                        if side_key == 'l_fundo':
-                            comp_l = pcfg.get('compL', 120)
-                            saia_lesq = borda_saia_larg.get('l_esquerda', 10) if bordas.get('l_esquerda') == 'saia' else 0
-                            saia_esq = borda_saia_larg.get('esquerda', 10) if bordas.get('esquerda') == 'saia' else 0
-                            n_saias = (1 if saia_lesq > 0 else 0) + (1 if saia_esq > 0 else 0)
-                            cs_ilh = alt * n_saias
-                            ls_ilh = max(saia_lesq, saia_esq) if cs_ilh > 0 else 0
-                            criar_item_p('Ilharga', comp_l, alt, cs_ilh, ls_ilh, 0, 0,
-                                      produto_nome='Ilharga')
-                        elif side_key == 'l_esquerda':
-                            prof_l = pcfg.get('profL', 60)
-                            saia_lfundo = borda_saia_larg.get('l_fundo', 10) if bordas.get('l_fundo') == 'saia' else 0
-                            saia_frente = borda_saia_larg.get('frente', 10) if bordas.get('frente') == 'saia' else 0
-                            n_saias = (1 if saia_lfundo > 0 else 0) + (1 if saia_frente > 0 else 0)
-                            cs_ilh = alt * n_saias
-                            ls_ilh = max(saia_lfundo, saia_frente) if cs_ilh > 0 else 0
-                            criar_item_p('Ilharga', alt, prof_l, cs_ilh, ls_ilh, 0, 0,
-                                      produto_nome='Ilharga')
-                        else:
-                            def profundidade_ilharga_lateral(side):
-                                # A largura/profundidade da ilharga lateral deve seguir a bancada
-                                # onde aquela lateral está encostada. Ex.: molhada 60 e seca 50
-                                # => ilharga esquerda 60, ilharga direita 50 quando a molhada está à esquerda.
-                                prof_m_base = pcfg.get('profMolhada', 60)
-                                prof_s_base = pcfg.get('profSeca', 60)
-
-                                if modelo == 'toda_molhada':
-                                    return prof_m_base
-                                if modelo == 'toda_seca':
-                                    return prof_s_base
-
-                                if modelo == 'molhada_esq_seca_dir':
-                                    return prof_m_base if side == 'esquerda' else prof_s_base
-                                if modelo == 'molhada_dir_seca_esq':
-                                    return prof_s_base if side == 'esquerda' else prof_m_base
-
-                                if modelo == 'molhada_centro_seca_lat':
-                                    return pcfg.get('profSecaEsq', prof_s_base) if side == 'esquerda' else pcfg.get('profSecaDir', prof_s_base)
-                                if modelo == 'seca_centro_molhada_lat':
-                                    return pcfg.get('profMolhadaEsq', prof_m_base) if side == 'esquerda' else pcfg.get('profMolhadaDir', prof_m_base)
-
-                                # Modelos em L: a lateral externa padrão acompanha a peça seca do braço/lateral.
-                                # As laterais específicas do L continuam tratadas em l_esquerda/l_fundo acima.
-                                if modelo in ['l_seca_molhada', 'l_seca_molhada_seca']:
-                                    if side == 'esquerda':
-                                        return pcfg.get('profL', prof_s_base)
-                                    return prof_s_base if has_seca else prof_m_base
-
-                                return prof_m_base if has_molhada else prof_s_base
-
-                            prof_ilh = profundidade_ilharga_lateral(side_key)
-                            saia_frente = borda_saia_larg.get('frente', 10) if bordas.get('frente') in ['saia'] else 0
-                            saia_fundo = borda_saia_larg.get('fundo', 10) if bordas.get('fundo') in ['saia'] else 0
-                            n_saias = (1 if saia_frente > 0 else 0) + (1 if saia_fundo > 0 else 0)
-                            cs_ilh = alt * n_saias
-                            ls_ilh = max(saia_frente, saia_fundo) if cs_ilh > 0 else 0
-                            criar_item_p('Ilharga', alt, prof_ilh, cs_ilh, ls_ilh, 0, 0,
-                                      produto_nome='Ilharga')
+                        saia_frente = borda_saia_larg.get('frente', 10) if bordas.get('frente') == 'saia' else 0
+                        saia_fundo = borda_saia_larg.get('fundo', 10) if bordas.get('fundo') == 'saia' else 0
+                        n_saias = (1 if saia_frente > 0 else 0) + (1 if saia_fundo > 0 else 0)
+                        cs_ilh = alt * n_saias
+                        ls_ilh = max(saia_frente, saia_fundo) if cs_ilh > 0 else 0
+                        criar_item_p('Ilharga', alt, prof, cs_ilh, ls_ilh, 0, 0,
+                                  produto_nome='Ilharga')
 
                 for side_key in ['frente', 'fundo']:
                     if bordas.get(side_key) == 'ilharga':
                         alt = borda_alts.get(side_key, 92)
-                        comp_total = 0
-                        if has_molhada:
-                            comp_total += pcfg.get('compMolhada', 120)
-                        if has_seca:
-                            comp_total += pcfg.get('compSeca', 120)
-                        if not comp_total:
-                            comp_total = 120
                         saia_esq = borda_saia_larg.get('esquerda', 10) if bordas.get('esquerda') == 'saia' else 0
                         saia_dir = borda_saia_larg.get('direita', 10) if bordas.get('direita') == 'saia' else 0
                         n_saias = (1 if saia_esq > 0 else 0) + (1 if saia_dir > 0 else 0)
                         cs_ilh = alt * n_saias
                         ls_ilh = max(saia_esq, saia_dir) if cs_ilh > 0 else 0
-                        criar_item_p('Ilharga', comp_total, alt, cs_ilh, ls_ilh, 0, 0,
+                        criar_item_p('Ilharga', comp, alt, cs_ilh, ls_ilh, 0, 0,
                                   produto_nome='Ilharga')
 
-            elif produto == 'lavatorio':
-                comp = pcfg.get('compGen', 120)
-                prof = pcfg.get('profGen', 55)
-                lav_modelo = pcfg.get('lavModelo', 'retangular')
-                if lav_modelo == 'violao':
-                    rec_larg = pcfg.get('lavRecorteLarg', 70)
-                    rec_alt = pcfg.get('lavRecorteAlt', 35)
-                    espelhar = pcfg.get('espelhar', False)
-                    if espelhar:
-                        esq_dim = prof - rec_alt
-                        dir_dim = prof
-                    else:
-                        esq_dim = prof
-                        dir_dim = prof - rec_alt
-                    lav_sides = [
-                        ('fundo', comp),
-                        ('frente', comp),
-                        ('esquerda', esq_dim),
-                        ('direita', dir_dim),
-                        ('direita2', rec_alt),
-                    ]
-                else:
-                    lav_sides = [('fundo', comp), ('frente', comp), ('esquerda', prof), ('direita', prof)]
-                cs, ls, cf, lf, _ilh = calc_saia_fronte(lav_sides, bordas, borda_alts, borda_saia_larg)
-                tc = pcfg.get('tipoCuba', '') if pcfg.get('cuba') else ''
-                qc = pcfg.get('cubaQtd', 1) if tc else 0
-                lav_modelo = pcfg.get('lavModelo', 'retangular')
-                lav_nome = 'Lavatorio Violao' if lav_modelo == 'violao' else 'Lavatorio Retangular'
-                criar_item_p('Lavatorio', comp, prof, cs, ls, cf, lf,
-                          tipo_cuba=tc, qtd_cubas=qc,
-                          comp_cuba=pcfg.get('cubaComp',0), larg_cuba=pcfg.get('cubaLarg',0), prof_cuba=pcfg.get('cubaAlt',0),
-                          produto_nome=lav_nome)
-
-                if lav_modelo != 'violao':
-                    for side_key in ['esquerda', 'direita']:
-                        if bordas.get(side_key) == 'ilharga':
-                            alt = borda_alts.get(side_key, 92)
-                            saia_frente = borda_saia_larg.get('frente', 10) if bordas.get('frente') == 'saia' else 0
-                            saia_fundo = borda_saia_larg.get('fundo', 10) if bordas.get('fundo') == 'saia' else 0
-                            n_saias = (1 if saia_frente > 0 else 0) + (1 if saia_fundo > 0 else 0)
-                            cs_ilh = alt * n_saias
-                            ls_ilh = max(saia_frente, saia_fundo) if cs_ilh > 0 else 0
-                            criar_item_p('Ilharga', alt, prof, cs_ilh, ls_ilh, 0, 0,
-                                      produto_nome='Ilharga')
-
-                    for side_key in ['frente', 'fundo']:
-                        if bordas.get(side_key) == 'ilharga':
-                            alt = borda_alts.get(side_key, 92)
-                            saia_esq = borda_saia_larg.get('esquerda', 10) if bordas.get('esquerda') == 'saia' else 0
-                            saia_dir = borda_saia_larg.get('direita', 10) if bordas.get('direita') == 'saia' else 0
-                            n_saias = (1 if saia_esq > 0 else 0) + (1 if saia_dir > 0 else 0)
-                            cs_ilh = alt * n_saias
-                            ls_ilh = max(saia_esq, saia_dir) if cs_ilh > 0 else 0
-                            criar_item_p('Ilharga', comp, alt, cs_ilh, ls_ilh, 0, 0,
-                                      produto_nome='Ilharga')
-
-            elif produto == 'nicho':
-                criar_item_p('Nicho', pcfg.get('nichoLarg', 60), pcfg.get('nichoAlt', 30), 0, 0, 0, 0,
-                           prof_nicho=pcfg.get('nichoProf', 12),
-                           tem_fundo='Sim' if pcfg.get('nichoFundo', True) else 'Não',
-                           tem_alisar='Sim' if pcfg.get('nichoAlisar', False) else 'Não',
-                           larg_alisar=pcfg.get('nichoAlisarMedida', 0),
-                           produto_nome='Nicho')
-
-            elif produto == 'soleira':
-                soleiras_list = pcfg.get('soleiras')
-                if soleiras_list and isinstance(soleiras_list, list):
-                    for s in soleiras_list:
-                        qtd = int(s.get('qtd', 1))
-                        criar_item_p('Soleira', s.get('larg', 80), s.get('prof', 15), 0, 0, 0, 0,
-                                   produto_nome='Soleira', quantidade=qtd)
-                else:
-                    qtd_soleira = int(pcfg.get('soleiraQtd', 1))
-                    criar_item_p('Soleira', pcfg.get('soleiraLarg', 80), pcfg.get('soleiraProf', 15), 0, 0, 0, 0,
-                               produto_nome='Soleira', quantidade=qtd_soleira)
+        elif produto == 'nicho':
+            criar_item_p('Nicho', pcfg.get('nichoLarg', 60), pcfg.get('nichoAlt', 30), 0, 0, 0, 0,
+                       prof_nicho=pcfg.get('nichoProf', 12),
+                       tem_fundo='Sim' if pcfg.get('nichoFundo', True) else 'Não',
+                       tem_alisar='Sim' if pcfg.get('nichoAlisar', False) else 'Não',
+                       larg_alisar=pcfg.get('nichoAlisarMedida', 0),
+                       produto_nome='Nicho')
+
+        elif produto == 'soleira':
+            soleiras_list = pcfg.get('soleiras')
+            if soleiras_list and isinstance(soleiras_list, list):
+                for s in soleiras_list:
+                    qtd = int(s.get('qtd', 1))
+                    criar_item_p('Soleira', s.get('larg', 80), s.get('prof', 15), 0, 0, 0, 0,
+                               produto_nome='Soleira', quantidade=qtd)
+            else:
+                qtd_soleira = int(pcfg.get('soleiraQtd', 1))
+                criar_item_p('Soleira', pcfg.get('soleiraLarg', 80), pcfg.get('soleiraProf', 15), 0, 0, 0, 0,
+                           produto_nome='Soleira', quantidade=qtd_soleira)
+
+    for pcfg in produtos_cfg:
+        processar_produto_cfg(pcfg)
+
+    if not itens_gerados:
+        raise ValueError('Nenhum item gerado')
+
+    # Produtos em uma consulta; os que faltam entram no mesmo flush dos itens
+    nomes_produtos = list(dict.fromkeys(produto_nome for _, produto_nome in itens_gerados if produto_nome))
+    produtos = {}
+    if nomes_produtos:
+        produtos = {
+            prod.nome: prod
+            for prod in Produto.query.filter(Produto.dono == dono_cpf, Produto.nome.in_(nomes_produtos))
+        }
+    for nome_produto in nomes_produtos:
+        if nome_produto not in produtos:
+            produtos[nome_produto] = Produto(nome=nome_produto, dono=dono_cpf)
+            db.session.add(produtos[nome_produto])
+    for orc, produto_nome in itens_gerados:
+        orc.produto = produtos.get(produto_nome)
+    orcamentos_gerados = [orc for orc, _ in itens_gerados]
+    db.session.add_all(orcamentos_gerados)
+    db.session.flush()
+    orcamento_ids = [orc.id for orc in orcamentos_gerados]
 
-        processar_produto_cfg(cfg)
+    empresa = empresa_config_dict()
+    orc_salvo = OrcamentoSalvo(
+        valor_total=sum(orc.valor_total for orc in orcamentos_gerados),
+        criado_por='Configurador Online',
+        tipo_cliente='Cliente Online',
+        prazo_entrega=int(empresa.get('prazo_entrega_padrao') or 15),
+        desconto_avista=float(empresa.get('desconto_avista_padrao') or 5),
+        desconto_parcelado=float(empresa.get('desconto_parcelado_padrao') or 10),
+        observacoes=empresa.get('observacoes_padrao') or _config_empresa_fallback()['observacoes_padrao'],
+        exclude_payments=pagamentos_excluidos_padrao(empresa),
+        max_parcelas=int(empresa.get('max_parcelas_padrao') or 10),
+        valor_minimo_parcela=float(empresa.get('valor_minimo_parcela') or 100),
+        pagamentos_config_json=json.dumps(pagamentos_config_padrao(empresa), ensure_ascii=False),
+    )
+    orc_salvo.definir_itens(orcamento_ids)
+    orc_salvo.gerar_codigo()
+    db.session.add(orc_salvo)
+    db.session.flush()
+
+    todos_desenhos = []
+    for extra in cfg.get('produtosExtras', []):
+        d = extra.get('desenho', '')
+        if d:
+            todos_desenhos.append(d)
+    desenho_data = cfg.get('desenho', '')
+    if desenho_data:
+        todos_desenhos.append(desenho_data)
+    for dd in todos_desenhos:
+        # Só imagens PNG, JPEG ou WebP de verdade entram; SVG, HTML e afins são descartados
+        if imagem_data_uri(dd) is None:
+            print(f"[Configurador] Desenho descartado em {orc_salvo.codigo}: não é PNG, JPEG nem WebP")
+            continue
+        desenho = DesenhoOrdemServico(
+            orcamento_salvo_codigo=orc_salvo.codigo,
+            desenho_data=dd
+        )
+        db.session.add(desenho)
 
-        for extra in cfg.get('produtosExtras', []):
-            if extra.get('produto'):
-                processar_produto_cfg(extra)
+    db.session.commit()
+    return orc_salvo
+
+
+# Fila de entrada do configurador público, em disco (CONFIGURADOR_FILA_DIR) para
+# sobreviver a reinícios e valer para todos os workers. A rota confere o pedido,
+# grava o envio como <ticket>.pedido e devolve o ticket; o worker de cada processo
+# pega os pedidos renomeando-os para .gravando e grava um de cada vez, para uma
+# rajada de envios não disputar a trava de escrita do SQLite. O andamento de cada
+# pedido fica em <ticket>.status, lido por qualquer worker na consulta do ticket.
+configurador_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="configurador")
+PEDIDO_CONFIGURADOR_TTL = 3600  # segundos que um pedido concluído continua consultável
+PEDIDO_CONFIGURADOR_ORFAO = 600  # segundos até um .gravando de processo morto voltar para a fila
+
+# Balde de fichas por IP: CONFIGURADOR_RAJADA envios seguidos, repostos aos poucos
+_baldes_configurador = {}  # ip -> [fichas, instante da última reposição]
+_baldes_configurador_lock = threading.Lock()
+
+
+def consumir_ficha_configurador(ip, agora=None):
+    """Tira uma ficha do balde do IP; devolve 0 se o envio pode seguir ou os segundos até a próxima ficha."""
+    agora = time.monotonic() if agora is None else agora
+    capacidade = max(1, Config.CONFIGURADOR_RAJADA)
+    por_segundo = Config.CONFIGURADOR_POR_MINUTO / 60
+    with _baldes_configurador_lock:
+        if len(_baldes_configurador) > 10000:
+            # Quem já estaria com o balde cheio não precisa ocupar memória
+            cheio = capacidade / por_segundo if por_segundo > 0 else float("inf")
+            for chave, (_, instante) in list(_baldes_configurador.items()):
+                if agora - instante >= cheio:
+                    del _baldes_configurador[chave]
+        balde = _baldes_configurador.setdefault(ip, [capacidade, agora])
+        balde[0] = min(capacidade, balde[0] + (agora - balde[1]) * por_segundo)
+        balde[1] = agora
+        if balde[0] >= 1:
+            balde[0] -= 1
+            return 0
+        if por_segundo <= 0:
+            return 60
+        return (1 - balde[0]) / por_segundo
+
+
+def _arquivo_fila_configurador(ticket, extensao):
+    return os.path.join(Config.CONFIGURADOR_FILA_DIR, f"{ticket}.{extensao}")
+
+
+def _gravar_arquivo_fila_configurador(caminho, dados):
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, "wb") as arquivo:
+        arquivo.write(dados)
+    os.replace(temporario, caminho)
+
+
+def _gravar_status_pedido_configurador(pedido):
+    dados = json.dumps(pedido, ensure_ascii=False).encode("utf-8")
+    _gravar_arquivo_fila_configurador(_arquivo_fila_configurador(pedido["ticket"], "status"), dados)
+
+
+def _arrumar_fila_configurador(agora):
+    """Apaga status vencidos, devolve à fila os pedidos órfãos e retorna os bytes pendentes."""
+    pendentes = 0
+    try:
+        entradas = list(os.scandir(Config.CONFIGURADOR_FILA_DIR))
+    except FileNotFoundError:
+        return 0
+    for entrada in entradas:
+        try:
+            info = entrada.stat()
+            if entrada.name.endswith(".pedido"):
+                pendentes += info.st_size
+            elif entrada.name.endswith(".gravando"):
+                pendentes += info.st_size
+                if agora - info.st_mtime > PEDIDO_CONFIGURADOR_ORFAO:
+                    # O processo que pegou o pedido morreu antes de terminar
+                    os.rename(entrada.path, entrada.path[:-len(".gravando")] + ".pedido")
+            elif agora - info.st_mtime > PEDIDO_CONFIGURADOR_TTL:
+                os.remove(entrada.path)
+        except FileNotFoundError:
+            continue  # outro worker mexeu no arquivo no meio da varredura
+    return pendentes
+
+
+def enfileirar_pedido_configurador(corpo, dono_cpf, url_root):
+    """Grava o envio na fila em disco e agenda a gravação; devolve o pedido ou None se a fila estiver cheia."""
+    agora = time.time()
+    limite = Config.CONFIGURADOR_FILA_MAX_MB * 1024 * 1024
+    if _arrumar_fila_configurador(agora) + len(corpo) > limite:
+        return None
+    ticket = secrets.token_urlsafe(12)
+    cabecalho = json.dumps({"dono": dono_cpf, "url_root": url_root, "recebido_em": agora})
+    os.makedirs(Config.CONFIGURADOR_FILA_DIR, exist_ok=True)
+    _gravar_arquivo_fila_configurador(
+        _arquivo_fila_configurador(ticket, "pedido"), cabecalho.encode("utf-8") + b"\n" + corpo
+    )
+    configurador_executor.submit(drenar_fila_configurador)
+    return {"ticket": ticket, "status": "na fila", "recebido_em": agora}
 
-        if not orcamento_ids:
-            return jsonify({'success': False, 'error': 'Nenhum item gerado'}), 400
 
-        empresa = empresa_config_dict()
-        orc_salvo = OrcamentoSalvo(
-            orcamentos_ids=','.join(orcamento_ids),
-            valor_total=sum(Orcamento.query.get(int(i)).valor_total for i in orcamento_ids),
-            criado_por='Configurador Online',
-            tipo_cliente='Cliente Online',
-            prazo_entrega=int(empresa.get('prazo_entrega_padrao') or 15),
-            desconto_avista=float(empresa.get('desconto_avista_padrao') or 5),
-            desconto_parcelado=float(empresa.get('desconto_parcelado_padrao') or 10),
-            observacoes=empresa.get('observacoes_padrao') or _config_empresa_fallback()['observacoes_padrao'],
-            exclude_payments=pagamentos_excluidos_padrao(empresa),
-            max_parcelas=int(empresa.get('max_parcelas_padrao') or 10),
-            valor_minimo_parcela=float(empresa.get('valor_minimo_parcela') or 100),
-            pagamentos_config_json=json.dumps(pagamentos_config_padrao(empresa), ensure_ascii=False),
-        )
-        orc_salvo.gerar_codigo()
-        db.session.add(orc_salvo)
-        db.session.flush()
+def drenar_fila_configurador():
+    """Grava os pedidos da fila em disco, dos mais antigos aos mais novos, até ela esvaziar."""
+    while True:
+        _arrumar_fila_configurador(time.time())
+        pedidos = []
+        try:
+            for entrada in os.scandir(Config.CONFIGURADOR_FILA_DIR):
+                if entrada.name.endswith(".pedido"):
+                    try:
+                        pedidos.append((entrada.stat().st_mtime, entrada.name[:-len(".pedido")]))
+                    except FileNotFoundError:
+                        continue
+        except FileNotFoundError:
+            return
+        if not pedidos:
+            return
+        for _, ticket in sorted(pedidos):
+            caminho = _arquivo_fila_configurador(ticket, "gravando")
+            try:
+                os.rename(_arquivo_fila_configurador(ticket, "pedido"), caminho)
+                os.utime(caminho, None)  # o prazo de órfão conta a partir de agora
+            except FileNotFoundError:
+                continue  # outro worker já pegou este pedido
+            try:
+                _processar_pedido_configurador(ticket, caminho)
+            except Exception as exc:
+                print(f"[Configurador] Falha ao processar o pedido {ticket}: {exc}")
+
+
+def _processar_pedido_configurador(ticket, caminho):
+    pedido = {"ticket": ticket, "status": "processando"}
+    try:
+        with open(caminho, "rb") as arquivo:
+            cabecalho = json.loads(arquivo.readline())
+            cfg = json.loads(arquivo.read())
+    except (OSError, ValueError) as exc:
+        print(f"[Configurador] Pedido {ticket} ilegível na fila: {exc}")
+        pedido.update(status="erro", erro="Não foi possível gravar o orçamento. Tente novamente.",
+                      concluido_em=time.time())
+        _gravar_status_pedido_configurador(pedido)
+        os.remove(caminho)
+        return
+    pedido["recebido_em"] = cabecalho["recebido_em"]
+    _gravar_status_pedido_configurador(pedido)
 
-        todos_desenhos = []
-        for extra in cfg.get('produtosExtras', []):
-            d = extra.get('desenho', '')
-            if d:
-                todos_desenhos.append(d)
-        desenho_data = cfg.get('desenho', '')
-        if desenho_data:
-            todos_desenhos.append(desenho_data)
-        for dd in todos_desenhos:
-            desenho = DesenhoOrdemServico(
-                orcamento_salvo_codigo=orc_salvo.codigo,
-                desenho_data=dd
+    # Contexto de requisição para o PDF pré-renderizado sair com a mesma URL base do envio
+    with app.test_request_context(base_url=cabecalho["url_root"]):
+        orc_salvo = None
+        try:
+            orc_salvo = gravar_orcamento_configurador(cfg, cabecalho["dono"])
+        except ValueError as exc:
+            db.session.rollback()
+            pedido.update(status="erro", erro=str(exc))
+        except Exception as exc:
+            db.session.rollback()
+            pedido.update(status="erro", erro="Não foi possível gravar o orçamento. Tente novamente.")
+            print(f"[Configurador] Pedido {ticket} não gravado: {exc}")
+        else:
+            pedido.update(
+                status="concluido",
+                codigo=orc_salvo.codigo,
+                token=gerar_token_orcamento(orc_salvo.codigo),
             )
-            db.session.add(desenho)
+        # Status e remoção logo após o commit, para um reinício não gravar o pedido de novo
+        pedido["concluido_em"] = time.time()
+        _gravar_status_pedido_configurador(pedido)
+        os.remove(caminho)
+        if orc_salvo is not None:
+            preaquecer_pdf_orcamento(orc_salvo)
 
-        db.session.commit()
 
-        token = gerar_token_orcamento(orc_salvo.codigo)
-        return jsonify({'success': True, 'codigo': orc_salvo.codigo, 'token': token})
+def ler_pedido_configurador(ticket):
+    """Status do pedido pelo ticket, em qualquer worker; None se não existir ou já venceu."""
+    if not ticket or secure_filename(ticket) != ticket:
+        return None
+    try:
+        with open(_arquivo_fila_configurador(ticket, "status"), encoding="utf-8") as arquivo:
+            return json.load(arquivo)
+    except FileNotFoundError:
+        pass
+    for extensao in ("pedido", "gravando"):
+        if os.path.exists(_arquivo_fila_configurador(ticket, extensao)):
+            return {"ticket": ticket, "status": "na fila"}
+    return None
+
+
+def _resposta_pedido_configurador(pedido, codigo_http=200):
+    dados = {
+        "success": pedido["status"] != "erro",
+        "ticket": pedido["ticket"],
+        "status": pedido["status"],
+        "status_url": url_for("status_pedido_configurador", ticket=pedido["ticket"]),
+    }
+    if pedido["status"] == "concluido":
+        dados.update(codigo=pedido["codigo"], token=pedido["token"])
+    elif pedido["status"] == "erro":
+        dados["error"] = pedido.get("erro")
+    resposta = jsonify(dados)
+    resposta.status_code = codigo_http
+    resposta.headers["Cache-Control"] = "no-store"
+    return resposta
+
+
+def _recusar_pedido_configurador(mensagem, codigo_http, retry_after=None):
+    resposta = jsonify({'success': False, 'error': mensagem})
+    resposta.status_code = codigo_http
+    if retry_after is not None:
+        resposta.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return resposta
 
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/configurador-orcamento', methods=['POST'])
+def api_configurador_orcamento():
+    limite = int(Config.CONFIGURADOR_PAYLOAD_MAX_MB * 1024 * 1024)
+    if request.content_length is None:
+        return _recusar_pedido_configurador('Tamanho do envio não informado.', 411)
+    if request.content_length > limite:
+        return _recusar_pedido_configurador('Envio grande demais. Reduza os desenhos e tente novamente.', 413)
+
+    espera = consumir_ficha_configurador(request.remote_addr or '')
+    if espera:
+        return _recusar_pedido_configurador('Muitos envios seguidos. Aguarde alguns instantes.', 429, espera)
+
+    cfg = request.get_json(silent=True)
+    erro = validar_payload_configurador(cfg)
+    if erro:
+        return _recusar_pedido_configurador(erro, 400)
+
+    pedido = enfileirar_pedido_configurador(
+        request.get_data(), session.get('user_cpf', '12233344441'), request.url_root
+    )
+    if pedido is None:
+        return _recusar_pedido_configurador(
+            'Estamos recebendo muitos orçamentos agora. Tente novamente em instantes.', 503, 5
+        )
+    return _resposta_pedido_configurador(pedido, 202)
+
+
+@app.route('/api/configurador-orcamento/<ticket>')
+def status_pedido_configurador(ticket):
+    pedido = ler_pedido_configurador(ticket)
+    if pedido is None:
+        return jsonify({'success': False, 'status': 'erro', 'error': 'Pedido não encontrado'}), 404
+    return _resposta_pedido_configurador(pedido)
 
 WHATSAPP_VERIFY_TOKEN = os.getenv('WHATSAPP_VERIFY_TOKEN', 'primemarble2026')
 
@@ -2313,13 +3572,65 @@ def whatsapp_webhook_verify():
 def whatsapp_webhook_receive():
     return jsonify({'status': 'ok'}), 200
 
+@app.route('/desenhos/<sha>')
+def desenho_blob(sha):
+    """Imagem do configurador ou a miniatura dela pelo hash do conteúdo, que nunca muda para a mesma URL."""
+    if 'user_cpf' not in session:
+        abort(403)
+    linha = db.session.query(DesenhoOrdemServico.desenho_hash, DesenhoOrdemServico.desenho_mime).filter(
+        or_(DesenhoOrdemServico.desenho_hash == sha, DesenhoOrdemServico.miniatura_hash == sha)
+    ).first()
+    if linha is None or linha.desenho_mime not in MIMES_IMAGEM_DESENHO.values():
+        abort(404)
+
+    resposta = make_response()
+    resposta.set_etag(sha)
+    resposta.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    # Mesmo aberto direto na aba, o arquivo não roda script nem é reinterpretado pelo navegador
+    resposta.headers["X-Content-Type-Options"] = "nosniff"
+    resposta.headers["Content-Security-Policy"] = "sandbox"
+    if request.if_none_match.contains(sha):
+        resposta.status_code = 304
+        return resposta
+    try:
+        dados = armazem_blobs.ler(sha)
+    except OSError:
+        abort(404)
+    # O tipo vem dos bytes, não do cabeçalho do data URI enviado pelo cliente
+    mime = mime_imagem_desenho(dados)
+    if mime is None:
+        abort(404)
+    resposta.set_data(dados)
+    resposta.mimetype = mime
+    return resposta
+
+@app.route('/logo/<sha>', defaults={'tamanho': None})
+@app.route('/logo/<sha>/<tamanho>')
+def logo_empresa_arquivo(sha, tamanho):
+    """Logo da empresa pelo hash do conteúdo; público porque aparece no login e no link do orçamento."""
+    logo = logo_empresa()
+    if not logo.hash or sha != logo.hash or (tamanho and tamanho not in TAMANHOS_LOGO):
+        abort(404)
+
+    etag = f"{sha}-{tamanho}" if tamanho else sha
+    resposta = make_response()
+    resposta.set_etag(etag)
+    resposta.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    if request.if_none_match.contains(etag):
+        resposta.status_code = 304
+        return resposta
+    dados, mime = variante_logo(logo, tamanho)
+    resposta.set_data(dados)
+    resposta.mimetype = mime
+    return resposta
+
 def _ver_desenho_legado_desativado(codigo):
     abort(404)
     desenhos = [
         d for d in DesenhoOrdemServico.query.filter_by(
             orcamento_salvo_codigo=codigo
         ).order_by(DesenhoOrdemServico.data_criacao.asc()).all()
-        if _eh_imagem_configurador(d.desenho_data)
+        if d.eh_imagem
     ]
     if not desenhos:
         return 'Desenho legado nao encontrado', 404
@@ -2336,13 +3647,10 @@ def _ver_desenho_legado_desativado(codigo):
 
         telefone = ''
         endereco = ''
-        if orc_salvo.orcamentos_ids:
-            pid = orc_salvo.orcamentos_ids.split(",")[0].strip()
-            if pid.isdigit():
-                po = Orcamento.query.get(int(pid))
-                if po and po.cliente:
-                    telefone = escape(po.cliente.telefone or '')
-                    endereco = escape(po.cliente.endereco or '')
+        cliente_salvo = _cliente_do_orcamento_salvo(orc_salvo)
+        if cliente_salvo:
+            telefone = escape(cliente_salvo.telefone or '')
+            endereco = escape(cliente_salvo.endereco or '')
 
         header_html = f'''<div style="background:#12122a;padding:16px 24px;border-bottom:1px solid #2a2a4a;font-family:Arial,sans-serif;color:#ccc;display:flex;flex-wrap:wrap;gap:8px 24px;align-items:center">
   <span style="color:#fede27;font-weight:700;font-size:18px">{codigo}</span>
@@ -2385,7 +3693,11 @@ def index():
         mes=hoje.month,
         ano=hoje.year,
     )
-    dashboard = _montar_dashboard_vendas(orcamentos, limite_recentes=limite_recentes)
+    dashboard = _montar_dashboard_vendas(
+        _resumo_vendas_visivel(mes_atual, ano_atual),
+        orcamentos,
+        limite_recentes=limite_recentes,
+    )
     meses = {
         1: "Janeiro",
         2: "Fevereiro",
@@ -2409,34 +3721,31 @@ def index():
     )
 
 def _ids_orcamento_salvo(orcamento_salvo):
-    ids = []
-    for item in (orcamento_salvo.orcamentos_ids or "").split(","):
-        item = item.strip()
-        if item.isdigit():
-            ids.append(int(item))
-    return ids
+    return orcamento_salvo.ids_itens
+
+def _orcamentos_salvos_com_itens(orcamento_ids):
+    return (
+        OrcamentoSalvo.query.join(OrcamentoSalvoItem)
+        .filter(OrcamentoSalvoItem.orcamento_id.in_([int(item_id) for item_id in orcamento_ids]))
+        .distinct()
+        .all()
+    )
+
+def _orcamentos_salvos_com_item(orcamento_id):
+    return _orcamentos_salvos_com_itens([orcamento_id])
 
 def _cliente_do_orcamento_salvo(orcamento_salvo):
-    ids = _ids_orcamento_salvo(orcamento_salvo)
-    if not ids:
+    if not orcamento_salvo.cliente_id:
         return None
-    primeiro_orcamento = Orcamento.query.get(ids[0])
-    return primeiro_orcamento.cliente if primeiro_orcamento else None
+    return db.session.get(Cliente, orcamento_salvo.cliente_id)
 
-def _orcamentos_salvos_visiveis():
-    user_cpf = session.get("user_cpf")
-    is_admin = session.get("admin")
-    orcamentos = OrcamentoSalvo.query.order_by(OrcamentoSalvo.data_salvo.desc()).all()
-
-    if is_admin:
-        return orcamentos
+def _filtrar_visiveis(query):
+    if session.get("admin"):
+        return query
+    return query.filter(OrcamentoSalvo.dono == session.get("user_cpf"))
 
-    visiveis = []
-    for orcamento_salvo in orcamentos:
-        cliente = _cliente_do_orcamento_salvo(orcamento_salvo)
-        if cliente and cliente.dono == user_cpf:
-            visiveis.append(orcamento_salvo)
-    return visiveis
+def _orcamentos_salvos_visiveis():
+    return _filtrar_visiveis(OrcamentoSalvo.query)
 
 def _moeda(valor):
     return "R$ {:,.2f}".format(valor or 0).replace(",", "X").replace(".", ",").replace("X", ".")
@@ -2446,6 +3755,312 @@ def _valor_venda_considerado(orcamento):
         return orcamento.valor_venda
     return orcamento.valor_total or 0
 
+# Equivalentes em SQL de `orcamento.status or "Em Espera"` e de _valor_venda_considerado
+STATUS_VENDA_SQL = db.func.coalesce(db.func.nullif(OrcamentoSalvo.status, ""), "Em Espera")
+VALOR_VENDA_CONSIDERADO_SQL = db.case(
+    (
+        db.and_(
+            OrcamentoSalvo.status == "Aprovado",
+            OrcamentoSalvo.valor_venda.isnot(None),
+            OrcamentoSalvo.valor_venda != 0,
+        ),
+        OrcamentoSalvo.valor_venda,
+    ),
+    else_=db.func.coalesce(OrcamentoSalvo.valor_total, 0),
+)
+
+CAMPOS_RESUMO_VENDAS = (
+    "status", "data_salvo", "data_fechamento", "dono", "forma_pagamento",
+    "criado_por", "tipo_cliente", "valor_total", "valor_venda",
+)
+
+def _contribuicao_resumo_vendas(dados):
+    """Chave e totais com que um orçamento salvo entra em vendas_resumo_mensal.
+
+    Segue as mesmas regras de _filtrar_orcamentos_por_periodo; devolve None
+    quando o orçamento não entra em nenhum período.
+    """
+    status = dados["status"] or ""
+    if status in ("", "Em Espera"):
+        data = dados["data_salvo"]
+        if data and data.replace(tzinfo=None) < VENDAS_DATA_INICIAL:
+            return None
+    else:
+        data = dados["data_fechamento"]
+        if not data or data.replace(tzinfo=None) < VENDAS_DATA_INICIAL:
+            return None
+    chave = (
+        data.year if data else 0,
+        data.month if data else 0,
+        dados["dono"] or "",
+        status,
+        dados["forma_pagamento"] or "",
+        dados["criado_por"] or "",
+        dados["tipo_cliente"] or "",
+    )
+    valor_total = dados["valor_total"] or 0
+    valor_considerado = dados["valor_venda"] if status == "Aprovado" and dados["valor_venda"] else valor_total
+    return chave, (1, valor_total, valor_considerado)
+
+def _somar_resumo_vendas(deltas, dados, sinal):
+    contribuicao = _contribuicao_resumo_vendas(dados)
+    if contribuicao:
+        chave, valores = contribuicao
+        acumulado = deltas[chave]
+        for posicao, valor in enumerate(valores):
+            acumulado[posicao] += sinal * valor
+
+def _linha_resumo_vendas(chave, valores):
+    ano, mes, dono, status, forma_pagamento, criado_por, tipo_cliente = chave
+    quantidade, valor_total, valor_considerado = valores
+    return {
+        "ano": ano,
+        "mes": mes,
+        "dono": dono,
+        "status": status,
+        "forma_pagamento": forma_pagamento,
+        "criado_por": criado_por,
+        "tipo_cliente": tipo_cliente,
+        "quantidade": quantidade,
+        "valor_total": valor_total,
+        "valor_considerado": valor_considerado,
+    }
+
+def _aplicar_resumo_vendas(conexao, deltas):
+    tabela = VendasResumoMensal.__table__
+    chaves = ["ano", "mes", "dono", "status", "forma_pagamento", "criado_por", "tipo_cliente"]
+    for chave, valores in deltas.items():
+        if not any(valores):
+            continue
+        insercao = sqlite_insert(tabela).values(**_linha_resumo_vendas(chave, valores))
+        conexao.execute(insercao.on_conflict_do_update(
+            index_elements=chaves,
+            set_={
+                coluna: tabela.c[coluna] + insercao.excluded[coluna]
+                for coluna in ("quantidade", "valor_total", "valor_considerado")
+            },
+        ))
+    conexao.execute(tabela.delete().where(tabela.c.quantidade <= 0))
+
+@event.listens_for(db.session, "before_flush")
+def _atualizar_resumo_vendas(sessao, contexto, instancias):
+    """Aplica no resumo mensal, na mesma transação, as mudanças dos orçamentos salvos."""
+    novos = [obj for obj in sessao.new if isinstance(obj, OrcamentoSalvo)]
+    alterados = [
+        obj for obj in sessao.dirty
+        if isinstance(obj, OrcamentoSalvo)
+        and any(inspect(obj).attrs[campo].history.has_changes() for campo in CAMPOS_RESUMO_VENDAS)
+    ]
+    removidos = [obj for obj in sessao.deleted if isinstance(obj, OrcamentoSalvo)]
+    if not (novos or alterados or removidos):
+        return
+
+    deltas = defaultdict(lambda: [0, 0, 0])
+    conexao = sessao.connection()
+    ids_anteriores = [obj.id for obj in alterados + removidos if obj.id]
+    if ids_anteriores:
+        # Os valores antigos ainda estão no banco; o flush só acontece depois
+        anteriores = conexao.execute(
+            db.select(*[getattr(OrcamentoSalvo, campo) for campo in CAMPOS_RESUMO_VENDAS])
+            .where(OrcamentoSalvo.id.in_(ids_anteriores))
+        )
+        for linha in anteriores:
+            _somar_resumo_vendas(deltas, linha._mapping, -1)
+    for obj in novos:
+        # Os defaults das colunas (status, tipo_cliente) só entram no INSERT
+        for campo in CAMPOS_RESUMO_VENDAS:
+            padrao = OrcamentoSalvo.__table__.c[campo].default
+            if getattr(obj, campo) is None and padrao is not None and padrao.is_scalar:
+                setattr(obj, campo, padrao.arg)
+    for obj in novos + alterados:
+        if obj.data_salvo is None:
+            obj.data_salvo = datetime.utcnow()
+        _somar_resumo_vendas(deltas, {campo: getattr(obj, campo) for campo in CAMPOS_RESUMO_VENDAS}, 1)
+    _aplicar_resumo_vendas(conexao, deltas)
+
+def _resumo_vendas_calculado():
+    deltas = defaultdict(lambda: [0, 0, 0])
+    linhas = db.session.execute(
+        db.select(*[getattr(OrcamentoSalvo, campo) for campo in CAMPOS_RESUMO_VENDAS])
+        .execution_options(yield_per=1000)
+    )
+    for linha in linhas:
+        _somar_resumo_vendas(deltas, linha._mapping, 1)
+    return deltas
+
+def resumo_vendas_divergente():
+    """Compara vendas_resumo_mensal com o resumo recalculado de orcamento_salvo."""
+    calculado = {chave: valores for chave, valores in _resumo_vendas_calculado().items() if any(valores)}
+    tabela = VendasResumoMensal.__table__
+    chaves = ["ano", "mes", "dono", "status", "forma_pagamento", "criado_por", "tipo_cliente"]
+    gravado = {
+        tuple(linha[:7]): linha[7:]
+        for linha in db.session.execute(db.select(
+            *[tabela.c[coluna] for coluna in chaves],
+            tabela.c.quantidade, tabela.c.valor_total, tabela.c.valor_considerado,
+        ))
+    }
+    if calculado.keys() != gravado.keys():
+        return True
+    for chave, (quantidade, valor_total, valor_considerado) in calculado.items():
+        # Os valores gravados somam e subtraem floats a cada mudança; centavos bastam
+        gravado_quantidade, gravado_total, gravado_considerado = gravado[chave]
+        if (
+            quantidade != gravado_quantidade
+            or abs(valor_total - gravado_total) >= 0.01
+            or abs(valor_considerado - gravado_considerado) >= 0.01
+        ):
+            return True
+    return False
+
+def reconstruir_resumo_vendas():
+    deltas = _resumo_vendas_calculado()
+    db.session.execute(VendasResumoMensal.__table__.delete())
+    if deltas:
+        db.session.execute(
+            VendasResumoMensal.__table__.insert(),
+            [_linha_resumo_vendas(chave, valores) for chave, valores in deltas.items()],
+        )
+    db.session.commit()
+    return len(deltas)
+
+@app.cli.command("reconstruir-resumo-vendas")
+@click.option("--se-divergente", is_flag=True, help="Só reconstrói se o resumo não bater com orcamento_salvo.")
+def reconstruir_resumo_vendas_comando(se_divergente):
+    """Recalcula vendas_resumo_mensal a partir de orcamento_salvo."""
+    if se_divergente and not resumo_vendas_divergente():
+        print("Resumo mensal de vendas confere com orcamento_salvo")
+        return
+    grupos = reconstruir_resumo_vendas()
+    print(f"Resumo mensal de vendas reconstruído com {grupos} grupos")
+
+
+# Reprecificação dos itens em aberto quando o valor de um material muda. Um
+# único worker por processo, para duas mudanças não gravarem ao mesmo tempo.
+reprecificacao_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reprecificacao")
+reprecificacoes = {}  # material_id -> resumo da última reprecificação
+_reprecificacao_lock = threading.Lock()
+
+
+def _itens_abertos_do_material(material_id):
+    """Itens do material fora de orçamentos salvos já fechados (status diferente de Em Espera)."""
+    fechados = (
+        db.select(OrcamentoSalvoItem.orcamento_id)
+        .join(OrcamentoSalvo, OrcamentoSalvo.id == OrcamentoSalvoItem.orcamento_salvo_id)
+        .where(STATUS_VENDA_SQL != "Em Espera")
+    )
+    return db.select(Orcamento.id).where(
+        Orcamento.material_id == material_id,
+        Orcamento.id.not_in(fechados),
+    )
+
+
+def reprecificar_material(material_id, resumo=None, lote=None, pausa=0.05):
+    """Recalcula em lotes os itens em aberto do material com o valor e a configuração atuais.
+
+    Cada lote é gravado na própria transação, com os totais dos orçamentos salvos
+    afetados, e há uma pausa entre lotes para não segurar o banco. Preenche e
+    devolve `resumo` com as diferenças encontradas.
+    """
+    lote = lote or Config.REPRECIFICACAO_LOTE
+    resumo = resumo if resumo is not None else {}
+    resumo.update(
+        material_id=material_id,
+        status="processando",
+        itens_verificados=0,
+        itens_alterados=0,
+        valor_antes=0.0,
+        valor_depois=0.0,
+        orcamentos_salvos=[],
+        lotes=0,
+    )
+    inicio = time.perf_counter()
+    codigos_afetados = set()
+    ultimo_id = 0
+    while True:
+        material = db.session.get(Material, material_id)
+        if material is None:
+            resumo.update(status="erro", erro="Material não encontrado.")
+            return resumo
+        ids = db.session.execute(
+            _itens_abertos_do_material(material_id)
+            .where(Orcamento.id > ultimo_id)
+            .order_by(Orcamento.id)
+            .limit(lote)
+        ).scalars().all()
+        if not ids:
+            break
+        ultimo_id = ids[-1]
+
+        # Configuração lida uma vez por lote, não uma vez por item
+        with config_empresa_fixa():
+            opts = opcoes_precificacao_empresa()
+            orcamentos = Orcamento.query.filter(Orcamento.id.in_(ids)).order_by(Orcamento.id).all()
+            valores = regras_precificacao_empresa().calcular_lote(
+                colunas_precificacao_orcamentos(orcamentos, [material.valor] * len(orcamentos), opts)
+            )
+            alterados = []
+            for orcamento, valor_total in zip(orcamentos, valores):
+                if orcamento.valor_total == valor_total:
+                    continue
+                resumo["valor_antes"] += orcamento.valor_total or 0
+                resumo["valor_depois"] += valor_total
+                orcamento.valor_total = valor_total
+                alterados.append(orcamento.id)
+            codigos = atualizar_valores_orcamentos_salvos(alterados)
+            db.session.commit()
+            invalidar_pdf_orcamento(*codigos)
+
+        codigos_afetados.update(codigos)
+        resumo["itens_verificados"] += len(orcamentos)
+        resumo["itens_alterados"] += len(alterados)
+        resumo["orcamentos_salvos"] = sorted(codigos_afetados)
+        resumo["lotes"] += 1
+        if len(ids) < lote:
+            break
+        time.sleep(pausa)
+
+    resumo.update(
+        status="concluido",
+        material=material.nome,
+        valor_material=material.valor,
+        valor_antes=round(resumo["valor_antes"], 2),
+        valor_depois=round(resumo["valor_depois"], 2),
+        diferenca=round(resumo["valor_depois"] - resumo["valor_antes"], 2),
+        segundos=round(time.perf_counter() - inicio, 2),
+    )
+    return resumo
+
+
+def _executar_reprecificacao(material_id, resumo):
+    with app.app_context():
+        try:
+            reprecificar_material(material_id, resumo)
+        except Exception as exc:
+            db.session.rollback()
+            resumo.update(status="erro", erro=str(exc))
+        print(f"[Reprecificação] material {material_id}: {resumo}")
+
+
+def enfileirar_reprecificacao(material_id):
+    """Agenda a reprecificação do material; uma que ainda não começou é reaproveitada."""
+    with _reprecificacao_lock:
+        resumo = reprecificacoes.get(material_id)
+        if resumo is not None and resumo.get("status") == "na fila":
+            return resumo
+        resumo = {"material_id": material_id, "status": "na fila"}
+        reprecificacoes[material_id] = resumo
+    reprecificacao_executor.submit(_executar_reprecificacao, material_id, resumo)
+    return resumo
+
+
+@app.cli.command("reprecificar-material")
+@click.argument("material_id", type=int)
+def reprecificar_material_comando(material_id):
+    """Recalcula agora os itens em aberto de um material e mostra o resumo."""
+    resumo = reprecificar_material(material_id)
+    print(json.dumps(resumo, ensure_ascii=False, indent=2))
+
 def _float_payload(valor):
     if valor in (None, ""):
         return None
@@ -2484,28 +4099,32 @@ def _dados_venda_orcamento(orcamento):
         "final_valor_formatado": _moeda(final_valor),
     }
 
-def _montar_dashboard_vendas(orcamentos, limite_recentes=6):
-    hoje = datetime.now(br_tz).date()
-    total = len(orcamentos)
-    aprovados = [o for o in orcamentos if (o.status or "") == "Aprovado"]
-    espera = [o for o in orcamentos if (o.status or "") == "Em Espera"]
-    declinados = [o for o in orcamentos if (o.status or "") == "Declinado"]
-    valor_total = sum(o.valor_total or 0 for o in orcamentos)
-    valor_aberto = sum(o.valor_total or 0 for o in espera)
-    valor_aprovado = sum(_valor_venda_considerado(o) for o in aprovados)
-    total_decidido = len(aprovados) + len(declinados)
-    taxa_conversao = round((len(aprovados) / total_decidido) * 100, 1) if total_decidido else 0
+def _consulta_com_nome_cliente(query):
+    return (
+        query.outerjoin(Cliente, Cliente.id == OrcamentoSalvo.cliente_id)
+        .add_columns(Cliente.nome)
+        .order_by(None)
+        .order_by(OrcamentoSalvo.data_salvo.desc(), OrcamentoSalvo.id.desc())
+    )
 
+def _orcamentos_com_cliente(query, limite=None):
+    """Materializa apenas as linhas exibidas, já com o nome do cliente."""
+    query = _consulta_com_nome_cliente(query)
+    if limite is not None:
+        query = query.limit(limite)
+    return query.all()
+
+def _linhas_recentes(query, limite=None):
+    hoje = datetime.now(br_tz).date()
     recentes = []
-    for orcamento in orcamentos[:limite_recentes]:
-        cliente = _cliente_do_orcamento_salvo(orcamento)
+    for orcamento, cliente_nome in _orcamentos_com_cliente(query, limite):
         data_salvo = orcamento.data_salvo
         data_base = data_salvo.date() if data_salvo else hoje
         dados_venda = _dados_venda_orcamento(orcamento)
         recentes.append({
             "id": orcamento.id,
             "codigo": orcamento.codigo,
-            "cliente": cliente.nome if cliente else "Não definido",
+            "cliente": cliente_nome or "Não definido",
             "valor": _moeda(orcamento.valor_total),
             "valor_float": orcamento.valor_total or 0,
             "status": orcamento.status or "Em Espera",
@@ -2515,54 +4134,144 @@ def _montar_dashboard_vendas(orcamentos, limite_recentes=6):
             "dias": max((hoje - data_base).days, 0),
             **dados_venda,
         })
+    return recentes
+
+def _montar_dashboard_vendas(resumo, orcamentos, limite_recentes=6):
+    por_status = {}
+    linhas = (
+        resumo.with_entities(
+            VendasResumoMensal.status,
+            db.func.sum(VendasResumoMensal.quantidade),
+            db.func.sum(VendasResumoMensal.valor_total),
+            db.func.sum(VendasResumoMensal.valor_considerado),
+        )
+        .group_by(VendasResumoMensal.status)
+        .all()
+    )
+    for status, quantidade, valor_total_status, valor_considerado in linhas:
+        por_status[status] = (quantidade, valor_total_status or 0, valor_considerado or 0)
+
+    vazio = (0, 0, 0)
+    total = sum(quantidade for quantidade, _, _ in por_status.values())
+    aprovados = por_status.get("Aprovado", vazio)
+    espera = por_status.get("Em Espera", vazio)
+    declinados = por_status.get("Declinado", vazio)
+    valor_total = sum(valor for _, valor, _ in por_status.values())
+    valor_aberto = espera[1]
+    valor_aprovado = aprovados[2]
+    total_decidido = aprovados[0] + declinados[0]
+    taxa_conversao = round((aprovados[0] / total_decidido) * 100, 1) if total_decidido else 0
 
     return {
         "total": total,
-        "aprovados": len(aprovados),
-        "espera": len(espera),
-        "declinados": len(declinados),
+        "aprovados": aprovados[0],
+        "espera": espera[0],
+        "declinados": declinados[0],
         "decididos": total_decidido,
         "taxa_conversao": taxa_conversao,
         "valor_total": _moeda(valor_total),
         "valor_aberto": _moeda(valor_aberto),
         "valor_aprovado": _moeda(valor_aprovado),
         "ticket_medio": _moeda(valor_total / total if total else 0),
-        "recentes": recentes,
+        "recentes": _linhas_recentes(orcamentos, limite_recentes) if limite_recentes else [],
     }
 
-def _filtrar_orcamentos_por_periodo(orcamentos, mes=None, ano=None):
+def _parametro_periodo(valor):
     try:
-        mes = int(mes) if mes not in (None, "", "todos") else None
+        return int(valor) if valor not in (None, "", "todos") else None
     except ValueError:
-        mes = None
+        return None
 
+def _intervalo_periodo(coluna, mes, ano):
     try:
-        ano = int(ano) if ano not in (None, "", "todos") else None
-    except ValueError:
-        ano = None
-
-    filtrados = []
-    data_minima = VENDAS_DATA_INICIAL.date()
-    for orcamento in orcamentos:
-        status = orcamento.status or "Em Espera"
-        if status == "Em Espera":
-            data_criacao = orcamento.data_salvo.date() if orcamento.data_salvo else None
-            if data_criacao and data_criacao < data_minima:
-                continue
-            filtrados.append(orcamento)
-            continue
-
-        data_base = orcamento.data_fechamento
-        if not data_base:
-            continue
-        if data_base.date() < data_minima:
-            continue
-        if ano and data_base.year != ano:
-            continue
-        if mes and data_base.month != mes:
-            continue
-        filtrados.append(orcamento)
-    return filtrados, mes, ano
+        if ano and mes:
+            inicio = datetime(ano, mes, 1)
+            fim = datetime(ano + mes // 12, mes % 12 + 1, 1)
+        elif ano:
+            inicio = datetime(ano, 1, 1)
+            fim = datetime(ano + 1, 1, 1)
+        elif mes:
+            if not 1 <= mes <= 12:
+                return [db.false()]
+            return [db.extract("month", coluna) == mes]
+        else:
+            return []
+    except (ValueError, OverflowError):
+        return [db.false()]
+    return [coluna >= inicio, coluna < fim]
+
+def _filtrar_orcamentos_por_periodo(query, mes=None, ano=None, status=None):
+    mes = _parametro_periodo(mes)
+    ano = _parametro_periodo(ano)
+
+    # Com um status definido fica só o ramo dele, escrito sobre a coluna status
+    # para o SQLite poder usar o índice (status, data_fechamento)
+    if status == "Em Espera":
+        return query.filter(
+            db.or_(OrcamentoSalvo.status.in_(("", "Em Espera")), OrcamentoSalvo.status.is_(None)),
+            db.or_(OrcamentoSalvo.data_salvo.is_(None), OrcamentoSalvo.data_salvo >= VENDAS_DATA_INICIAL),
+        ), mes, ano
+    if status:
+        return query.filter(
+            OrcamentoSalvo.status == status,
+            OrcamentoSalvo.data_fechamento >= VENDAS_DATA_INICIAL,
+            *_intervalo_periodo(OrcamentoSalvo.data_fechamento, mes, ano),
+        ), mes, ano
+
+    # Em Espera conta pela data de criação; os demais pela data de fechamento
+    em_espera = STATUS_VENDA_SQL == "Em Espera"
+    query = query.filter(db.or_(
+        db.and_(
+            em_espera,
+            db.or_(OrcamentoSalvo.data_salvo.is_(None), OrcamentoSalvo.data_salvo >= VENDAS_DATA_INICIAL),
+        ),
+        db.and_(
+            STATUS_VENDA_SQL != "Em Espera",
+            OrcamentoSalvo.data_fechamento >= VENDAS_DATA_INICIAL,
+            *_intervalo_periodo(OrcamentoSalvo.data_fechamento, mes, ano),
+        ),
+    ))
+    return query, mes, ano
+
+def _resumo_vendas_visivel(mes=None, ano=None, vendedor=None):
+    """Mesmo recorte de _filtrar_orcamentos_por_periodo, lido de vendas_resumo_mensal."""
+    query = VendasResumoMensal.query
+    if not session.get("admin"):
+        query = query.filter(VendasResumoMensal.dono == session.get("user_cpf"))
+    if vendedor:
+        query = query.filter(VendasResumoMensal.criado_por == vendedor)
+    periodo = []
+    if ano:
+        periodo.append(VendasResumoMensal.ano == ano)
+    if mes:
+        periodo.append(VendasResumoMensal.mes == mes)
+    return query.filter(db.or_(
+        VendasResumoMensal.status.in_(("", "Em Espera")),
+        db.and_(db.true(), *periodo),
+    ))
+
+def _agrupar_vendas_aprovadas(query, chave, quantidade, valor, limite=None):
+    linhas = (
+        query.order_by(None)
+        .with_entities(
+            chave.label("chave"),
+            quantidade.label("quantidade"),
+            valor.label("valor"),
+        )
+        .group_by(chave)
+        .order_by(db.desc("valor"))
+    )
+    if limite:
+        linhas = linhas.limit(limite)
+    grupos = {}
+    for nome, quantidade, valor in linhas.all():
+        valor = valor or 0
+        grupos[nome] = {
+            "quantidade": quantidade,
+            "valor": valor,
+            "ticket": valor / quantidade if quantidade else 0,
+        }
+    return grupos
 
 @app.route('/conversao_vendas')
 def conversao_vendas():
@@ -2572,25 +4281,31 @@ def conversao_vendas():
     todos_orcamentos = _orcamentos_salvos_visiveis()
     hoje = datetime.now(br_tz)
     anos_base = set(range(VENDAS_DATA_INICIAL.year, hoje.year + 1))
+    anos_fechamento = (
+        _resumo_vendas_visivel()
+        .with_entities(VendasResumoMensal.ano)
+        .filter(VendasResumoMensal.ano > 0)
+        .distinct()
+        .all()
+    )
     anos_disponiveis = sorted(
-        anos_base | {o.data_fechamento.year for o in todos_orcamentos if o.data_fechamento},
+        anos_base | {ano for (ano,) in anos_fechamento},
         reverse=True,
     )
     mes_filtro = request.args.get("mes", str(hoje.month))
     ano_filtro = request.args.get("ano", str(hoje.year))
     vendedor_filtro = request.args.get("vendedor", "Todos")
     usuarios = Usuario.query.order_by(Usuario.nome).all() if session.get("admin") else []
+    vendedor = None
     if session.get("admin") and vendedor_filtro and vendedor_filtro != "Todos":
-        todos_orcamentos = [
-            orcamento for orcamento in todos_orcamentos
-            if (orcamento.criado_por or "") == vendedor_filtro
-        ]
+        vendedor = vendedor_filtro
+        todos_orcamentos = todos_orcamentos.filter(OrcamentoSalvo.criado_por == vendedor)
     orcamentos, mes_filtro, ano_filtro = _filtrar_orcamentos_por_periodo(
         todos_orcamentos,
         mes=mes_filtro,
         ano=ano_filtro,
     )
-    dashboard = _montar_dashboard_vendas(orcamentos)
+    dashboard = _montar_dashboard_vendas(_resumo_vendas_visivel(mes_filtro, ano_filtro, vendedor), orcamentos)
     meses = [
         (1, "Janeiro"),
         (2, "Fevereiro"),
@@ -2629,7 +4344,7 @@ def conversao_vendas():
             {
                 "id": o.id,
                 "codigo": o.codigo,
-                "cliente": (_cliente_do_orcamento_salvo(o).nome if _cliente_do_orcamento_salvo(o) else "Não definido"),
+                "cliente": cliente_nome or "Não definido",
                 "valor": _moeda(o.valor_total),
                 "valor_float": o.valor_total or 0,
                 "status": o.status or "Em Espera",
@@ -2639,40 +4354,47 @@ def conversao_vendas():
                 "data_salvo_iso": o.data_salvo.strftime("%Y-%m-%d") if o.data_salvo else "",
                 **_dados_venda_orcamento(o),
             }
-            for o in orcamentos
+            for o, cliente_nome in _orcamentos_com_cliente(orcamentos)
         ],
     )
 
+def _consultas_relatorio_vendas(args):
+    """Orçamentos do período e os listados no detalhe (com o filtro de status) do relatório de vendas."""
+    todos_orcamentos = _orcamentos_salvos_visiveis()
+    hoje = datetime.now(br_tz)
+    vendedor_filtro = args.get("vendedor", "Todos")
+    status_filtro = args.get("status", "Todos")
+    vendedor = None
+    if session.get("admin") and vendedor_filtro and vendedor_filtro != "Todos":
+        vendedor = vendedor_filtro
+        todos_orcamentos = todos_orcamentos.filter(OrcamentoSalvo.criado_por == vendedor)
+    orcamentos, mes_filtro, ano_filtro = _filtrar_orcamentos_por_periodo(
+        todos_orcamentos,
+        mes=args.get("mes", str(hoje.month)),
+        ano=args.get("ano", str(hoje.year)),
+    )
+    orcamentos_detalhe = orcamentos
+    if status_filtro and status_filtro != "Todos":
+        orcamentos_detalhe, _, _ = _filtrar_orcamentos_por_periodo(
+            todos_orcamentos,
+            mes=mes_filtro,
+            ano=ano_filtro,
+            status=status_filtro,
+        )
+    return orcamentos, orcamentos_detalhe, mes_filtro, ano_filtro, vendedor
+
 @app.route('/relatorio_vendas')
 def relatorio_vendas():
     if 'user_cpf' not in session:
         return redirect(url_for('login'))
 
-    todos_orcamentos = _orcamentos_salvos_visiveis()
     hoje = datetime.now(br_tz)
-    mes_filtro = request.args.get("mes", str(hoje.month))
-    ano_filtro = request.args.get("ano", str(hoje.year))
     vendedor_filtro = request.args.get("vendedor", "Todos")
     status_filtro = request.args.get("status", "Todos")
     usuarios = Usuario.query.order_by(Usuario.nome).all() if session.get("admin") else []
-    if session.get("admin") and vendedor_filtro and vendedor_filtro != "Todos":
-        todos_orcamentos = [
-            orcamento for orcamento in todos_orcamentos
-            if (orcamento.criado_por or "") == vendedor_filtro
-        ]
-    orcamentos, mes_filtro, ano_filtro = _filtrar_orcamentos_por_periodo(
-        todos_orcamentos,
-        mes=mes_filtro,
-        ano=ano_filtro,
-    )
-    orcamentos_detalhe = orcamentos
-    if status_filtro and status_filtro != "Todos":
-        orcamentos_detalhe = [
-            orcamento for orcamento in orcamentos
-            if (orcamento.status or "Em Espera") == status_filtro
-        ]
-    dashboard = _montar_dashboard_vendas(orcamentos, limite_recentes=len(orcamentos) or 1)
-    detalhe_dashboard = _montar_dashboard_vendas(orcamentos_detalhe, limite_recentes=len(orcamentos_detalhe) or 1)
+    orcamentos, orcamentos_detalhe, mes_filtro, ano_filtro, vendedor = _consultas_relatorio_vendas(request.args)
+    resumo = _resumo_vendas_visivel(mes_filtro, ano_filtro, vendedor)
+    dashboard = _montar_dashboard_vendas(resumo, orcamentos, limite_recentes=0)
     meses = [
         (1, "Janeiro"), (2, "Fevereiro"), (3, "Março"), (4, "Abril"),
         (5, "Maio"), (6, "Junho"), (7, "Julho"), (8, "Agosto"),
@@ -2691,52 +4413,49 @@ def relatorio_vendas():
         "Aprovado": {"quantidade": 0, "valor": 0},
         "Declinado": {"quantidade": 0, "valor": 0},
     }
-    formas_pagamento = {}
-    vendedores = {}
-    tipos_cliente = {}
-    clientes_resumo = {}
-
-    for orcamento in orcamentos:
-        status = orcamento.status or "Em Espera"
-        if status not in status_resumo:
-            status_resumo[status] = {"quantidade": 0, "valor": 0}
-        status_resumo[status]["quantidade"] += 1
-        status_resumo[status]["valor"] += _valor_venda_considerado(orcamento) if status == "Aprovado" else (orcamento.valor_total or 0)
-
-        if (orcamento.status or "") == "Aprovado":
-            valor_venda = _valor_venda_considerado(orcamento)
-            forma = orcamento.forma_pagamento or "Não informado"
-            vendedor = orcamento.criado_por or "Não informado"
-            tipo_cliente = orcamento.tipo_cliente or "Não informado"
-            cliente = _cliente_do_orcamento_salvo(orcamento)
-            cliente_nome = cliente.nome if cliente else "Não informado"
-
-            for grupo, chave in (
-                (formas_pagamento, forma),
-                (vendedores, vendedor),
-                (tipos_cliente, tipo_cliente),
-                (clientes_resumo, cliente_nome),
-            ):
-                if chave not in grupo:
-                    grupo[chave] = {"quantidade": 0, "valor": 0}
-                grupo[chave]["quantidade"] += 1
-                grupo[chave]["valor"] += valor_venda
-
-    for grupo in (formas_pagamento, vendedores, tipos_cliente, clientes_resumo):
-        for item in grupo.values():
-            item["ticket"] = item["valor"] / item["quantidade"] if item["quantidade"] else 0
-
-    formas_pagamento = dict(
-        sorted(formas_pagamento.items(), key=lambda item: item[1]["valor"], reverse=True)
+    status_resumido = db.case((VendasResumoMensal.status == "", "Em Espera"), else_=VendasResumoMensal.status)
+    linhas_status = (
+        resumo.with_entities(
+            status_resumido,
+            db.func.sum(VendasResumoMensal.quantidade),
+            db.func.sum(VendasResumoMensal.valor_considerado),
+        )
+        .group_by(status_resumido)
+        .all()
+    )
+    for status, quantidade, valor in linhas_status:
+        status_resumo[status] = {"quantidade": quantidade, "valor": valor or 0}
+
+    nao_informado = "Não informado"
+    resumo_aprovado = resumo.filter(VendasResumoMensal.status == "Aprovado")
+    quantidade_aprovada = db.func.sum(VendasResumoMensal.quantidade)
+    valor_aprovado = db.func.sum(VendasResumoMensal.valor_considerado)
+    formas_pagamento = _agrupar_vendas_aprovadas(
+        resumo_aprovado,
+        db.func.coalesce(db.func.nullif(VendasResumoMensal.forma_pagamento, ""), nao_informado),
+        quantidade_aprovada,
+        valor_aprovado,
     )
-    vendedores = dict(
-        sorted(vendedores.items(), key=lambda item: item[1]["valor"], reverse=True)
+    vendedores = _agrupar_vendas_aprovadas(
+        resumo_aprovado,
+        db.func.coalesce(db.func.nullif(VendasResumoMensal.criado_por, ""), nao_informado),
+        quantidade_aprovada,
+        valor_aprovado,
     )
-    tipos_cliente = dict(
-        sorted(tipos_cliente.items(), key=lambda item: item[1]["valor"], reverse=True)
+    tipos_cliente = _agrupar_vendas_aprovadas(
+        resumo_aprovado,
+        db.func.coalesce(db.func.nullif(VendasResumoMensal.tipo_cliente, ""), nao_informado),
+        quantidade_aprovada,
+        valor_aprovado,
     )
-    clientes_resumo = dict(
-        sorted(clientes_resumo.items(), key=lambda item: item[1]["valor"], reverse=True)[:3]
+    # O resumo mensal não guarda o cliente; o ranking de clientes segue na tabela de orçamentos
+    clientes_resumo = _agrupar_vendas_aprovadas(
+        orcamentos.filter(OrcamentoSalvo.status == "Aprovado")
+        .outerjoin(Cliente, Cliente.id == OrcamentoSalvo.cliente_id),
+        db.func.coalesce(Cliente.nome, nao_informado),
+        db.func.count(OrcamentoSalvo.id),
+        db.func.sum(VALOR_VENDA_CONSIDERADO_SQL),
+        limite=3,
     )
     aprovados = status_resumo.get("Aprovado", {"quantidade": 0, "valor": 0})
     declinados = status_resumo.get("Declinado", {"quantidade": 0, "valor": 0})
@@ -2744,14 +4463,16 @@ def relatorio_vendas():
     decisoes = aprovados["quantidade"] + declinados["quantidade"]
     taxa_ganho = round((aprovados["quantidade"] / decisoes) * 100, 1) if decisoes else 0
     ticket_vendas = aprovados["valor"] / aprovados["quantidade"] if aprovados["quantidade"] else 0
-    observacoes_count = sum(1 for o in orcamentos if getattr(o, "observacao_vendas", None))
+    observacoes_count = orcamentos.filter(
+        OrcamentoSalvo.observacao_vendas.isnot(None), OrcamentoSalvo.observacao_vendas != ""
+    ).order_by(None).count()
     usuario_atual = Usuario.query.filter_by(cpf=session.get("user_cpf")).first()
     responsavel_relatorio = usuario_atual.nome if usuario_atual and usuario_atual.nome else session.get("user_cpf", "")
     resumo_executivo = {
         "periodo": periodo_label,
         "emitido_em": hoje.strftime("%d/%m/%Y %H:%M"),
         "responsavel": responsavel_relatorio,
-        "orcamentos_analisados": len(orcamentos),
+        "orcamentos_analisados": dashboard["total"],
         "receita_aprovada": aprovados["valor"],
         "receita_aprovada_formatada": _moeda(aprovados["valor"]),
         "valor_negociacao": em_espera["valor"],
@@ -2773,7 +4494,7 @@ def relatorio_vendas():
         periodo_label=periodo_label,
         resumo=resumo_executivo,
         dashboard=dashboard,
-        orcamentos=detalhe_dashboard["recentes"],
+        orcamentos=_linhas_recentes(orcamentos_detalhe),
         status_resumo=status_resumo,
         formas_pagamento=formas_pagamento,
         vendedores=vendedores,
@@ -2919,9 +4640,7 @@ def listar_orcamentos():
             modelo_cuba = "Normal"
 
         pricing_opts = opcoes_precificacao_empresa()
-        valor_total = calcular_valor_item(
-            tipo_produto=tipo_produto,
-            valor_material=material.valor,
+        valor_total = regras_precificacao_empresa().funcao(tipo_produto)(material.valor, dict(
             quantidade=quantidade,
             comprimento=comprimento,
             largura=largura,
@@ -2955,8 +4674,7 @@ def listar_orcamentos():
             tem_fundo=tem_fundo,
             tem_alisar=tem_alisar,
             largura_alisar=largura_alisar,
-            **pricing_opts,
-        )
+        ))
 
         novo_orcamento = Orcamento(
             cliente_id=cliente_id,
@@ -3007,48 +4725,12 @@ def listar_orcamentos():
     user_cpf = session.get('user_cpf')
 
     if not user_cpf:
-        flash("Faça login para acessar os orçamentos.", "error")
-        return redirect(url_for('login'))
-
-    # Construir query base
-    if session.get('admin'):
-        query = db.session.query(
-            Orcamento,
-            Usuario.nome.label('nome_usuario')
-        ).join(Usuario, Orcamento.dono == Usuario.cpf)
-    else:
-        query = db.session.query(
-            Orcamento,
-            Usuario.nome.label('nome_usuario')
-        ).join(Usuario, Orcamento.dono == Usuario.cpf).filter(Orcamento.dono == user_cpf)
-
-    # Aplicar filtros
-    if filtro_cliente != 'Todos':
-        query = query.join(Cliente).filter(Cliente.nome == filtro_cliente)
-    
-    if filtro_data_inicio:
-        try:
-            data_inicio = datetime.strptime(filtro_data_inicio, '%Y-%m-%d')
-            query = query.filter(Orcamento.data >= data_inicio)
-        except ValueError:
-            pass
-    
-    if filtro_data_fim:
-        try:
-            data_fim = datetime.strptime(filtro_data_fim, '%Y-%m-%d')
-            # Adicionar 1 dia para incluir o dia final
-            data_fim = data_fim.replace(hour=23, minute=59, second=59)
-            query = query.filter(Orcamento.data <= data_fim)
-        except ValueError:
-            pass
-
-    # Ordenar e limitar
-    query = query.order_by(Orcamento.data.desc())
-    
-    if limite_int > 0:  # Aplicar limite apenas se for maior que 0
-        query = query.limit(limite_int)
+        flash("Faça login para acessar os orçamentos.", "error")
+        return redirect(url_for('login'))
 
-    orcamentos = query.all()
+    # Só a primeira página; a tela busca as demais em /orcamentos/json
+    linhas, _ = pagina_itens_orcamento(_filtros_itens_orcamento(request.args), _limite_itens_por_pagina(limite))
+    orcamentos = [(linha[0], linha.nome_usuario) for linha in linhas]
 
     # Carregar listas para os selects
     if session.get('admin'):
@@ -3275,6 +4957,7 @@ def configuracoes():
             config.logo_mime = logo.mimetype or _mime_logo_por_extensao(filename)
             config.logo_filename = filename
 
+        marcar_config_empresa_alterada(config)
         db.session.commit()
         flash("Configurações salvas com sucesso.", "config_success")
         return redirect(url_for('configuracoes'))
@@ -3326,12 +5009,23 @@ def editar_cliente(id):
 def editar_material(id):
     material = Material.query.get_or_404(id)
     if request.method == 'POST':
+        valor_anterior = material.valor
         material.nome = request.form['nome']
         material.valor = float(request.form['valor'])
         db.session.commit()
+        if material.valor != valor_anterior:
+            enfileirar_reprecificacao(material.id)
         return redirect(url_for('materiais'))
     return redirect(url_for('materiais'))
 
+
+@app.route('/materiais/<int:id>/reprecificacao')
+def status_reprecificacao_material(id):
+    resumo = reprecificacoes.get(id)
+    if resumo is None:
+        return jsonify({"material_id": id, "status": None})
+    return jsonify(dict(resumo))
+
 @app.route('/orcamentos/edit/<int:id>', methods=['GET', 'POST'])
 def editar_orcamento(id):
     orcamento = Orcamento.query.get_or_404(id)
@@ -3563,9 +5257,7 @@ def editar_orcamento(id):
         # Arredonda apenas o valor final
         pricing_opts = opcoes_precificacao_empresa()
         pricing_opts = opcoes_precificacao_empresa()
-        orcamento.valor_total = calcular_valor_item(
-            tipo_produto=orcamento.tipo_produto,
-            valor_material=material.valor,
+        orcamento.valor_total = regras_precificacao_empresa().funcao(orcamento.tipo_produto)(material.valor, dict(
             quantidade=orcamento.quantidade,
             comprimento=orcamento.comprimento,
             largura=orcamento.largura,
@@ -3592,12 +5284,13 @@ def editar_orcamento(id):
             tem_fundo=orcamento.tem_fundo,
             tem_alisar=orcamento.tem_alisar,
             largura_alisar=orcamento.largura_alisar,
-            **pricing_opts,
-        )
+        ))
         
-        orcamento_salvo = OrcamentoSalvo.query.filter(OrcamentoSalvo.orcamentos_ids.contains(str(orcamento.id))).first()
-        if orcamento_salvo:
+        codigos_alterados = []
+        for orcamento_salvo in _orcamentos_salvos_com_item(orcamento.id):
+            orcamento_salvo.atualizar_cliente()
             atualizar_valor_orcamento_salvo(orcamento_salvo.id)
+            codigos_alterados.append(orcamento_salvo.codigo)
             
         orcamento_salvo_id = request.form.get('orcamento_salvo_id')
 
@@ -3614,17 +5307,19 @@ def editar_orcamento(id):
             orcamento_salvo_novo = OrcamentoSalvo.query.get(orcamento_salvo_id)
 
             if orcamento_salvo_novo:
-                ids_atualizados = orcamento_salvo_novo.orcamentos_ids.split(',') if orcamento_salvo_novo.orcamentos_ids else []
-                if str(orcamento.id) not in ids_atualizados:
-                    ids_atualizados.append(str(orcamento.id))
-                    orcamento_salvo_novo.orcamentos_ids = ','.join(ids_atualizados)
+                ids_atualizados = orcamento_salvo_novo.ids_itens
+                if orcamento.id not in ids_atualizados:
+                    ids_atualizados.append(orcamento.id)
+                    orcamento_salvo_novo.definir_itens(ids_atualizados)
 
                     # **Somente atualiza se o orçamento salvo existir**
                     if orcamento_salvo_novo.id:
                         atualizar_valor_orcamento_salvo(orcamento_salvo_novo.id)
+                        codigos_alterados.append(orcamento_salvo_novo.codigo)
                         flash("Orçamento vinculado com sucesso!", "success")
         
         db.session.commit()
+        invalidar_pdf_orcamento(*codigos_alterados)
         return redirect(url_for('listar_orcamentos'))
 
     return render_template(
@@ -3689,25 +5384,19 @@ def deletar_orcamento(id):
         flash("Erro: Orçamento não encontrado.", "error")
         return redirect(url_for('listar_orcamentos'))
 
-    # Verifica se esse orçamento pertence a um orçamento salvo
-    orcamento_salvo = OrcamentoSalvo.query.filter(
-        OrcamentoSalvo.orcamentos_ids.like(f'%{id}%')
-    ).first()
-
-    # 🔥 AGORA: Se estiver em um orçamento salvo, apenas remove da lista
-    if orcamento_salvo:
+    # 🔥 AGORA: Se estiver em orçamentos salvos, apenas remove das listas
+    codigos_alterados = []
+    for orcamento_salvo in _orcamentos_salvos_com_item(id):
+        codigos_alterados.append(orcamento_salvo.codigo)
         # Remover da lista de IDs
-        ids = orcamento_salvo.orcamentos_ids.split(',')
-        ids_atualizados = [item_id for item_id in ids if item_id.strip() != str(id)]
+        ids_atualizados = [item_id for item_id in orcamento_salvo.ids_itens if item_id != id]
         
         # Se ainda houver itens, atualizar
         if ids_atualizados:
-            orcamento_salvo.orcamentos_ids = ','.join(ids_atualizados)
+            orcamento_salvo.definir_itens(ids_atualizados)
             
             # Recalcular valor
-            orcamentos_restantes = Orcamento.query.filter(
-                Orcamento.id.in_([int(item_id) for item_id in ids_atualizados if item_id.strip().isdigit()])
-            ).all()
+            orcamentos_restantes = Orcamento.query.filter(Orcamento.id.in_(ids_atualizados)).all()
             
             orcamento_salvo.valor_total = sum(orc.valor_total for orc in orcamentos_restantes)
             
@@ -3720,6 +5409,7 @@ def deletar_orcamento(id):
     # ðŸ”¥ EXCLUIR FISICAMENTE (apenas da tabela Orcamento)
     db.session.delete(orcamento)
     db.session.commit()
+    invalidar_pdf_orcamento(*codigos_alterados)
 
     if wants_json:
         return jsonify({"success": True, "message": "Orçamento excluído com sucesso!"})
@@ -3743,13 +5433,34 @@ def deletar_orcamentos_selecionados():
         if not ids:
             return jsonify({'error': 'IDs inválidos!'}), 400
 
+        # Tira os itens dos orçamentos salvos antes de apagá-los, como em deletar_orcamento:
+        # o SQLite não aplica o ON DELETE CASCADE e um vínculo órfão apontaria para o
+        # próximo item que reaproveitar o id
+        apagados = set(ids)
+        codigos_alterados = []
+        restantes = []
+        for orcamento_salvo in _orcamentos_salvos_com_itens(ids):
+            codigos_alterados.append(orcamento_salvo.codigo)
+            ids_atualizados = [item_id for item_id in orcamento_salvo.ids_itens if item_id not in apagados]
+            if ids_atualizados:
+                orcamento_salvo.definir_itens(ids_atualizados)
+                restantes.extend(ids_atualizados)
+            else:
+                db.session.delete(orcamento_salvo)
+        db.session.flush()
+
         # Deleta os orçamentos no banco de dados
+        excluir_itens_normalizados(ids)
         Orcamento.query.filter(Orcamento.id.in_(ids)).delete(synchronize_session=False)
+        atualizar_valores_orcamentos_salvos(restantes)
         db.session.commit()
+        invalidar_contagens_itens()
+        invalidar_pdf_orcamento(*codigos_alterados)
 
         return jsonify({'success': 'Orçamentos deletados com sucesso!'})
 
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': f'Erro ao deletar: {str(e)}'}), 500
 
 @app.route('/detalhes_orcamento', methods=['GET'])
@@ -4065,7 +5776,6 @@ def salvar_orcamento():
         novo_orcamento = OrcamentoSalvo(
             codigo=novo_codigo,
             data_salvo=data_salvamento,
-            orcamentos_ids=",".join(map(str, ids)),  # IDs dos orçamentos vinculados
             valor_total=valor_total,
             criado_por=criado_por,
             prazo_entrega=int(empresa.get('prazo_entrega_padrao') or 15),
@@ -4077,9 +5787,11 @@ def salvar_orcamento():
             valor_minimo_parcela=float(empresa.get('valor_minimo_parcela') or 100),
             pagamentos_config_json=json.dumps(pagamentos_config_padrao(empresa), ensure_ascii=False),
         )
+        novo_orcamento.definir_itens(ids)  # IDs dos orçamentos vinculados
 
         db.session.add(novo_orcamento)
         db.session.commit()
+        preaquecer_pdf_orcamento(novo_orcamento)
 
         return jsonify({"success": True, "codigo": novo_codigo})
 
@@ -4091,56 +5803,96 @@ def salvar_orcamento():
 
 
 
-@app.route("/orcamentos_salvos")
-def listar_orcamentos_salvos():
-    user_cpf = session.get("user_cpf")
-    is_admin = session.get("admin")
+ORDENACOES_ORCAMENTOS_SALVOS = {
+    'codigo': OrcamentoSalvo.codigo,
+    'data': OrcamentoSalvo.data_salvo,
+    'valor': OrcamentoSalvo.valor_total,
+    'cliente': Cliente.nome,
+    'vendedor': OrcamentoSalvo.criado_por,
+}
+POR_PAGINA_ORCAMENTOS_SALVOS = (15, 30, 50, 100)
 
-    orcamentos_salvos = OrcamentoSalvo.query.order_by(OrcamentoSalvo.codigo.desc()).all()
 
-    resultado = []
+def _consulta_orcamentos_salvos_com_cliente():
+    """Orçamentos salvos com nome e dono do cliente em uma única consulta."""
+    query = db.session.query(
+        OrcamentoSalvo.id,
+        OrcamentoSalvo.codigo,
+        OrcamentoSalvo.data_salvo,
+        OrcamentoSalvo.valor_total,
+        OrcamentoSalvo.criado_por,
+        OrcamentoSalvo.status,
+        OrcamentoSalvo.tipo_cliente,
+        Cliente.id.label("cliente_id"),
+        Cliente.nome.label("cliente_nome"),
+        Cliente.dono.label("cliente_dono"),
+    ).select_from(OrcamentoSalvo
+    ).join(Cliente, Cliente.id == OrcamentoSalvo.cliente_id)
 
-    for orc_salvo in orcamentos_salvos:
-        primeiro_orcamento_id = int(orc_salvo.orcamentos_ids.split(",")[0])
-        primeiro_orcamento = Orcamento.query.get(primeiro_orcamento_id)
+    return _filtrar_visiveis(query)
 
-        if not primeiro_orcamento:
-            continue
 
-        cliente = Cliente.query.get(primeiro_orcamento.cliente_id)
-        if not cliente:
-            continue
+def _consulta_orcamentos_salvos_filtrada(args):
+    """Orçamentos salvos com os filtros e a ordenação da tela, lidos de args."""
+    query = _consulta_orcamentos_salvos_com_cliente()
 
-        # Esse trecho deixa claro o filtro admin e não-admin
-        if is_admin or cliente.dono == user_cpf:
-            resultado.append({
-                'id': orc_salvo.id,
-                'codigo': orc_salvo.codigo,
-                'data_salvo': orc_salvo.data_salvo,
-                'valor_total': orc_salvo.valor_total,
-                'criado_por': orc_salvo.criado_por,
-                'status': orc_salvo.status,
-                'tipo_cliente': orc_salvo.tipo_cliente,
-                'cliente_nome': cliente.nome,
-                'cliente_dono': cliente.dono
-            })
+    filtros = {
+        'codigo': args.get('codigo', '').strip(),
+        'criado_por': args.get('criado_por', '').strip() if session.get("admin") else '',
+        'cliente': args.get('cliente', type=int),
+    }
+    if filtros['codigo']:
+        query = query.filter(OrcamentoSalvo.codigo.ilike(f"%{filtros['codigo']}%"))
+    if filtros['criado_por']:
+        query = query.filter(OrcamentoSalvo.criado_por == filtros['criado_por'])
+    if filtros['cliente']:
+        query = query.filter(Cliente.id == filtros['cliente'])
+
+    ordem = args.get('ordem', 'codigo')
+    if ordem not in ORDENACOES_ORCAMENTOS_SALVOS:
+        ordem = 'codigo'
+    direcao = 'asc' if args.get('direcao') == 'asc' else 'desc'
+    coluna = ORDENACOES_ORCAMENTOS_SALVOS[ordem]
+    query = query.order_by(coluna.asc() if direcao == 'asc' else coluna.desc(), OrcamentoSalvo.id.desc())
+    filtros.update(ordem=ordem, direcao=direcao)
+    return query, filtros
+
+
+def _listagem_orcamentos_salvos():
+    is_admin = session.get("admin")
+    query, filtros = _consulta_orcamentos_salvos_filtrada(request.args)
+
+    por_pagina = request.args.get('por_pagina', POR_PAGINA_ORCAMENTOS_SALVOS[0], type=int)
+    if por_pagina not in POR_PAGINA_ORCAMENTOS_SALVOS:
+        por_pagina = POR_PAGINA_ORCAMENTOS_SALVOS[0]
+    paginacao = query.paginate(
+        page=request.args.get('pagina', 1, type=int),
+        per_page=por_pagina,
+        error_out=False,
+    )
+
+    filtros['por_pagina'] = por_pagina
 
-    # Agora adicionando a clareza no filtro dos clientes:
     if is_admin:
-        clientes = Cliente.query.all()
+        clientes = Cliente.query.order_by(Cliente.nome).all()
+        usuarios = Usuario.query.order_by(Usuario.nome).all()
     else:
-        clientes = Cliente.query.filter_by(dono=user_cpf).all()
-
-    usuarios = Usuario.query.all()
-
-    return render_template("orcamentos_salvos.html",
-                           clientes=clientes,
-                           usuarios=usuarios,
-                           orcamentos=resultado)
-
+        clientes = Cliente.query.filter_by(dono=session.get("user_cpf")).order_by(Cliente.nome).all()
+        usuarios = []
 
+    return {
+        'orcamentos': paginacao.items,
+        'paginacao': paginacao,
+        'filtros': filtros,
+        'opcoes_por_pagina': POR_PAGINA_ORCAMENTOS_SALVOS,
+        'clientes': clientes,
+        'usuarios': usuarios,
+    }
 
 
+@app.route("/orcamentos_salvos")
+def listar_orcamentos_salvos():
+    return render_template("orcamentos_salvos.html", **_listagem_orcamentos_salvos())
 
 
 @app.route('/detalhes_orcamento_salvo/<codigo>')
@@ -4163,7 +5915,7 @@ def detalhes_orcamento_salvo(codigo):
     
     # Admin pode ver tudo, usuário comum só vê seus próprios orçamentos
     if not is_admin:
-        ids_check = [int(i) for i in orcamento_salvo.orcamentos_ids.split(",") if i.strip()]
+        ids_check = orcamento_salvo.ids_itens
         tem_permissao = db.session.query(Orcamento).join(Cliente, Cliente.id == Orcamento.cliente_id).filter(
             Orcamento.id.in_(ids_check), Cliente.dono == usuario.cpf
         ).first()
@@ -4172,7 +5924,7 @@ def detalhes_orcamento_salvo(codigo):
             return redirect(url_for('listar_orcamentos_salvos'))
     
     # Buscar os orçamentos vinculados
-    ids = [int(id) for id in orcamento_salvo.orcamentos_ids.split(",") if id.strip()]
+    ids = orcamento_salvo.ids_itens
     orcamentos = Orcamento.query.filter(Orcamento.id.in_(ids)).all()
     
     if not orcamentos:
@@ -4207,7 +5959,7 @@ def detalhes_orcamento_salvo(codigo):
     valor_total_float = valor_total_final
     
     # Configurar logo URL
-    logo_url = empresa_logo_data_uri()
+    logo_url = empresa_logo_url(tamanho="pdf")
     
     # Obter informações do usuário
     usuario_logado = Usuario.query.filter_by(cpf=session.get('user_cpf')).first()
@@ -4278,19 +6030,8 @@ def recriar_agrupamentos_orcamento(codigo_orcamento):
             print(f"âš ï¸ Orçamento salvo não encontrado: {codigo_orcamento}")
             return None
         
-        # Extrair IDs dos orçamentos (com validação)
-        ids_str = orcamento_salvo.orcamentos_ids
-        if not ids_str or not ids_str.strip():
-            print(f"âš ï¸ Lista de IDs vazia para orçamento: {codigo_orcamento}")
-            return {}
-        
-        ids = []
-        for id_str in ids_str.split(','):
-            id_str = id_str.strip()
-            if id_str and id_str.isdigit():
-                ids.append(int(id_str))
-            else:
-                print(f"âš ï¸ ID inválido ignorado: '{id_str}'")
+        # IDs dos orçamentos vinculados
+        ids = orcamento_salvo.ids_itens
         
         if not ids:
             print(f"âš ï¸ Nenhum ID válido encontrado para orçamento: {codigo_orcamento}")
@@ -4375,7 +6116,8 @@ def orcamentos_salvos():
         OrcamentoSalvo.tipo_cliente,
         Cliente.nome.label("cliente_nome"),
         Cliente.dono.label("cliente_dono")  # O CPF de quem cadastrou o cliente
-    ).join(Orcamento, db.func.instr(OrcamentoSalvo.orcamentos_ids, db.cast(Orcamento.id, db.String())) > 0
+    ).join(OrcamentoSalvoItem, OrcamentoSalvoItem.orcamento_salvo_id == OrcamentoSalvo.id
+    ).join(Orcamento, Orcamento.id == OrcamentoSalvoItem.orcamento_id
     ).join(Cliente, Cliente.id == Orcamento.cliente_id)
 
     # 🔹 Se não for admin, filtrar apenas os orçamentos dos clientes cadastrados pelo usuário logado
@@ -4410,6 +6152,7 @@ def deletar_orcamento_salvo(orcamento_id):
         # Depois exclui o orçamento salvo
         db.session.delete(orcamento)
         db.session.commit()
+        invalidar_pdf_orcamento(orcamento.codigo)
         
         return jsonify({"success": "Orçamento deletado com sucesso!"})
     
@@ -4501,8 +6244,8 @@ def orcamento_preview(token):
     empresa = empresa_config_dict()
     nome_empresa = empresa.get('nome_empresa') or 'Sistema de Orçamento'
     dominio = request.url_root.rstrip('/')
-    logo_url = empresa_logo_url()
-    logo_absoluta = logo_url if logo_url.startswith('data:') else request.url_root.rstrip('/') + logo_url
+    logo_url = empresa_logo_url(tamanho="pdf")
+    logo_absoluta = logo_url if logo_url.startswith('data:') else request.host_url.rstrip('/') + logo_url
     return f'''<!DOCTYPE html>
 <html>
 <head>
@@ -4542,17 +6285,17 @@ a:hover{{background:#d4a017;color:#1a1a2e}}
 </body>
 </html>'''
 
-@app.route('/gerar_pdf_orcamento/<path:codigo_ou_token>')
-def gerar_pdf_orcamento(codigo_ou_token):
+def _orcamento_salvo_por_codigo_ou_token(codigo_ou_token):
     orcamento_salvo = OrcamentoSalvo.query.filter_by(codigo=codigo_ou_token).first()
     if not orcamento_salvo:
         codigo_real = decodificar_token_orcamento(codigo_ou_token)
         if codigo_real:
             orcamento_salvo = OrcamentoSalvo.query.filter_by(codigo=codigo_real).first()
-    if not orcamento_salvo:
-        return "Orçamento não encontrado", 404
+    return orcamento_salvo
 
-    ids = [int(id) for id in orcamento_salvo.orcamentos_ids.split(",")]
+def _preparar_pdf_orcamento(orcamento_salvo, usuario_logado=None, exclude_param=""):
+    """Devolve a chave do cache e o contexto do template do PDF de um orçamento salvo."""
+    ids = orcamento_salvo.ids_itens
     orcamentos = Orcamento.query.filter(Orcamento.id.in_(ids)).all()
     
     # 🔥 Estrutura de agrupamento: Ambiente -> Descrição -> Tipo de Produto
@@ -4575,10 +6318,7 @@ def gerar_pdf_orcamento(codigo_ou_token):
     # Calcular valor total
     valor_total_final = sum(o.valor_total for o in orcamentos)
     valor_total_float = valor_total_final
-
-    logo_url = empresa_logo_url()
     
-    usuario_logado = Usuario.query.filter_by(cpf=session.get('user_cpf')).first()
     vendedor_nome = orcamento_salvo.criado_por or (usuario_logado.nome if usuario_logado else "")
     usuario_vendedor = Usuario.query.filter_by(nome=vendedor_nome).first() if vendedor_nome else usuario_logado
     if not usuario_vendedor:
@@ -4600,14 +6340,22 @@ def gerar_pdf_orcamento(codigo_ou_token):
 
     # ✅ Opções excluídas
     exclude_payments = orcamento_salvo.exclude_payments.split(',') if orcamento_salvo.exclude_payments else []
-    exclude_param = request.args.get('exclude_payments', '')
     if exclude_param:
         exclude_payments = exclude_param.split(',')
 
-    # Renderizar HTML
-    rendered_html = render_template(
-        "detalhes_orcamento_salvo.html",
-        logo_url=logo_url,
+    chave_pdf = chave_pdf_orcamento(
+        orcamento_salvo,
+        orcamentos,
+        PDF_TEMPLATE,
+        vendedor_nome=vendedor_nome,
+        telefone_usuario=telefone_usuario,
+        exclude_payments=exclude_payments,
+        pagamentos_config=pagamentos_config,
+        base_url=request.url_root,
+    )
+    contexto = dict(
+        # O HTML do PDF não busca arquivos externos: o logo vai embutido
+        empresa_logo_url=empresa_logo_data_uri(),
         codigo_orcamento=orcamento_salvo.codigo,
         data_salvo=orcamento_salvo.data_salvo,
         cliente_nome=orcamentos[0].cliente.nome if orcamentos else "Desconhecido",
@@ -4621,22 +6369,129 @@ def gerar_pdf_orcamento(codigo_ou_token):
         desconto_avista=desconto_avista,
         desconto_parcelado=desconto_parcelado,
         observacoes=observacoes,
-        pdf=True,
         exclude_payments=exclude_payments,
         pagamentos_config=pagamentos_config,
         max_parcelas=max_parcelas,
         valor_minimo_parcela=valor_minimo_parcela,
         parcelas_orcamento=parcelas_orcamento,
-        linhas_ordenadas=linhas_ordenadas_por_tabela(ambientes_agrupados, orcamento_salvo)
+        linhas_ordenadas=linhas_ordenadas_por_tabela(ambientes_agrupados, orcamento_salvo),
     )
+    return chave_pdf, contexto
+
+def _enfileirar_pdf_orcamento(orcamento_salvo, chave_pdf, contexto):
+    codigo = orcamento_salvo.codigo
+    rendered_html = render_template(PDF_TEMPLATE, **contexto)
+    return pool_pdf.enfileirar(
+        chave_pdf,
+        rendered_html,
+        request.url_root,
+        ao_concluir=lambda pdf_bytes: gravar_pdf_cache(codigo, chave_pdf, pdf_bytes),
+    )
+
+def preaquecer_pdf_orcamento(orcamento_salvo):
+    """Enfileira o PDF como o cliente o abre pelo link (sem login), para o primeiro download sair do cache."""
+    try:
+        chave_pdf, contexto = _preparar_pdf_orcamento(orcamento_salvo)
+        if not pdf_em_cache(orcamento_salvo.codigo, chave_pdf):
+            _enfileirar_pdf_orcamento(orcamento_salvo, chave_pdf, contexto)
+    except Exception as exc:
+        print(f"[PDF] Pré-renderização de {orcamento_salvo.codigo} não enfileirada: {exc}")
+
+def _status_pdf_orcamento(orcamento_salvo, chave_pdf, contexto):
+    """Consulta o cache e o pool; enfileira o PDF se ninguém estiver gerando."""
+    if pdf_em_cache(orcamento_salvo.codigo, chave_pdf):
+        return "pronto", None
+    status, erro = pool_pdf.status(chave_pdf)
+    if status is None:
+        _enfileirar_pdf_orcamento(orcamento_salvo, chave_pdf, contexto)
+        status = "processando"
+    return status, erro
+
+def _pagina_aguardando_pdf(codigo, status_url):
+    codigo = escape(codigo)
+    return f'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Gerando PDF - {codigo}</title>
+<noscript><meta http-equiv="refresh" content="3"></noscript>
+<style>
+body{{font-family:Arial,sans-serif;display:flex;justify-content:center;align-items:center;min-height:100vh;margin:0;background:#1a1a2e;color:#fff}}
+.card{{text-align:center;background:#16213e;padding:40px;border-radius:16px;box-shadow:0 4px 20px rgba(0,0,0,.3);max-width:400px;width:90%}}
+.sub{{color:#999;font-size:.9rem}}
+</style>
+</head>
+<body>
+<div class="card">
+<h2>Orçamento {codigo}</h2>
+<p id="mensagem" class="sub">Gerando o PDF, aguarde alguns segundos...</p>
+</div>
+<script>
+const statusUrl = {json.dumps(status_url)};
+async function verificarPdf() {{
+    try {{
+        const resposta = await fetch(statusUrl, {{cache: "no-store"}});
+        const dados = await resposta.json();
+        if (dados.status === "pronto") {{
+            window.location.reload();
+            return;
+        }}
+        if (dados.status === "erro") {{
+            document.getElementById("mensagem").textContent = "Não foi possível gerar o PDF: " + (dados.erro || "");
+            return;
+        }}
+    }} catch (e) {{}}
+    setTimeout(verificarPdf, 1500);
+}}
+setTimeout(verificarPdf, 1000);
+</script>
+</body>
+</html>'''
+
+@app.route('/gerar_pdf_orcamento/<path:codigo_ou_token>')
+def gerar_pdf_orcamento(codigo_ou_token):
+    orcamento_salvo = _orcamento_salvo_por_codigo_ou_token(codigo_ou_token)
+    if not orcamento_salvo:
+        return "Orçamento não encontrado", 404
+
+    usuario_logado = Usuario.query.filter_by(cpf=session.get('user_cpf')).first()
+    exclude_param = request.args.get('exclude_payments', '')
+    chave_pdf, contexto = _preparar_pdf_orcamento(orcamento_salvo, usuario_logado, exclude_param)
+    pdf_bytes = ler_pdf_cache(orcamento_salvo.codigo, chave_pdf)
+    if pdf_bytes:
+        return _resposta_pdf(pdf_bytes, f"orcamento_{orcamento_salvo.codigo}.pdf", etag=chave_pdf)
 
+    # A geração roda no pool; a página de espera consulta o status e recarrega quando o PDF fica pronto
     try:
-        pdf_bytes = _get_weasyprint_html()(string=rendered_html, base_url=request.url_root).write_pdf()
-    except RuntimeError:
-        pdf_bytes = _gerar_pdf_html_com_chrome(rendered_html, request.url_root)
-        return _resposta_pdf(pdf_bytes, f"orcamento_{orcamento_salvo.codigo}.pdf")
+        status, erro = _status_pdf_orcamento(orcamento_salvo, chave_pdf, contexto)
+    except FilaPdfCheia:
+        resposta = make_response("Muitos PDFs sendo gerados agora. Tente novamente em instantes.", 503)
+        resposta.headers["Retry-After"] = "5"
+        return resposta
+    if status == "erro":
+        pool_pdf.descartar(chave_pdf)
+        return f"Erro ao gerar PDF: {escape(erro)}", 500
+
+    status_url = url_for('status_pdf_orcamento', codigo_ou_token=codigo_ou_token, exclude_payments=exclude_param or None)
+    resposta = make_response(_pagina_aguardando_pdf(orcamento_salvo.codigo, status_url), 202)
+    resposta.headers["Cache-Control"] = "no-store"
+    return resposta
+
+@app.route('/status_pdf_orcamento/<path:codigo_ou_token>')
+def status_pdf_orcamento(codigo_ou_token):
+    orcamento_salvo = _orcamento_salvo_por_codigo_ou_token(codigo_ou_token)
+    if not orcamento_salvo:
+        return jsonify({"status": "erro", "erro": "Orçamento não encontrado"}), 404
 
-    return _resposta_pdf(pdf_bytes, f"orcamento_{orcamento_salvo.codigo}.pdf")
+    usuario_logado = Usuario.query.filter_by(cpf=session.get('user_cpf')).first()
+    chave_pdf, contexto = _preparar_pdf_orcamento(
+        orcamento_salvo, usuario_logado, request.args.get('exclude_payments', '')
+    )
+    try:
+        status, erro = _status_pdf_orcamento(orcamento_salvo, chave_pdf, contexto)
+    except FilaPdfCheia:
+        status, erro = "processando", None
+    return jsonify({"status": status, "erro": erro})
 
 @app.route('/orcamentos/editar_material_rt_selecionados', methods=['POST'])
 def editar_material_rt_selecionados():
@@ -4687,21 +6542,8 @@ def editar_material_rt_selecionados():
     else:
         produto = None
 
-    cuba_valores = {
-        'Embutida': 225,
-        'Esculpida': 175,
-        'Tradicional Inox': 225,
-        'Tanque Inox': 500,
-        'Apoio Cliente': 125,
-        'Embutida Cliente': 125,
-        'Gourmet Cliente': 225,
-        'Sobrepor Cliente': 125,
-        'Tanque Inox Cliente': 225
-    }
-
-    cooktop_valor = 50  # Valor fixo para cooktop
-
     orcamentos = Orcamento.query.filter(Orcamento.id.in_(orcamento_ids)).all()
+    valores_material = []
 
     for orcamento in orcamentos:
         # Atualizar cliente apenas se foi fornecido
@@ -4714,6 +6556,7 @@ def editar_material_rt_selecionados():
             material_para_calculo = material
         else:
             material_para_calculo = orcamento.material
+        valores_material.append(material_para_calculo.valor if material_para_calculo else 0)
         
         # 🔥 NOVO: Atualizar descrição apenas se foi fornecida
         if descricao_id:
@@ -4737,147 +6580,20 @@ def editar_material_rt_selecionados():
             # Se RT foi definida como "Não", zerar o percentual
             orcamento.rt_percentual = 0.0
 
-        valor_total_criar = 0
-
-        comprimento_cal = max(orcamento.comprimento, 10)
-        largura_cal = max(orcamento.largura, 10)
-
-        valor_base = material_para_calculo.valor * (comprimento_cal * largura_cal / 10000)
-
-        if orcamento.tipo_produto in ['Bancada', 'Lavatorio']:
-            if material_para_calculo.valor < 1000:
-                valor_base *= 1.3
-            elif material_para_calculo.valor < 2000:
-                valor_base *= 1.15
-            elif material_para_calculo.valor < 1000000:
-                valor_base *= 1.1
-
-        if orcamento.tipo_produto in ['Ilharga Bipolida', 'Pedra Bipolida com Saia', 'Pedra Bipolida'] and material_para_calculo.valor < 1000000:
-            pricing_opts = opcoes_precificacao_empresa()
-            margem_bipolida = pricing_opts.get('ilharga_bipolida_margem', 15)
-            if orcamento.tipo_produto == 'Pedra Bipolida com Saia':
-                margem_bipolida = pricing_opts.get('pedra_bipolida_com_saia_margem', 15)
-            elif orcamento.tipo_produto == 'Pedra Bipolida':
-                margem_bipolida = pricing_opts.get('pedra_bipolida_margem', 15)
-            valor_base *= 1 + (float(margem_bipolida or 0) / 100)
-
-        valor_total_criar += valor_base
-
-        # Nicho
-        if orcamento.tipo_produto == 'Nicho':
-            profundidade_nicho = max(orcamento.profundidade_nicho or 0, 10)
-            if orcamento.tem_fundo == 'Sim':
-                area_nicho = ((comprimento_cal + 4) * (largura_cal + 4)) + (2 * (comprimento_cal + 4) * profundidade_nicho) + (2 * (largura_cal +4) * profundidade_nicho)
-            else:
-                area_nicho = 2 * ((comprimento_cal + 4) + (largura_cal + 4)) * profundidade_nicho
-
-            if orcamento.tem_alisar == 'Sim' and (orcamento.largura_alisar or 0) > 0:
-                largura_alisar_cal = 10 if 0 < orcamento.largura_alisar < 10 else orcamento.largura_alisar
-                area_nicho += ((comprimento_cal + (largura_alisar_cal * 2)) * largura_alisar_cal * 2) + \
-                              ((largura_cal + (largura_alisar_cal * 2)) * largura_alisar_cal * 2)
-
-            valor_nicho = (area_nicho / 10000) * material_para_calculo.valor + 150
-            valor_total_criar = valor_nicho
-
-        # Saia
-        if orcamento.tipo_produto in ['Ilharga', 'Ilharga Bipolida', 'Pedra Simples com Saia', 'Pedra Bipolida com Saia', 'Bancada', 'Lavatorio']:
-            comprimento_saia_cal = 10 if 0 < orcamento.comprimento_saia < 10 else orcamento.comprimento_saia
-            largura_saia_cal = 10 if 0 < orcamento.largura_saia < 10 else orcamento.largura_saia
-            valor_saia = comprimento_saia_cal * largura_saia_cal * material_para_calculo.valor / 10000
-            valor_total_criar += valor_saia
-
-        # Fronte
-        if orcamento.tipo_produto in ['Bancada', 'Lavatorio']:
-            comprimento_fronte_cal = 10 if 0 < orcamento.comprimento_fronte < 10 else orcamento.comprimento_fronte
-            largura_fronte_cal = 10 if 0 < orcamento.largura_fronte < 10 else orcamento.largura_fronte
-            valor_fronte = comprimento_fronte_cal * largura_fronte_cal * material_para_calculo.valor / 10000
-            valor_total_criar += valor_fronte
-
-        # Pedra de Box
-        if orcamento.tipo_produto == 'Pedra de Box':
-            pricing_opts = opcoes_precificacao_empresa()
-            valor_total_criar = (valor_base * 2) + ((orcamento.comprimento or 0) / 100) * pricing_opts.get('pedra_box_adicional', 30)
-
-        # Cubas
-        if orcamento.tipo_cuba:
-            valor_cuba = cuba_valores.get(orcamento.tipo_cuba, 0)
-            valor_total_criar += valor_cuba * (orcamento.quantidade_cubas or 0)
-
-            if orcamento.tipo_cuba == 'Esculpida':
-                comprimento_cuba = orcamento.comprimento_cuba or 0
-                largura_cuba = orcamento.largura_cuba or 0
-                profundidade_cuba = orcamento.profundidade_cuba or 0
-                if orcamento.modelo_cuba == 'Prainha':
-                    m2_cuba = ((comprimento_cuba * largura_cuba) + (2 * largura_cuba * profundidade_cuba)) / 10000
-                else:
-                    m2_cuba = ((comprimento_cuba * largura_cuba * 2) +
-                               (2 * (comprimento_cuba + largura_cuba) * profundidade_cuba)) / 10000
-
-                valor_cuba_esculpida = m2_cuba * material_para_calculo.valor * (orcamento.quantidade_cubas or 1) 
-                valor_total_criar += valor_cuba_esculpida
-
-        # Cooktop
-        if orcamento.tem_cooktop == 'Sim':
-            valor_total_criar += cooktop_valor
-
-        # 🔥 CORREÇÃO: ADICIONAR INSTALAÇÃO AQUI - ANTES DA MULTIPLICAÇÃO POR QUANTIDADE
-        if orcamento.instalacao == 'Sim':
-            valor_total_criar += orcamento.instalacao_valor or 0
-
-        # Quantidade - MULTIPLICAR APÓS TODOS OS ACréSCIMOS
-        valor_total_criar *= orcamento.quantidade
-
-        # RT - usar os valores atuais ou novos
-        rt_para_calculo = rt if rt is not None else orcamento.rt
-        rt_percentual_para_calculo = rt_percentual if rt == 'Sim' else orcamento.rt_percentual
-
-        if rt_para_calculo == 'Sim' and rt_percentual_para_calculo > 0:
-            valor_rt = valor_total_criar / (1 - rt_percentual_para_calculo / 100) - valor_total_criar
-            valor_total_final = valor_total_criar + valor_rt
-        else:
-            valor_total_final = valor_total_criar
-
-        orcamento.valor_total = calcular_valor_item(
-            tipo_produto=orcamento.tipo_produto,
-            valor_material=material_para_calculo.valor,
-            quantidade=orcamento.quantidade,
-            comprimento=orcamento.comprimento,
-            largura=orcamento.largura,
-            instalacao=orcamento.instalacao,
-            instalacao_valor=orcamento.instalacao_valor,
-            rt=rt_para_calculo,
-            rt_percentual=rt_percentual_para_calculo,
-            comprimento_saia=orcamento.comprimento_saia,
-            largura_saia=orcamento.largura_saia,
-            comprimento_fronte=orcamento.comprimento_fronte,
-            largura_fronte=orcamento.largura_fronte,
-            tipo_cuba=orcamento.tipo_cuba,
-            quantidade_cubas=orcamento.quantidade_cubas,
-            comprimento_cuba=orcamento.comprimento_cuba,
-            largura_cuba=orcamento.largura_cuba,
-            profundidade_cuba=orcamento.profundidade_cuba,
-            modelo_cuba=orcamento.modelo_cuba,
-            cubas_valor_total=cubas_total(cubas_do_orcamento(orcamento), material_para_calculo.valor, pricing_opts.get('cuba_valores')),
-            tem_cooktop=orcamento.tem_cooktop,
-            acessorios_valor_total=acessorios_total(acessorios_do_orcamento(orcamento)),
-            acabamentos_valor_total=acabamentos_total(acabamentos_do_orcamento(orcamento)),
-            saia_fronte_valor_total=saia_fronte_total_orcamento(orcamento, material_para_calculo.valor, pricing_opts),
-            profundidade_nicho=orcamento.profundidade_nicho,
-            tem_fundo=orcamento.tem_fundo,
-            tem_alisar=orcamento.tem_alisar,
-            largura_alisar=orcamento.largura_alisar,
-            **pricing_opts,
-        )
-
-    db.session.commit()
+    # Todos os itens são precificados de uma vez com as mesmas opções da empresa
+    valores = regras_precificacao_empresa().calcular_lote(
+        colunas_precificacao_orcamentos(orcamentos, valores_material, pricing_opts)
+    )
+    for orcamento, valor_total in zip(orcamentos, valores):
+        orcamento.valor_total = valor_total
 
     # 🔥 Atualizar todos os orçamentos salvos afetados
-    orcamentos_salvos = OrcamentoSalvo.query.filter(
-        db.or_(*[OrcamentoSalvo.orcamentos_ids.like(f"%{id}%") for id in orcamento_ids])
-    ).all()
-
-    for orcamento_salvo in orcamentos_salvos:
-        atualizar_valor_orcamento_salvo(orcamento_salvo.id)
+    if cliente_id:
+        for orcamento_salvo in _orcamentos_salvos_com_itens(orcamento_ids):
+            orcamento_salvo.atualizar_cliente()
+    codigos = atualizar_valores_orcamentos_salvos(orcamento_ids)
+    db.session.commit()
+    invalidar_pdf_orcamento(*codigos)
 
     return jsonify({'success': 'Cliente, materiais, descrição, produto e RT atualizados, valores recalculados e orçamentos salvos atualizados.'})
 
@@ -4899,9 +6615,7 @@ def duplicar_selecionados():
             if original:
                 material = Material.query.get(original.material_id)
                 pricing_opts = opcoes_precificacao_empresa()
-                valor_total = calcular_valor_item(
-                    tipo_produto=original.tipo_produto,
-                    valor_material=material.valor if material else 0,
+                valor_total = regras_precificacao_empresa().funcao(original.tipo_produto)(material.valor if material else 0, dict(
                     quantidade=original.quantidade,
                     comprimento=original.comprimento,
                     largura=original.largura,
@@ -4928,8 +6642,7 @@ def duplicar_selecionados():
                     tem_fundo=original.tem_fundo,
                     tem_alisar=original.tem_alisar,
                     largura_alisar=original.largura_alisar,
-                    **pricing_opts,
-                )
+                ))
 
                 novo_orcamento = Orcamento(
                     cliente_id=original.cliente_id,
@@ -5016,6 +6729,8 @@ def salvar_rodape_orcamento(codigo):
     orcamento_salvo.exclude_payments = exclude_payments
     
     db.session.commit()
+    invalidar_pdf_orcamento(orcamento_salvo.codigo)
+    preaquecer_pdf_orcamento(orcamento_salvo)
     if ajax:
         return jsonify({'success': True})
 
@@ -5048,11 +6763,7 @@ def salvar_ordem_linhas_orcamento(codigo):
     if not isinstance(tabelas, dict):
         return jsonify({'success': False, 'message': 'Dados de ordenação inválidos.'}), 400
 
-    ids_orcamento = {
-        int(item_id)
-        for item_id in (orcamento_salvo.orcamentos_ids or '').split(',')
-        if str(item_id).strip().isdigit()
-    }
+    ids_orcamento = set(orcamento_salvo.ids_itens)
 
     ordem_atual = ordem_linhas_orcamento(orcamento_salvo)
     for chave_tabela, ids_tabela in tabelas.items():
@@ -5073,6 +6784,7 @@ def salvar_ordem_linhas_orcamento(codigo):
 
     orcamento_salvo.ordem_linhas_json = json.dumps(ordem_atual, ensure_ascii=False)
     db.session.commit()
+    invalidar_pdf_orcamento(orcamento_salvo.codigo)
     return jsonify({'success': True, 'ordem_linhas': ordem_atual})
 
 
@@ -5273,107 +6985,194 @@ def verificar_mesmo_cliente():
         print(f"Erro em verificar_mesmo_cliente: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# /orcamentos/json pagina por (data, id) decrescentes: o cursor é o último item
+# devolvido e cada página custa o mesmo, esteja no começo ou no fim da lista.
+ITENS_POR_PAGINA_PADRAO = 15
+ITENS_POR_PAGINA_MAX = 200
+
+# Total por combinação de filtros. Vale até um item ou cliente mudar neste
+# processo, ou por CONTAGEM_ITENS_TTL segundos (para o que outros workers gravam).
+_contagens_itens = {}
+_contagens_itens_lock = threading.Lock()
+_versao_contagens_itens = 0
+
+
+def invalidar_contagens_itens():
+    global _versao_contagens_itens
+    with _contagens_itens_lock:
+        _versao_contagens_itens += 1
+        _contagens_itens.clear()
+
+
+@event.listens_for(db.session, "before_flush")
+def _invalidar_contagens_itens_no_flush(sessao, contexto, instancias):
+    for obj in (*sessao.new, *sessao.dirty, *sessao.deleted):
+        if isinstance(obj, (Orcamento, Cliente)):
+            invalidar_contagens_itens()
+            return
+
+
+def _filtros_itens_orcamento(args):
+    """Filtros da listagem de itens a partir da query string, já com a visibilidade do usuário."""
+    filtros = {}
+    if not session.get('admin'):
+        filtros['dono'] = session.get('user_cpf')
+    elif args.get('dono'):
+        filtros['dono'] = args.get('dono')
+
+    filtro_cliente = args.get('filtro_cliente', 'Todos')
+    if filtro_cliente and filtro_cliente != 'Todos':
+        filtros['cliente_nome'] = filtro_cliente
+    for campo in ('cliente_id', 'material_id'):
+        valor = args.get(campo, type=int)
+        if valor:
+            filtros[campo] = valor
+    tipo_produto = (args.get('tipo_produto') or '').strip()
+    if tipo_produto:
+        filtros['tipo_produto'] = tipo_produto
+
+    try:
+        if args.get('filtro_data_inicio'):
+            filtros['data_inicio'] = datetime.strptime(args['filtro_data_inicio'], '%Y-%m-%d')
+    except ValueError:
+        pass
+    try:
+        if args.get('filtro_data_fim'):
+            data_fim = datetime.strptime(args['filtro_data_fim'], '%Y-%m-%d')
+            filtros['data_fim'] = data_fim.replace(hour=23, minute=59, second=59)
+    except ValueError:
+        pass
+    return filtros
+
+
+def _consulta_itens_orcamento(filtros):
+    query = db.session.query(
+        Orcamento,
+        Usuario.nome.label('nome_usuario'),
+        Cliente.nome.label('cliente_nome'),
+        Ambiente.nome.label('ambiente_nome'),
+        Descricao.nome.label('descricao_nome'),
+        Produto.nome.label('produto_nome'),
+        Material.nome.label('material_nome'),
+        Material.valor.label('valor_material'),
+    ).join(Usuario, Orcamento.dono == Usuario.cpf)\
+     .join(Cliente, Orcamento.cliente_id == Cliente.id)\
+     .join(Material, Orcamento.material_id == Material.id)\
+     .outerjoin(Ambiente, Orcamento.ambiente_id == Ambiente.id)\
+     .outerjoin(Descricao, Orcamento.descricao_id == Descricao.id)\
+     .outerjoin(Produto, Orcamento.produto_id == Produto.id)
+
+    if 'dono' in filtros:
+        query = query.filter(Orcamento.dono == filtros['dono'])
+    if 'cliente_nome' in filtros:
+        query = query.filter(Cliente.nome == filtros['cliente_nome'])
+    if 'cliente_id' in filtros:
+        query = query.filter(Orcamento.cliente_id == filtros['cliente_id'])
+    if 'material_id' in filtros:
+        query = query.filter(Orcamento.material_id == filtros['material_id'])
+    if 'tipo_produto' in filtros:
+        query = query.filter(Orcamento.tipo_produto == filtros['tipo_produto'])
+    if 'data_inicio' in filtros:
+        query = query.filter(Orcamento.data >= filtros['data_inicio'])
+    if 'data_fim' in filtros:
+        query = query.filter(Orcamento.data <= filtros['data_fim'])
+    return query
+
+
+def contar_itens_orcamento(filtros):
+    chave = tuple(sorted(filtros.items()))
+    agora = time.monotonic()
+    with _contagens_itens_lock:
+        versao = _versao_contagens_itens
+        em_cache = _contagens_itens.get(chave)
+    if em_cache and agora - em_cache[0] < Config.CONTAGEM_ITENS_TTL:
+        return em_cache[1]
+
+    total = _consulta_itens_orcamento(filtros).order_by(None).with_entities(db.func.count(Orcamento.id)).scalar()
+    with _contagens_itens_lock:
+        # Não grava um total contado antes de uma invalidação que chegou no meio
+        if versao == _versao_contagens_itens:
+            if len(_contagens_itens) >= 500:
+                _contagens_itens.clear()
+            _contagens_itens[chave] = (agora, total)
+    return total
+
+
+def _limite_itens_por_pagina(limite):
+    """Tamanho da página; 0 e 'all' (listar todos) passam a ser páginas do tamanho máximo."""
+    if str(limite).lower() in ('0', 'all'):
+        return ITENS_POR_PAGINA_MAX
+    try:
+        return min(max(int(limite), 1), ITENS_POR_PAGINA_MAX)
+    except (TypeError, ValueError):
+        return ITENS_POR_PAGINA_PADRAO
+
+
+def _cursor_item_orcamento(orcamento):
+    return f"{orcamento.data.strftime('%Y-%m-%dT%H:%M:%S.%f')}_{orcamento.id}"
+
+
+def _ler_cursor_item_orcamento(cursor):
+    data, _, item_id = cursor.rpartition('_')
+    return datetime.strptime(data, '%Y-%m-%dT%H:%M:%S.%f'), int(item_id)
+
+
+def pagina_itens_orcamento(filtros, limite, cursor=None):
+    """Linhas de _consulta_itens_orcamento após o cursor e o cursor da próxima página (ou None)."""
+    query = _consulta_itens_orcamento(filtros)
+    if cursor:
+        query = query.filter(db.tuple_(Orcamento.data, Orcamento.id) < _ler_cursor_item_orcamento(cursor))
+    linhas = query.order_by(Orcamento.data.desc(), Orcamento.id.desc()).limit(limite + 1).all()
+    if len(linhas) <= limite:
+        return linhas, None
+    linhas = linhas[:limite]
+    return linhas, _cursor_item_orcamento(linhas[-1][0])
+
+def _item_orcamento_json(row):
+    """Linha de _consulta_itens_orcamento no formato de /orcamentos/json."""
+    orcamento = row[0]  # Primeiro elemento é o objeto Orcamento
+    return {
+        'id': orcamento.id,
+        'cliente_nome': row.cliente_nome if hasattr(row, 'cliente_nome') else '',
+        'ambiente_nome': row.ambiente_nome if hasattr(row, 'ambiente_nome') and row.ambiente_nome else 'Não definido',
+        'descricao_nome': row.descricao_nome if hasattr(row, 'descricao_nome') and row.descricao_nome else 'Não definido',
+        'produto_nome': row.produto_nome if hasattr(row, 'produto_nome') and row.produto_nome else 'Não definido',
+        'tipo_produto': orcamento.tipo_produto,
+        'material_nome': row.material_nome if hasattr(row, 'material_nome') else '',
+        'valor_material': row.valor_material if hasattr(row, 'valor_material') else 0,
+        'quantidade': orcamento.quantidade,
+        'comprimento': orcamento.comprimento,
+        'largura': orcamento.largura,
+        'recortes': acessorios_texto(orcamento),
+        'acabamentos': acabamentos_texto(orcamento),
+        'instalacao': orcamento.instalacao,
+        'instalacao_valor': orcamento.instalacao_valor,
+        'rt_percentual': orcamento.rt_percentual,
+        'valor_total': orcamento.valor_total,
+        'data': orcamento.data.strftime('%d-%m-%y') if orcamento.data else '',
+        'nome_usuario': row.nome_usuario if hasattr(row, 'nome_usuario') else '',
+        'data_attr': orcamento.data.strftime('%Y-%m-%d %H:%M:%S') if orcamento.data else ''
+    }
+
 @app.route('/orcamentos/json', methods=['GET'])
 def orcamentos_json():
     try:
-        user_cpf = session.get('user_cpf')
-        is_admin = session.get('admin')
-        
-        # Obter parâmetros de filtro
-        filtro_cliente = request.args.get('filtro_cliente', 'Todos')
-        filtro_data_inicio = request.args.get('filtro_data_inicio', '')
-        filtro_data_fim = request.args.get('filtro_data_fim', '')
-        limite = request.args.get('limite', '15')
-        
-        # Converter limite para inteiro
+        filtros = _filtros_itens_orcamento(request.args)
+        limite = _limite_itens_por_pagina(request.args.get('limite', ITENS_POR_PAGINA_PADRAO))
+        cursor = request.args.get('cursor') or None
         try:
-            if limite == '0' or limite.lower() == 'all':
-                limite_int = 0
-            else:
-                limite_int = int(limite)
-        except (ValueError, TypeError):
-            limite_int = 15
-
-        # 🔥 CORREÇÃO: Query corrigida com outerjoins adequados
-        query_base = db.session.query(
-            Orcamento,
-            Usuario.nome.label('nome_usuario'),
-            Cliente.nome.label('cliente_nome'),
-            Ambiente.nome.label('ambiente_nome'),
-            Descricao.nome.label('descricao_nome'),
-            Produto.nome.label('produto_nome'),
-            Material.nome.label('material_nome'),
-            Material.valor.label('valor_material')  # ðŸ”¥ ADICIONADO: valor do material
-        ).join(Usuario, Orcamento.dono == Usuario.cpf)\
-         .join(Cliente, Orcamento.cliente_id == Cliente.id)\
-         .join(Material, Orcamento.material_id == Material.id)\
-         .outerjoin(Ambiente, Orcamento.ambiente_id == Ambiente.id)\
-         .outerjoin(Descricao, Orcamento.descricao_id == Descricao.id)\
-         .outerjoin(Produto, Orcamento.produto_id == Produto.id)
-
-        # Aplicar filtro de usuário se não for admin
-        if not is_admin:
-            query_base = query_base.filter(Orcamento.dono == user_cpf)
-
-        # Aplicar filtros adicionais
-        if filtro_cliente != 'Todos':
-            query_base = query_base.filter(Cliente.nome == filtro_cliente)
-        
-        if filtro_data_inicio:
-            try:
-                data_inicio = datetime.strptime(filtro_data_inicio, '%Y-%m-%d')
-                query_base = query_base.filter(Orcamento.data >= data_inicio)
-            except ValueError:
-                pass
-        
-        if filtro_data_fim:
-            try:
-                data_fim = datetime.strptime(filtro_data_fim, '%Y-%m-%d')
-                data_fim = data_fim.replace(hour=23, minute=59, second=59)
-                query_base = query_base.filter(Orcamento.data <= data_fim)
-            except ValueError:
-                pass
-
-        # Ordenar e limitar
-        query_base = query_base.order_by(Orcamento.data.desc())
-        
-        if limite_int > 0:
-            query_base = query_base.limit(limite_int)
-
-        orcamentos_data = query_base.all()
+            orcamentos_data, proximo_cursor = pagina_itens_orcamento(filtros, limite, cursor)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Cursor inválido'}), 400
 
-        # Formatar dados para JSON
-        orcamentos_json = []
-        for row in orcamentos_data:
-            orcamento = row[0]  # Primeiro elemento é o objeto Orcamento
-            
-            orcamentos_json.append({
-                'id': orcamento.id,
-                'cliente_nome': row.cliente_nome if hasattr(row, 'cliente_nome') else '',
-                'ambiente_nome': row.ambiente_nome if hasattr(row, 'ambiente_nome') and row.ambiente_nome else 'Não definido',
-                'descricao_nome': row.descricao_nome if hasattr(row, 'descricao_nome') and row.descricao_nome else 'Não definido',
-                'produto_nome': row.produto_nome if hasattr(row, 'produto_nome') and row.produto_nome else 'Não definido',
-                'tipo_produto': orcamento.tipo_produto,
-                'material_nome': row.material_nome if hasattr(row, 'material_nome') else '',
-                'valor_material': row.valor_material if hasattr(row, 'valor_material') else 0,  # ðŸ”¥ NOVO
-                'quantidade': orcamento.quantidade,
-                'comprimento': orcamento.comprimento,
-                'largura': orcamento.largura,
-                'recortes': acessorios_texto(orcamento),
-                'acabamentos': acabamentos_texto(orcamento),
-                'instalacao': orcamento.instalacao,
-                'instalacao_valor': orcamento.instalacao_valor,  # ðŸ”¥ NOVO
-                'rt_percentual': orcamento.rt_percentual,  # ðŸ”¥ NOVO
-                'valor_total': orcamento.valor_total,
-                'data': orcamento.data.strftime('%d-%m-%y') if orcamento.data else '',
-                'nome_usuario': row.nome_usuario if hasattr(row, 'nome_usuario') else '',
-                'data_attr': orcamento.data.strftime('%Y-%m-%d %H:%M:%S') if orcamento.data else ''
-            })
+        orcamentos_json = [_item_orcamento_json(row) for row in orcamentos_data]
 
         return jsonify({
             'success': True,
             'orcamentos': orcamentos_json,
-            'total': len(orcamentos_json)
+            'quantidade': len(orcamentos_json),
+            'total': contar_itens_orcamento(filtros),
+            'proximo_cursor': proximo_cursor,
         })
 
     except Exception as e:
@@ -5382,50 +7181,125 @@ def orcamentos_json():
         print(traceback.format_exc())
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/ordens_servico')
-def ordens_servico():
-    user_cpf = session.get("user_cpf")
-    is_admin = session.get("admin")
+# Exportação em streaming: cada lote é lido inteiro (.all()) e vira texto assim que
+# chega, então a memória não cresce com a quantidade de linhas e nenhum cursor do
+# SQLite fica aberto entre um lote e outro enquanto o cliente baixa o arquivo.
+EXPORTACAO_LOTE = 500
+FORMATOS_EXPORTACAO = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+CAMPOS_EXPORTACAO_ITENS = (
+    'id', 'data', 'nome_usuario', 'cliente_nome', 'ambiente_nome', 'descricao_nome', 'produto_nome',
+    'tipo_produto', 'material_nome', 'valor_material', 'quantidade', 'comprimento', 'largura',
+    'acabamentos', 'recortes', 'instalacao', 'instalacao_valor', 'rt_percentual', 'valor_total',
+)
+CAMPOS_EXPORTACAO_ORCAMENTOS_SALVOS = (
+    'codigo', 'data_salvo', 'cliente', 'criado_por', 'status', 'tipo_cliente', 'valor_total',
+)
+CAMPOS_EXPORTACAO_VENDAS = CAMPOS_EXPORTACAO_ORCAMENTOS_SALVOS + (
+    'valor_venda', 'forma_pagamento', 'data_fechamento', 'entrada_percentual', 'entrada_valor',
+    'final_percentual', 'final_valor', 'observacao_vendas',
+)
+
+
+def _em_lotes_por_id(query, coluna_id):
+    """Linhas de query na ordem dela, buscadas em lotes pelos ids lidos de antemão.
+
+    Serve para ordenações sem chave única para paginar (código, cliente, valor...).
+    """
+    ids = [linha[0] for linha in query.with_entities(coluna_id).all()]
+    for inicio in range(0, len(ids), EXPORTACAO_LOTE):
+        yield from query.filter(coluna_id.in_(ids[inicio:inicio + EXPORTACAO_LOTE])).all()
+
+
+def _exportar_itens(args):
+    filtros = _filtros_itens_orcamento(args)
+    cursor = None
+    while True:
+        # Mesmo cursor (data, id) da listagem: cada lote é uma consulta curta
+        linhas, cursor = pagina_itens_orcamento(filtros, EXPORTACAO_LOTE, cursor)
+        for row in linhas:
+            linha = _item_orcamento_json(row)
+            linha['data'] = linha.pop('data_attr')
+            yield linha
+        if cursor is None:
+            break
+
+
+def _linha_exportacao_orcamento_salvo(orcamento, cliente_nome):
+    return {
+        'codigo': orcamento.codigo,
+        'data_salvo': orcamento.data_salvo.strftime('%Y-%m-%d %H:%M:%S') if orcamento.data_salvo else '',
+        'cliente': cliente_nome or '',
+        'criado_por': orcamento.criado_por or '',
+        'status': orcamento.status or 'Em Espera',
+        'tipo_cliente': orcamento.tipo_cliente or '',
+        'valor_total': orcamento.valor_total,
+    }
 
-    orcamentos_salvos = OrcamentoSalvo.query.order_by(OrcamentoSalvo.codigo.desc()).all()
 
-    resultado = []
+def _exportar_orcamentos_salvos(args):
+    query, _ = _consulta_orcamentos_salvos_filtrada(args)
+    for linha in _em_lotes_por_id(query, OrcamentoSalvo.id):
+        yield _linha_exportacao_orcamento_salvo(linha, linha.cliente_nome)
 
-    for orc_salvo in orcamentos_salvos:
-        primeiro_orcamento_id = int(orc_salvo.orcamentos_ids.split(",")[0])
-        primeiro_orcamento = Orcamento.query.get(primeiro_orcamento_id)
 
-        if not primeiro_orcamento:
-            continue
+def _exportar_vendas(args):
+    _, orcamentos, _, _, _ = _consultas_relatorio_vendas(args)
+    for orcamento, cliente_nome in _em_lotes_por_id(_consulta_com_nome_cliente(orcamentos), OrcamentoSalvo.id):
+        dados = _dados_venda_orcamento(orcamento)
+        linha = _linha_exportacao_orcamento_salvo(orcamento, cliente_nome)
+        linha.update({campo: dados[campo] for campo in CAMPOS_EXPORTACAO_VENDAS if campo in dados})
+        yield linha
 
-        cliente = Cliente.query.get(primeiro_orcamento.cliente_id)
-        if not cliente:
-            continue
 
-        if is_admin or cliente.dono == user_cpf:
-            resultado.append({
-                'id': orc_salvo.id,
-                'codigo': orc_salvo.codigo,
-                'data_salvo': orc_salvo.data_salvo,
-                'valor_total': orc_salvo.valor_total,
-                'criado_por': orc_salvo.criado_por,
-                'status': orc_salvo.status,
-                'tipo_cliente': orc_salvo.tipo_cliente,
-                'cliente_nome': cliente.nome,
-                'cliente_dono': cliente.dono
-            })
+EXPORTACOES = {
+    'itens': (_exportar_itens, CAMPOS_EXPORTACAO_ITENS),
+    'orcamentos_salvos': (_exportar_orcamentos_salvos, CAMPOS_EXPORTACAO_ORCAMENTOS_SALVOS),
+    'vendas': (_exportar_vendas, CAMPOS_EXPORTACAO_VENDAS),
+}
 
-    if is_admin:
-        clientes = Cliente.query.all()
-    else:
-        clientes = Cliente.query.filter_by(dono=user_cpf).all()
 
-    usuarios = Usuario.query.all()
+def _texto_exportacao(linhas, formato, campos):
+    """Gera o arquivo em pedaços de uns 64 KB a partir de dicts com as chaves de campos."""
+    buffer = io.StringIO()
+    if formato == 'csv':
+        escritor = csv.DictWriter(buffer, campos, extrasaction='ignore')
+        buffer.write('\ufeff')  # BOM para o Excel abrir como UTF-8
+        escritor.writeheader()
+        escrever = escritor.writerow
+    else:
+        def escrever(linha):
+            buffer.write(json.dumps({campo: linha.get(campo) for campo in campos}, ensure_ascii=False, default=str))
+            buffer.write('\n')
+    for linha in linhas:
+        escrever(linha)
+        if buffer.tell() >= 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+@app.route('/exportar/<tipo>.<formato>')
+def exportar(tipo, formato):
+    """Exporta itens, orçamentos salvos ou vendas com os mesmos filtros das telas."""
+    if 'user_cpf' not in session:
+        return redirect(url_for('login'))
+    if tipo not in EXPORTACOES or formato not in FORMATOS_EXPORTACAO:
+        abort(404)
+    gerar_linhas, campos = EXPORTACOES[tipo]
+    nome_arquivo = f"{tipo}_{datetime.now(br_tz):%Y%m%d_%H%M}.{formato}"
+    return app.response_class(
+        stream_with_context(_texto_exportacao(gerar_linhas(request.args), formato, campos)),
+        mimetype=FORMATOS_EXPORTACAO[formato],
+        headers={'Content-Disposition': f'attachment; filename="{nome_arquivo}"'},
+    )
 
-    return render_template("ordens_servico.html",
-                           clientes=clientes,
-                           usuarios=usuarios,
-                           orcamentos=resultado)
+@app.route('/ordens_servico')
+def ordens_servico():
+    return render_template("ordens_servico.html", **_listagem_orcamentos_salvos())
 
 
 
@@ -5453,6 +7327,13 @@ def salvar_desenho_ordem_servico(codigo):
         if not orcamento_salvo:
             return jsonify({"success": False, "error": "Orçamento salvo não encontrado"}), 404
 
+        sha_atual = orcamento_salvo.desenho_ordem_servico_hash
+        if sha_atual and not armazem_blobs.existe(sha_atual):
+            return jsonify({
+                "success": False,
+                "error": "O desenho salvo desta OS não está disponível no servidor. Restaure o backup antes de salvar."
+            }), 409
+
         # IMPORTANTE:
         # A tabela DesenhoOrdemServico é reservada para desenhos/imagens gerados pelo
         # fluxo público "Gere seu Orçamento" do configurador 3D. É essa tabela que
@@ -5490,7 +7371,7 @@ def detalhes_ordem_servico(codigo):
         return redirect(url_for('ordens_servico'))
 
     # 🔥 BUSCAR ORÇAMENTOS VINCULADOS
-    ids = [int(id) for id in orcamento_salvo.orcamentos_ids.split(",")]
+    ids = orcamento_salvo.ids_itens
     orcamentos = Orcamento.query.filter(Orcamento.id.in_(ids)).all()
     
     if not orcamentos:
@@ -5545,17 +7426,30 @@ def detalhes_ordem_servico(codigo):
     # O configurador 3D salva imagem data:image/... em DesenhoOrdemServico para o botão azul
     # "Ver Desenho". Essa imagem não pode ser colocada como innerHTML na OS.
     desenho_salvo = None
-    if _eh_html_ordem_servico(orcamento_salvo.desenho_ordem_servico):
-        desenho_salvo = orcamento_salvo.desenho_ordem_servico
-    else:
-        desenho_registro = DesenhoOrdemServico.query.filter_by(
-            orcamento_salvo_codigo=codigo
-        ).order_by(DesenhoOrdemServico.data_criacao.desc()).first()
-
-        # Compatibilidade com registros antigos que, por erro, salvaram HTML editável
-        # na tabela do configurador. Imagens do configurador são ignoradas aqui.
-        if desenho_registro and _eh_html_ordem_servico(desenho_registro.desenho_data):
-            desenho_salvo = desenho_registro.desenho_data
+    desenho_indisponivel = False
+    try:
+        if _eh_html_ordem_servico(orcamento_salvo.desenho_ordem_servico):
+            desenho_salvo = orcamento_salvo.desenho_ordem_servico
+        else:
+            desenho_registro = DesenhoOrdemServico.query.filter_by(
+                orcamento_salvo_codigo=codigo
+            ).order_by(DesenhoOrdemServico.data_criacao.desc()).first()
+
+            # Compatibilidade com registros antigos que, por erro, salvaram HTML editável
+            # na tabela do configurador. Imagens do configurador são ignoradas aqui.
+            if desenho_registro and not desenho_registro.eh_imagem and _eh_html_ordem_servico(desenho_registro.desenho_data):
+                desenho_salvo = desenho_registro.desenho_data
+    except DesenhoIndisponivel:
+        # Sem o arquivo, a tela abriria vazia e salvar apagaria a referência ao desenho
+        desenho_indisponivel = True
+
+    # Imagens do configurador 3D como referência abaixo da área de desenho: só as
+    # miniaturas entram na página, a imagem inteira abre pelo link
+    desenhos_configurador = DesenhoOrdemServico.query.filter(
+        DesenhoOrdemServico.orcamento_salvo_codigo == codigo,
+        DesenhoOrdemServico.desenho_hash.isnot(None),
+        DesenhoOrdemServico.desenho_mime.in_(MIMES_IMAGEM_DESENHO.values()),
+    ).order_by(DesenhoOrdemServico.data_criacao.asc()).all()
 
     # ðŸ”¥ RENDERIZAR TEMPLATE COM TODOS OS DADOS
     return render_template(
@@ -5568,7 +7462,9 @@ def detalhes_ordem_servico(codigo):
         materiais_agrupados=materiais_agrupados,
         grupos_pecas_json=grupos_pecas_json,
         telefone_usuario=telefone_usuario,
-        desenho_salvo=desenho_salvo
+        desenho_salvo=desenho_salvo,
+        desenho_indisponivel=desenho_indisponivel,
+        desenhos_configurador=desenhos_configurador
     )
 
 @app.route('/excluir_item_orcamento/<codigo>', methods=['POST'])
@@ -5625,9 +7521,9 @@ def excluir_item_orcamento(codigo):
             return redirect(url_for('detalhes_orcamento_salvo', codigo=codigo))
         
         # Verificar se o item pertence a este orçamento salvo
-        orcamento_ids = orcamento_salvo.orcamentos_ids.split(',')
+        orcamento_ids = orcamento_salvo.ids_itens
         
-        if str(item_id) not in orcamento_ids:
+        if int(item_id) not in orcamento_ids:
             if wants_json:
                 return jsonify({"success": False, "error": "Este item não pertence a este orçamento!"}), 400
             flash("Este item não pertence a este orçamento!", "error")
@@ -5650,13 +7546,14 @@ def excluir_item_orcamento(codigo):
             db.session.add(nova_remocao)
         
         # Remover o ID do item excluído da lista de IDs
-        orcamento_ids_atualizados = [id.strip() for id in orcamento_ids if id.strip() != str(item_id)]
+        orcamento_ids_atualizados = [id for id in orcamento_ids if id != int(item_id)]
         
         # Verificar se ainda há itens no orçamento salvo
         if not orcamento_ids_atualizados:
             # Se não houver mais itens, excluir o orçamento salvo
             db.session.delete(orcamento_salvo)
             db.session.commit()
+            invalidar_pdf_orcamento(codigo)
             
             if wants_json:
                 return jsonify({
@@ -5668,17 +7565,16 @@ def excluir_item_orcamento(codigo):
             return redirect(url_for('listar_orcamentos_salvos'))
         
         # Atualizar a lista de IDs no orçamento salvo
-        orcamento_salvo.orcamentos_ids = ','.join(orcamento_ids_atualizados)
+        orcamento_salvo.definir_itens(orcamento_ids_atualizados)
         
         # Recalcular o valor total do orçamento salvo
-        orcamentos_restantes = Orcamento.query.filter(
-            Orcamento.id.in_([int(id) for id in orcamento_ids_atualizados if id.isdigit()])
-        ).all()
+        orcamentos_restantes = Orcamento.query.filter(Orcamento.id.in_(orcamento_ids_atualizados)).all()
         
         novo_valor_total = sum(orc.valor_total for orc in orcamentos_restantes)
         orcamento_salvo.valor_total = novo_valor_total
         
         db.session.commit()
+        invalidar_pdf_orcamento(codigo)
         
         # 🔥 Log da operação
         print(f"✅ Item removido da lista (não excluído do BD): ID={item_id}, Tipo={tipo_produto}")
@@ -5723,13 +7619,13 @@ def restaurar_item_orcamento(codigo, item_id):
             return jsonify({"success": False, "error": "Item não encontrado"}), 404
         
         # Verificar se o item já está na lista
-        orcamento_ids = orcamento_salvo.orcamentos_ids.split(',')
-        if str(item_id) in [id.strip() for id in orcamento_ids]:
+        orcamento_ids = orcamento_salvo.ids_itens
+        if item_id in orcamento_ids:
             return jsonify({"success": False, "error": "Item já está no orçamento"}), 400
         
         # Adicionar o item de volta à lista
-        orcamento_ids.append(str(item_id))
-        orcamento_salvo.orcamentos_ids = ','.join(orcamento_ids)
+        orcamento_ids.append(item_id)
+        orcamento_salvo.definir_itens(orcamento_ids)
         
         # 🔥 REMOVER REGISTRO DE REMOÇÃO
         ItemRemovidoOrcamento.query.filter_by(
@@ -5738,14 +7634,13 @@ def restaurar_item_orcamento(codigo, item_id):
         ).delete()
         
         # Recalcular valor total
-        orcamentos = Orcamento.query.filter(
-            Orcamento.id.in_([int(id) for id in orcamento_ids if id.strip().isdigit()])
-        ).all()
+        orcamentos = Orcamento.query.filter(Orcamento.id.in_(orcamento_ids)).all()
         
         novo_valor_total = sum(orc.valor_total for orc in orcamentos)
         orcamento_salvo.valor_total = novo_valor_total
         
         db.session.commit()
+        invalidar_pdf_orcamento(codigo)
         
         return jsonify({
             "success": True,
@@ -5769,7 +7664,7 @@ def itens_excluidos_orcamento(codigo):
         return redirect(url_for('listar_orcamentos_salvos'))
     
     # IDs atuais no orçamento salvo
-    ids_atuais = [int(id.strip()) for id in orcamento_salvo.orcamentos_ids.split(',') if id.strip().isdigit()]
+    ids_atuais = orcamento_salvo.ids_itens
     
     # Buscar todos os orçamentos do cliente (para sugerir itens para restaurar)
     primeiro_id = ids_atuais[0] if ids_atuais else None
@@ -5860,6 +7755,8 @@ def itens_excluidos_count(codigo):
 
 
 criar_banco()
+# Pedidos do configurador que ficaram na fila em disco quando o processo parou
+configurador_executor.submit(drenar_fila_configurador)
 
 if __name__ == '__main__':
     port = int(os.getenv("PORT", "5000"))
@@ -0,0 +1,110 @@
+"""Mede o tempo de geração do PDF de um orçamento salvo com 50 itens.
+
+Compara o caminho antigo (tela completa detalhes_orcamento_salvo.html e um
+HTML(...).write_pdf() novo a cada PDF, buscando o CSS por HTTP no próprio
+servidor) com o RenderizadorWeasyPrint aquecido e com o template de impressão.
+
+Uso: python benchmark_pdf.py [repeticoes]
+"""
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+_pasta = tempfile.mkdtemp(prefix="benchmark_pdf_")
+os.environ["DATABASE_PATH"] = os.path.join(_pasta, "benchmark.db")
+os.environ["PDF_CACHE_DIR"] = os.path.join(_pasta, "pdf_cache")
+
+from flask import render_template  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import app as aplicacao  # noqa: E402
+from pdf_render import RenderizadorWeasyPrint, _get_weasyprint_html  # noqa: E402
+
+TOTAL_ITENS = 50
+TIPOS = ["Bancada", "Nicho", "Pedra de Box", "Pedra Bipolida", "Soleira"]
+
+
+def _criar_orcamento_salvo(cliente):
+    cliente.post("/setup", data={"nome": "Benchmark", "cpf": "00000000000", "senha": "benchmark"})
+    cliente.post("/login", data={"cpf": "00000000000", "senha": "benchmark"})
+    with aplicacao.app.app_context():
+        db = aplicacao.db
+        material = aplicacao.Material(nome="Granito São Gabriel", valor=850)
+        cli = aplicacao.Cliente(nome="Cliente Benchmark", telefone="11 90000-0000", dono="00000000000")
+        ambientes = [aplicacao.Ambiente(nome=f"Ambiente {i}", dono="00000000000") for i in range(5)]
+        descricao = aplicacao.Descricao(nome="Peça", dono="00000000000")
+        produto = aplicacao.Produto(nome="Produto", dono="00000000000")
+        db.session.add_all([material, cli, descricao, produto, *ambientes])
+        db.session.commit()
+        ids = dict(material=material.id, cliente=cli.id, descricao=descricao.id, produto=produto.id)
+        ambientes_ids = [a.id for a in ambientes]
+
+    for i in range(TOTAL_ITENS):
+        cliente.post("/orcamentos", data={
+            "cliente_id": ids["cliente"],
+            "ambiente_id": ambientes_ids[i % len(ambientes_ids)],
+            "descricao_id": ids["descricao"],
+            "produto_id": ids["produto"],
+            "tipo_produto": TIPOS[i % len(TIPOS)],
+            "material_id": ids["material"],
+            "quantidade": "1",
+            "comprimento": str(80 + i),
+            "largura": "60",
+            "profundidade_nicho": "10",
+            "tem_fundo": "Sim",
+            "saia_fronte_tipo[]": ["Saia"],
+            "saia_fronte_comprimento[]": [str(80 + i)],
+            "saia_fronte_largura[]": ["5"],
+        })
+    itens = cliente.get("/orcamentos/json?limite=all").get_json()["orcamentos"]
+    resposta = cliente.post("/salvar_orcamento", json={"ids": ",".join(str(o["id"]) for o in itens)})
+    return resposta.get_json()["codigo"]
+
+
+def _medir(nome, gerar, repeticoes):
+    tempos = []
+    tamanho = 0
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        tamanho = len(gerar())
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    print(
+        f"{nome:<32} primeiro {tempos[0]:8.1f} ms | média {statistics.mean(tempos):8.1f} ms | "
+        f"mediana {statistics.median(tempos):8.1f} ms | {tamanho / 1024:.0f} KB"
+    )
+
+
+def main():
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    cliente = aplicacao.app.test_client()
+    codigo = _criar_orcamento_salvo(cliente)
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    servidor = make_server("127.0.0.1", 0, aplicacao.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{servidor.server_port}/"
+
+    with aplicacao.app.test_request_context(base_url=base_url):
+        orcamento_salvo = aplicacao.OrcamentoSalvo.query.filter_by(codigo=codigo).first()
+        _, contexto = aplicacao._preparar_pdf_orcamento(orcamento_salvo)
+        html_tela = render_template("detalhes_orcamento_salvo.html", pdf=True, **contexto)
+        html_impressao = render_template(aplicacao.PDF_TEMPLATE, **contexto)
+
+    print(
+        f"Orçamento {codigo}: {len(orcamento_salvo.ids_itens)} itens, HTML da tela com "
+        f"{len(html_tela) / 1024:.0f} KB, de impressão com {len(html_impressao) / 1024:.0f} KB"
+    )
+    HTML = _get_weasyprint_html()
+    _medir("tela, HTML novo a cada PDF", lambda: HTML(string=html_tela, base_url=base_url).write_pdf(), repeticoes)
+    renderizador = RenderizadorWeasyPrint()
+    _medir("tela, renderizador quente", lambda: renderizador.renderizar(html_tela, base_url), repeticoes)
+    _medir("impressão, renderizador quente", lambda: renderizador.renderizar(html_impressao, base_url), repeticoes)
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Mede itens/s do cálculo de preço item a item, das regras compiladas e do lote.
+
+Usa os itens de orcamentos_sinteticos com as opções "empresa" da regressão. Mede
+os totais de cuba, saia/fronte e acabamentos que o app calcula antes do preço e
+depois as formas de chamar as regras: calcular_valor_item(**item, **opcoes), que
+separa as opções e busca as regras a cada chamada, RegrasPrecificacao(**opcoes)
+por calcular(**item) e direto pela função do tipo (como as rotas do app) e
+calcular_valores_itens (como a edição em lote e a reprecificação). Todas usam a
+mesma implementação; confere também que dão o mesmo resultado.
+
+Uso: python benchmark_precificacao.py [itens] [repeticoes]
+"""
+import statistics
+import sys
+import time
+
+from orcamentos_sinteticos import gerar_itens
+from pricing import COLUNAS_ITEM, RegrasPrecificacao, calcular_valor_item, calcular_valores_itens
+from regressao_precificacao import OPCOES, argumentos_itens
+
+
+def _medir(nome, calcular, total, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        valores = calcular()
+        tempos.append(time.perf_counter() - inicio)
+    mediana = statistics.median(tempos)
+    print(
+        f"{nome:<36} mín {min(tempos) * 1000:8.2f} ms | média {statistics.mean(tempos) * 1000:8.2f} ms | "
+        f"mediana {mediana * 1000:8.2f} ms | {total / mediana:10,.0f} itens/s"
+    )
+    return list(valores)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    opcoes = OPCOES["empresa"]
+    itens = gerar_itens(total)
+    print(f"{total} itens, {repeticoes} repetições")
+    _medir("totais de cuba, saia/fronte e acab.", lambda: argumentos_itens(itens, opcoes), total, repeticoes)
+    argumentos = argumentos_itens(itens, opcoes)
+    colunas = {nome: [item.get(nome, padrao) for item in argumentos] for nome, padrao in COLUNAS_ITEM.items()}
+    colunas["tipo_produto"] = [item["tipo_produto"] for item in argumentos]
+    colunas["valor_material"] = [item["valor_material"] for item in argumentos]
+
+    atual = _medir(
+        "calcular_valor_item",
+        lambda: [calcular_valor_item(**item, **opcoes) for item in argumentos],
+        total, repeticoes,
+    )
+    regras = RegrasPrecificacao(**opcoes)
+    compiladas = _medir("RegrasPrecificacao.calcular", lambda: [regras.calcular(**item) for item in argumentos], total, repeticoes)
+    funcoes = _medir(
+        "RegrasPrecificacao.funcao(tipo)",
+        lambda: [regras.funcao(item["tipo_produto"])(item["valor_material"], item) for item in argumentos],
+        total, repeticoes,
+    )
+    lote = _medir("calcular_valores_itens", lambda: calcular_valores_itens(colunas, **opcoes), total, repeticoes)
+
+    if not atual == compiladas == funcoes == lote:
+        sys.exit("Os caminhos de cálculo divergem!")
+    print("Resultados idênticos em todos os caminhos.")
+
+
+if __name__ == "__main__":
+    main()
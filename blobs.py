@@ -0,0 +1,92 @@
+"""Armazém de blobs endereçado pelo SHA-256 do conteúdo.
+
+Cada conteúdo é gravado uma única vez em <pasta>/<2 primeiros dígitos>/<sha256>,
+comprimido com zlib quando isso reduz o tamanho; quem usa guarda só o hash. Não
+importa o app, para poder ser usado por scripts e comandos de manutenção.
+"""
+
+import hashlib
+import os
+import re
+import zlib
+
+# Primeiro byte do arquivo: conteúdo comprimido com zlib ou gravado como veio
+_ZLIB = b"z"
+_CRU = b"-"
+_HASH_VALIDO = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ArmazemBlobs:
+    def __init__(self, pasta, nivel_compressao=6):
+        self.pasta = pasta
+        self.nivel_compressao = nivel_compressao
+
+    def caminho(self, sha):
+        if not _HASH_VALIDO.match(sha or ""):
+            raise ValueError(f"Hash de blob inválido: {sha!r}")
+        return os.path.join(self.pasta, sha[:2], sha)
+
+    def existe(self, sha):
+        return os.path.exists(self.caminho(sha))
+
+    def gravar(self, dados):
+        """Grava os bytes se ainda não existirem e devolve o SHA-256 deles."""
+        sha = hashlib.sha256(dados).hexdigest()
+        caminho = self.caminho(sha)
+        if os.path.exists(caminho):
+            return sha
+        comprimido = zlib.compress(dados, self.nivel_compressao)
+        conteudo = _ZLIB + comprimido if len(comprimido) < len(dados) else _CRU + dados
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        try:
+            with open(temporario, "wb") as arquivo:
+                arquivo.write(conteudo)
+            os.replace(temporario, caminho)
+        finally:
+            if os.path.exists(temporario):
+                os.unlink(temporario)
+        return sha
+
+    def importar(self, sha, conteudo):
+        """Grava um arquivo no formato do armazém (vindo de um backup) depois de conferir o hash."""
+        try:
+            if conteudo[:1] == _ZLIB:
+                dados = zlib.decompress(conteudo[1:])
+            elif conteudo[:1] == _CRU:
+                dados = conteudo[1:]
+            else:
+                raise ValueError(f"Blob sem cabeçalho válido: {sha}")
+        except zlib.error as exc:
+            raise ValueError(f"Blob corrompido: {sha}") from exc
+        if hashlib.sha256(dados).hexdigest() != sha:
+            raise ValueError(f"Blob não confere com o hash: {sha}")
+        return self.gravar(dados)
+
+    def ler(self, sha):
+        """Bytes originais do blob; levanta OSError se o arquivo não existir."""
+        with open(self.caminho(sha), "rb") as arquivo:
+            conteudo = arquivo.read()
+        if conteudo[:1] == _ZLIB:
+            return zlib.decompress(conteudo[1:])
+        return conteudo[1:]
+
+    def remover(self, sha):
+        try:
+            os.unlink(self.caminho(sha))
+        except OSError:
+            pass
+
+    def listar(self):
+        """(sha, tamanho em disco, mtime) de cada blob gravado."""
+        try:
+            subpastas = [entrada.path for entrada in os.scandir(self.pasta) if entrada.is_dir()]
+        except OSError:
+            return
+        for subpasta in subpastas:
+            with os.scandir(subpasta) as entradas:
+                for entrada in entradas:
+                    if not _HASH_VALIDO.match(entrada.name):
+                        continue
+                    info = entrada.stat()
+                    yield entrada.name, info.st_size, info.st_mtime
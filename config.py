@@ -20,3 +20,46 @@ class Config:
         "DATABASE_URL",
         f"sqlite:///{DATABASE_PATH.replace(os.sep, '/')}",
     )
+
+    # Cache em disco dos PDFs de orçamento, ao lado do banco por padrão.
+    PDF_CACHE_DIR = os.getenv(
+        "PDF_CACHE_DIR",
+        os.path.join(os.path.dirname(DATABASE_PATH), "pdf_cache"),
+    )
+    PDF_CACHE_MAX_MB = int(os.getenv("PDF_CACHE_MAX_MB", "200"))
+
+    # Desenhos da OS e do configurador, gravados por hash do conteúdo fora do banco.
+    BLOB_DIR = os.getenv(
+        "BLOB_DIR",
+        os.path.join(os.path.dirname(DATABASE_PATH), "blobs"),
+    )
+    # Lado maior, em pixels, da miniatura WebP gerada para os desenhos do configurador.
+    MINIATURA_DESENHO_PX = int(os.getenv("MINIATURA_DESENHO_PX", "480"))
+    # Lado menor, em pixels, das versões reduzidas do logo para o cabeçalho e para o PDF.
+    LOGO_CABECALHO_PX = int(os.getenv("LOGO_CABECALHO_PX", "192"))
+    LOGO_PDF_PX = int(os.getenv("LOGO_PDF_PX", "400"))
+
+    # Processos dedicados à renderização de PDF e limite de jobs na fila, por worker.
+    PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+    PDF_FILA_MAX = int(os.getenv("PDF_FILA_MAX", "20"))
+
+    # Itens reprecificados por transação quando o valor de um material muda.
+    REPRECIFICACAO_LOTE = int(os.getenv("REPRECIFICACAO_LOTE", "200"))
+
+    # Segundos que o total de itens por filtro de /orcamentos/json fica em cache.
+    CONTAGEM_ITENS_TTL = int(os.getenv("CONTAGEM_ITENS_TTL", "30"))
+
+    # Configurador público: pasta e tamanho total da fila em disco de envios aguardando
+    # gravação, tamanho máximo do envio (com os desenhos) e limite por IP, em envios
+    # seguidos e fichas repostas por minuto.
+    CONFIGURADOR_FILA_DIR = os.getenv(
+        "CONFIGURADOR_FILA_DIR",
+        os.path.join(os.path.dirname(DATABASE_PATH), "configurador_fila"),
+    )
+    CONFIGURADOR_FILA_MAX_MB = float(os.getenv("CONFIGURADOR_FILA_MAX_MB", "200"))
+    CONFIGURADOR_PAYLOAD_MAX_MB = float(os.getenv("CONFIGURADOR_PAYLOAD_MAX_MB", "15"))
+    CONFIGURADOR_RAJADA = int(os.getenv("CONFIGURADOR_RAJADA", "5"))
+    CONFIGURADOR_POR_MINUTO = float(os.getenv("CONFIGURADOR_POR_MINUTO", "6"))
+
+    # Proxies reversos na frente do app (1 no Render), para o IP do cliente vir do X-Forwarded-For.
+    PROXIES_CONFIAVEIS = int(os.getenv("PROXIES_CONFIAVEIS", "0"))
@@ -0,0 +1,117 @@
+"""Confere com EXPLAIN QUERY PLAN que as listagens principais usam os índices compostos.
+
+Cria um banco temporário, faz as requisições como admin e como vendedor,
+captura os SELECTs que cada rota manda ao SQLite e procura no plano de cada um
+o índice esperado. Sai com código 1 se alguma rota não usar o índice.
+
+Uso: python explain_indices.py
+"""
+import os
+import sys
+import tempfile
+
+_pasta = tempfile.mkdtemp(prefix="explain_indices_")
+os.environ["DATABASE_PATH"] = os.path.join(_pasta, "explain.db")
+
+from sqlalchemy import event  # noqa: E402
+
+import app as aplicacao  # noqa: E402
+
+ADMIN = "00000000000"
+VENDEDOR = "11111111111"
+
+# (descrição, usuário, método, url, dados do form, índice esperado)
+CHECAGENS = [
+    ("itens do admin em /orcamentos/json", ADMIN, "get", "/orcamentos/json", None, "ix_orcamento_data"),
+    ("itens do vendedor em /orcamentos/json", VENDEDOR, "get", "/orcamentos/json", None, "ix_orcamento_dono_data"),
+    (
+        "itens do vendedor por período em /orcamentos/json", VENDEDOR, "get",
+        "/orcamentos/json?filtro_data_inicio=2026-06-01&filtro_data_fim=2026-06-30", None,
+        # o período também tem de virar faixa no índice, não filtro depois da busca
+        "ix_orcamento_dono_data (dono=? AND data>?",
+    ),
+    (
+        "página seguinte (cursor) do vendedor em /orcamentos/json", VENDEDOR, "get",
+        "/orcamentos/json?cursor=2026-06-01T00:00:00.000000_10", None, "ix_orcamento_dono_data",
+    ),
+    (
+        "relatório de vendas, status Aprovado", ADMIN, "get",
+        "/relatorio_vendas?status=Aprovado&mes=6&ano=2026", None, "ix_orcamento_salvo_status_data_fechamento",
+    ),
+    (
+        "relatório de vendas, status Em Espera", ADMIN, "get",
+        "/relatorio_vendas?status=Em+Espera&mes=6&ano=2026", None, "ix_orcamento_salvo_status_data_fechamento",
+    ),
+    (
+        "cadastro de cliente (telefone e dono)", VENDEDOR, "post", "/clientes",
+        {"nome": "Cliente Explain", "telefone": "(11) 90000-0000"}, "ix_cliente_dono_telefone",
+    ),
+]
+
+
+def _preparar_usuarios():
+    clientes = {}
+    admin = aplicacao.app.test_client()
+    admin.post("/setup", data={"nome": "Admin", "cpf": ADMIN, "senha": "explain"})
+    with aplicacao.app.app_context():
+        vendedor = aplicacao.Usuario(nome="Vendedor", cpf=VENDEDOR, is_admin=False)
+        vendedor.set_senha("explain")
+        aplicacao.db.session.add(vendedor)
+        aplicacao.db.session.commit()
+    for cpf in (ADMIN, VENDEDOR):
+        cliente = aplicacao.app.test_client()
+        cliente.post("/login", data={"cpf": cpf, "senha": "explain"})
+        clientes[cpf] = cliente
+    return clientes
+
+
+def _capturar(cliente, metodo, url, dados):
+    consultas = []
+
+    def registrar(conexao, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            consultas.append((statement, parameters))
+
+    with aplicacao.app.app_context():
+        engine = aplicacao.db.engine
+    event.listen(engine, "before_cursor_execute", registrar)
+    try:
+        resposta = getattr(cliente, metodo)(url, data=dados)
+    finally:
+        event.remove(engine, "before_cursor_execute", registrar)
+    if resposta.status_code >= 400:
+        raise RuntimeError(f"{metodo.upper()} {url} respondeu {resposta.status_code}")
+    return engine, consultas
+
+
+def _planos(engine, consultas):
+    planos = []
+    with engine.connect() as conexao:
+        for statement, parameters in consultas:
+            linhas = conexao.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            planos.append((statement, [linha[-1] for linha in linhas]))
+    return planos
+
+
+def main():
+    clientes = _preparar_usuarios()
+    falhas = 0
+    for descricao, usuario, metodo, url, dados, indice in CHECAGENS:
+        engine, consultas = _capturar(clientes[usuario], metodo, url, dados)
+        planos = _planos(engine, consultas)
+        usa_indice = any(
+            f"INDEX {indice} " in f"{detalhe} " for _, detalhes in planos for detalhe in detalhes
+        )
+        print(f"{'OK  ' if usa_indice else 'FALHA'} {descricao}: {indice}")
+        if not usa_indice:
+            falhas += 1
+            for statement, detalhes in planos:
+                print("      " + " ".join(statement.split())[:160])
+                for detalhe in detalhes:
+                    print(f"        {detalhe}")
+    if falhas:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
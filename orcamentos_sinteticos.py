@@ -0,0 +1,126 @@
+"""Itens de orçamento sintéticos e reproduzíveis para a regressão e o benchmark de preços.
+
+Os itens percorrem em ciclo todas as combinações de tipo de produto, cuba, RT e
+saia/fronte/virada; medidas, valores e os demais campos saem de um random.Random
+com semente fixa. Parte dos itens usa as listas dinâmicas (cubas, saia_fronte) e
+parte só os campos antigos do Orcamento, para cobrir os dois caminhos de cálculo.
+"""
+import random
+from itertools import product
+
+from pricing import CUBA_VALORES_PADRAO
+
+SEMENTE_PADRAO = 2024
+
+TIPOS_PRODUTO = [
+    "Pedra Simples", "Soleira", "Ilharga", "Pedra Simples com Saia", "Bancada", "Lavatorio",
+    "Ilharga Bipolida", "Pedra Bipolida com Saia", "Pedra Bipolida", "Nicho", "Pedra de Box",
+    "Outro",
+]
+TIPOS_CUBA = [""] + list(CUBA_VALORES_PADRAO)
+RT = ["Não", "Sim"]
+# Nenhuma, só saia, só fronte, saia e fronte com virada
+SAIA_FRONTE = [(), ("Saia",), ("Fronte",), ("Saia", "Fronte", "virada")]
+ACABAMENTOS = {"Meia esquadria": 45, "Boleado": 30, "Chanfro": 25}
+
+COMBINACOES = list(product(TIPOS_PRODUTO, TIPOS_CUBA, RT, SAIA_FRONTE))
+
+
+def _medida(aleatorio, minimo, maximo):
+    sorteio = aleatorio.random()
+    if sorteio < 0.05:
+        return 0
+    if sorteio < 0.12:
+        return round(aleatorio.uniform(1, 10), 1)
+    return round(aleatorio.uniform(minimo, maximo), aleatorio.choice([0, 1, 2]))
+
+
+def gerar_itens(total=None, semente=SEMENTE_PADRAO):
+    """Gera `total` itens (por padrão um por combinação) como dicts.
+
+    Cada item traz os campos de calcular_valor_item, exceto os totais, e as
+    listas "cubas", "saia_fronte" e "acabamentos" no formato de normalizar_*.
+    """
+    aleatorio = random.Random(semente)
+    total = len(COMBINACOES) if total is None else total
+    itens = []
+    for indice in range(total):
+        tipo_produto, tipo_cuba, rt, saia_fronte = COMBINACOES[indice % len(COMBINACOES)]
+        dinamico = indice % 3 != 0
+        comprimento = _medida(aleatorio, 20, 320)
+        item = {
+            "tipo_produto": tipo_produto,
+            "valor_material": aleatorio.choice([0, 180, 650.5, 999.99, 1000, 1450, 1999.99, 2000, 3200]),
+            "quantidade": aleatorio.choice([1, 1, 1, 2, 3]),
+            "comprimento": comprimento,
+            "largura": _medida(aleatorio, 10, 75),
+            "instalacao": aleatorio.choice(["Sim", "Não"]),
+            "instalacao_valor": aleatorio.choice([0, 120, 250.5]),
+            "rt": rt,
+            "rt_percentual": aleatorio.choice([0, 5, 10, 12.5]) if rt == "Sim" else 0,
+            "tipo_cuba": tipo_cuba,
+            "quantidade_cubas": aleatorio.choice([1, 1, 2]) if tipo_cuba else 0,
+            "modelo_cuba": aleatorio.choice(["Normal", "Prainha"]),
+            "comprimento_cuba": _medida(aleatorio, 30, 90) if tipo_cuba == "Esculpida" else 0,
+            "largura_cuba": _medida(aleatorio, 30, 50) if tipo_cuba == "Esculpida" else 0,
+            "profundidade_cuba": _medida(aleatorio, 10, 20) if tipo_cuba == "Esculpida" else 0,
+            "tem_cooktop": aleatorio.choice(["Sim", "Não", "Não"]),
+            "profundidade_nicho": _medida(aleatorio, 8, 30) if tipo_produto == "Nicho" else 0,
+            "tem_fundo": aleatorio.choice(["Sim", "Não"]),
+            "tem_alisar": aleatorio.choice(["Sim", "Não"]),
+            "largura_alisar": aleatorio.choice([0, 3, 5]),
+            "comprimento_saia": 0,
+            "largura_saia": 0,
+            "comprimento_fronte": 0,
+            "largura_fronte": 0,
+            "cubas": [],
+            "saia_fronte": [],
+            "acabamentos": [],
+        }
+        if tipo_cuba and dinamico:
+            item["cubas"].append({
+                "nome": tipo_cuba,
+                "quantidade": item["quantidade_cubas"],
+                "modelo": item["modelo_cuba"],
+                "comprimento": item["comprimento_cuba"],
+                "largura": item["largura_cuba"],
+                "profundidade": item["profundidade_cuba"],
+            })
+        for tipo in ("Saia", "Fronte"):
+            if tipo not in saia_fronte:
+                continue
+            comprimento_peca = comprimento if aleatorio.random() < 0.7 else _medida(aleatorio, 5, 320)
+            largura_peca = aleatorio.choice([3, 5, 7.5, 10, 15])
+            if dinamico:
+                virada = "virada" in saia_fronte
+                item["saia_fronte"].append({
+                    "tipo": tipo,
+                    "comprimento": comprimento_peca,
+                    "largura": largura_peca,
+                    "virada": virada,
+                    "virada_comprimento": comprimento_peca if virada else 0,
+                    "virada_largura": aleatorio.choice([3, 5, 12]) if virada else 0,
+                })
+            else:
+                item[f"comprimento_{tipo.lower()}"] = comprimento_peca
+                item[f"largura_{tipo.lower()}"] = largura_peca
+        for nome in aleatorio.sample(sorted(ACABAMENTOS), aleatorio.choice([0, 0, 1, 2])):
+            item["acabamentos"].append({
+                "nome": nome,
+                "comprimento": _medida(aleatorio, 20, 320),
+                "valor": ACABAMENTOS[nome],
+            })
+        itens.append(item)
+    return itens
+
+
+def argumentos_calculo(item, cubas_valor_total, saia_fronte_valor_total, acabamentos_valor_total):
+    """Argumentos de calcular_valor_item para o item, com os totais já calculados."""
+    argumentos = {
+        chave: valor for chave, valor in item.items()
+        if chave not in ("cubas", "saia_fronte", "acabamentos")
+    }
+    argumentos["cubas_valor_total"] = cubas_valor_total
+    argumentos["saia_fronte_valor_total"] = saia_fronte_valor_total
+    argumentos["acabamentos_valor_total"] = acabamentos_valor_total
+    return argumentos
@@ -0,0 +1,346 @@
+"""Renderização de PDFs fora do processo web.
+
+As funções de renderização rodam nos processos do pool; este módulo não
+importa o app, para que os processos filhos subam rápido.
+"""
+
+import mimetypes
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import unquote, urlsplit
+
+PROJECT_DIR = os.path.abspath(os.path.dirname(__file__))
+
+
+def _get_weasyprint_html():
+    try:
+        from weasyprint import HTML
+        return HTML
+    except OSError as exc:
+        raise RuntimeError(
+            "WeasyPrint precisa das bibliotecas nativas GTK/Pango instaladas para gerar PDF no Windows."
+        ) from exc
+
+
+def _localizar_navegador_pdf():
+    candidatos = [
+        os.path.join(os.environ.get("PROGRAMFILES", ""), "Google", "Chrome", "Application", "chrome.exe"),
+        os.path.join(os.environ.get("PROGRAMFILES(X86)", ""), "Google", "Chrome", "Application", "chrome.exe"),
+        os.path.join(os.environ.get("LOCALAPPDATA", ""), "Google", "Chrome", "Application", "chrome.exe"),
+        os.path.join(os.environ.get("PROGRAMFILES", ""), "Microsoft", "Edge", "Application", "msedge.exe"),
+        os.path.join(os.environ.get("PROGRAMFILES(X86)", ""), "Microsoft", "Edge", "Application", "msedge.exe"),
+    ]
+    for caminho in candidatos:
+        if caminho and os.path.exists(caminho):
+            return caminho
+    return None
+
+def _absolutizar_assets_html(html, base_url):
+    static_url = "file:///" + os.path.join(PROJECT_DIR, "static").replace("\\", "/") + "/"
+    html = (
+        html
+        .replace('href="/static/', f'href="{static_url}')
+        .replace("href='/static/", f"href='{static_url}")
+        .replace('src="/static/', f'src="{static_url}')
+        .replace("src='/static/", f"src='{static_url}")
+    )
+    base = (base_url or "").rstrip("/")
+    if not base:
+        return html
+    return (
+        html
+        .replace('href="/static/', f'href="{base}/static/')
+        .replace("href='/static/", f"href='{base}/static/")
+        .replace('src="/static/', f'src="{base}/static/')
+        .replace("src='/static/", f"src='{base}/static/")
+    )
+
+def _gerar_pdf_html_com_chrome(rendered_html, base_url):
+    navegador = _localizar_navegador_pdf()
+    if not navegador:
+        raise RuntimeError("Chrome/Edge não encontrado para gerar PDF.")
+
+    import tempfile
+    html = _absolutizar_assets_html(rendered_html, base_url)
+    temp_html_path = None
+    temp_pdf_path = None
+    user_data_dir = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".html", mode="w", encoding="utf-8") as temp_html:
+            temp_html.write(html)
+            temp_html_path = temp_html.name
+
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
+            temp_pdf_path = temp_pdf.name
+
+        user_data_dir = tempfile.mkdtemp(prefix="chrome-pdf-")
+        file_url = "file:///" + temp_html_path.replace("\\", "/")
+        comando = [
+            navegador,
+            "--headless=new",
+            "--disable-gpu",
+            "--disable-software-rasterizer",
+            "--disable-dev-shm-usage",
+            "--disable-background-networking",
+            "--disable-background-timer-throttling",
+            "--disable-client-side-phishing-detection",
+            "--disable-extensions",
+            "--disable-sync",
+            "--metrics-recording-only",
+            "--no-sandbox",
+            "--disable-setuid-sandbox",
+            "--no-first-run",
+            "--no-default-browser-check",
+            "--disable-features=UseSkiaRenderer,VizDisplayCompositor,CanvasOopRasterization",
+            f"--user-data-dir={user_data_dir}",
+            "--print-to-pdf-no-header",
+            f"--print-to-pdf={temp_pdf_path}",
+            file_url,
+        ]
+        resultado = subprocess.run(comando, capture_output=True, text=True, timeout=60)
+        if resultado.returncode != 0:
+            raise RuntimeError((resultado.stderr or resultado.stdout or "Falha ao gerar PDF com Chrome.").strip())
+        with open(temp_pdf_path, "rb") as pdf_file:
+            pdf_bytes = pdf_file.read()
+        if not pdf_bytes.startswith(b"%PDF-"):
+            raise RuntimeError("Chrome não retornou um PDF válido.")
+        return pdf_bytes
+    finally:
+        for caminho in (temp_html_path, temp_pdf_path):
+            if caminho and os.path.exists(caminho):
+                try:
+                    os.unlink(caminho)
+                except OSError:
+                    pass
+        if user_data_dir and os.path.exists(user_data_dir):
+            try:
+                import shutil
+                shutil.rmtree(user_data_dir, ignore_errors=True)
+            except Exception:
+                pass
+
+
+def _criar_url_fetcher(limite_bytes):
+    """URLFetcher que lê /static/ do disco e guarda em memória o que já buscou.
+
+    Sem isso cada PDF buscaria o pilot.css por HTTP no próprio servidor.
+    """
+    try:
+        from weasyprint.urls import URLFetcher, URLFetcherResponse
+    except ImportError:
+        return None
+
+    class URLFetcherEmMemoria(URLFetcher):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.respostas = {}
+            self.total_bytes = 0
+
+        def _arquivo_estatico(self, url):
+            caminho = urlsplit(url).path
+            if not caminho.startswith("/static/"):
+                return None
+            raiz = os.path.join(PROJECT_DIR, "static")
+            arquivo = os.path.normpath(os.path.join(raiz, unquote(caminho[len("/static/"):])))
+            if not arquivo.startswith(raiz + os.sep) or not os.path.isfile(arquivo):
+                return None
+            return arquivo
+
+        def fetch(self, url, headers=None):
+            if url.startswith("data:"):
+                return super().fetch(url, headers)
+            arquivo = self._arquivo_estatico(url)
+            chave = (url, os.path.getmtime(arquivo)) if arquivo else (url, None)
+            if chave not in self.respostas:
+                if arquivo:
+                    with open(arquivo, "rb") as entrada:
+                        corpo = entrada.read()
+                    tipo = mimetypes.guess_type(arquivo)[0] or "application/octet-stream"
+                else:
+                    resposta = super().fetch(url, headers)
+                    try:
+                        corpo = resposta.read()
+                        tipo = resposta.headers.get("Content-Type") or "application/octet-stream"
+                    finally:
+                        resposta.close()
+                if self.total_bytes + len(corpo) > limite_bytes:
+                    self.respostas.clear()
+                    self.total_bytes = 0
+                self.respostas[chave] = (corpo, tipo)
+                self.total_bytes += len(corpo)
+            corpo, tipo = self.respostas[chave]
+            return URLFetcherResponse(url, corpo, {"Content-Type": tipo})
+
+    return URLFetcherEmMemoria()
+
+
+class RenderizadorWeasyPrint:
+    """WeasyPrint mantido aquecido no processo: fontes, arquivos buscados e imagens
+    decodificadas são reaproveitados entre um PDF e outro."""
+
+    LIMITE_IMAGENS = 64
+    LIMITE_ARQUIVOS_BYTES = 32 * 1024 * 1024
+
+    def __init__(self):
+        self.HTML = _get_weasyprint_html()
+        from weasyprint.text.fonts import FontConfiguration
+
+        self.font_config = FontConfiguration()
+        self.url_fetcher = _criar_url_fetcher(self.LIMITE_ARQUIVOS_BYTES)
+        # Cache de imagens do WeasyPrint, indexado pela URL (inclusive data URIs do logo)
+        self.imagens = {}
+
+    def renderizar(self, rendered_html, base_url):
+        if len(self.imagens) > self.LIMITE_IMAGENS:
+            self.imagens.clear()
+        opcoes = {"url_fetcher": self.url_fetcher} if self.url_fetcher else {}
+        documento = self.HTML(string=rendered_html, base_url=base_url, **opcoes)
+        return documento.write_pdf(font_config=self.font_config, cache=self.imagens)
+
+
+_renderizador = None
+
+
+def obter_renderizador():
+    global _renderizador
+    if _renderizador is None:
+        _renderizador = RenderizadorWeasyPrint()
+    return _renderizador
+
+
+def aquecer_renderizador():
+    """Initializer dos processos do pool: carrega o WeasyPrint antes do primeiro job."""
+    try:
+        obter_renderizador()
+    except Exception as exc:
+        print(f"[PDF] WeasyPrint indisponível neste processo: {exc}")
+
+
+def renderizar_pdf(rendered_html, base_url):
+    """Gera o PDF com WeasyPrint e, sem as bibliotecas nativas, com Chrome/Edge."""
+    try:
+        return obter_renderizador().renderizar(rendered_html, base_url)
+    except RuntimeError:
+        return _gerar_pdf_html_com_chrome(rendered_html, base_url)
+
+
+class FilaPdfCheia(RuntimeError):
+    pass
+
+
+class PoolPdf:
+    """Pool limitado de processos de renderização, com um job por chave de cache.
+
+    Cada worker do gunicorn tem o seu pool; o resultado é compartilhado pelo
+    cache em disco, então o status também consulta o cache.
+    """
+
+    # Segundos que o erro de um job continua disponível para a página de espera
+    ERRO_TTL = 300
+
+    def __init__(self, processos=2, fila_max=20):
+        self.processos = max(1, processos)
+        self.fila_max = max(1, fila_max)
+        self._executor = None
+        self._jobs = {}
+        self._erros = {}  # chave -> (mensagem, instante do erro)
+        self._lock = threading.Lock()
+
+    def _obter_executor(self):
+        if self._executor is None:
+            # spawn funciona igual no Linux e no Windows e não herda conexões do app
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processos,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=aquecer_renderizador,
+            )
+        return self._executor
+
+    def _descartar_executor(self, executor):
+        """Tira de uso um executor quebrado (processo filho morto) e os jobs dele.
+
+        Chamado sem o lock: o shutdown cancela futuros cujos callbacks pegam o lock.
+        """
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            for chave, futuro in list(self._jobs.items()):
+                if not futuro.done():
+                    del self._jobs[chave]
+        print("[PDF] Processo de renderização encerrado de forma inesperada; pool recriado.")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submeter(self, chave, rendered_html, base_url):
+        with self._lock:
+            futuro = self._jobs.get(chave)
+            # Job concluído com sucesso fica na lista até o callback gravar o resultado
+            if futuro is not None and (not futuro.done() or futuro.exception() is None):
+                return futuro, None
+            agora = time.monotonic()
+            for chave_erro, (_, instante) in list(self._erros.items()):
+                if agora - instante > self.ERRO_TTL:
+                    del self._erros[chave_erro]
+            pendentes = sum(1 for job in self._jobs.values() if not job.done())
+            if pendentes >= self.fila_max:
+                raise FilaPdfCheia("Fila de PDFs cheia.")
+            executor = self._obter_executor()
+            try:
+                futuro = executor.submit(renderizar_pdf, rendered_html, base_url)
+            except BrokenProcessPool:
+                return None, executor
+            self._erros.pop(chave, None)
+            self._jobs[chave] = futuro
+            return futuro, executor
+
+    def enfileirar(self, chave, rendered_html, base_url, ao_concluir=None):
+        futuro, executor = self._submeter(chave, rendered_html, base_url)
+        if futuro is None:
+            # Um filho morreu (falta de memória, segfault) e o executor não aceita mais jobs
+            self._descartar_executor(executor)
+            futuro, executor = self._submeter(chave, rendered_html, base_url)
+            if futuro is None:
+                raise BrokenProcessPool("Pool de PDF indisponível.")
+        if executor is None:
+            return futuro
+
+        def concluir(futuro_concluido):
+            erro = None if futuro_concluido.cancelled() else futuro_concluido.exception()
+            if erro is None and not futuro_concluido.cancelled() and ao_concluir:
+                try:
+                    ao_concluir(futuro_concluido.result())
+                except Exception as exc:
+                    print(f"[PDF] Falha ao concluir job {chave}: {exc}")
+            with self._lock:
+                if self._jobs.get(chave) is futuro_concluido:
+                    del self._jobs[chave]
+                    if erro is not None:
+                        self._erros[chave] = (str(erro) or type(erro).__name__, time.monotonic())
+            if isinstance(erro, BrokenProcessPool):
+                self._descartar_executor(executor)
+
+        futuro.add_done_callback(concluir)
+        return futuro
+
+    def status(self, chave):
+        """Devolve (status, erro) do job local: processando, erro ou None se desconhecido."""
+        with self._lock:
+            futuro = self._jobs.get(chave)
+            erro = self._erros.get(chave)
+        if futuro is not None:
+            return "processando", None
+        if erro is not None and time.monotonic() - erro[1] <= self.ERRO_TTL:
+            return "erro", erro[0]
+        return None, None
+
+    def descartar(self, chave):
+        with self._lock:
+            self._erros.pop(chave, None)
+            futuro = self._jobs.get(chave)
+            if futuro is not None and futuro.done():
+                del self._jobs[chave]
@@ -1,5 +1,7 @@
 """Central pricing rules for stonework quote items."""
 
+from array import array
+
 CUBA_VALORES_PADRAO = {
     "Embutida": 225,
     "Sobreposta": 125,
@@ -38,54 +40,6 @@ def medida_minima(valor, minimo=MINIMO_MEDIDA_CM):
     return minimo if 0 < valor < minimo else valor
 
 
-def aplicar_margem_material(
-    tipo_produto,
-    valor_material,
-    valor_base,
-    pedra_simples_margem=0,
-    soleira_margem=0,
-    ilharga_margem=0,
-    margem_ate_1000=30,
-    margem_ate_2000=15,
-    margem_acima_2000=10,
-    margem_ilharga_bipolida=15,
-    pedra_simples_com_saia_margem=0,
-    pedra_bipolida_com_saia_margem=15,
-    pedra_bipolida_margem=15,
-):
-    if tipo_produto == "Pedra Simples":
-        return valor_base * (1 + _float(pedra_simples_margem) / 100)
-
-    if tipo_produto == "Soleira":
-        margem = soleira_margem if _float(soleira_margem) else pedra_simples_margem
-        return valor_base * (1 + _float(margem) / 100)
-
-    if tipo_produto == "Ilharga":
-        return valor_base * (1 + _float(ilharga_margem) / 100)
-
-    if tipo_produto == "Pedra Simples com Saia":
-        return valor_base * (1 + _float(pedra_simples_com_saia_margem) / 100)
-
-    if tipo_produto in ["Bancada", "Lavatorio"]:
-        if valor_material < 1000:
-            return valor_base * (1 + _float(margem_ate_1000) / 100)
-        if valor_material < 2000:
-            return valor_base * (1 + _float(margem_ate_2000) / 100)
-        if valor_material < 1000000:
-            return valor_base * (1 + _float(margem_acima_2000) / 100)
-
-    if tipo_produto == "Ilharga Bipolida" and valor_base < 1000000:
-        return valor_base * (1 + _float(margem_ilharga_bipolida) / 100)
-
-    if tipo_produto == "Pedra Bipolida com Saia" and valor_base < 1000000:
-        return valor_base * (1 + _float(pedra_bipolida_com_saia_margem) / 100)
-
-    if tipo_produto == "Pedra Bipolida" and valor_base < 1000000:
-        return valor_base * (1 + _float(pedra_bipolida_margem) / 100)
-
-    return valor_base
-
-
 def calcular_area_nicho(
     comprimento,
     largura,
@@ -135,156 +89,381 @@ def calcular_area_cuba_esculpida(modelo_cuba, comprimento_cuba, largura_cuba, pr
     ) / 10000
 
 
-def calcular_valor_item(
-    *,
-    tipo_produto,
-    valor_material,
-    quantidade=1,
-    comprimento=0,
-    largura=0,
-    comprimento_saia=0,
-    largura_saia=0,
-    comprimento_fronte=0,
-    largura_fronte=0,
-    tipo_cuba="",
-    quantidade_cubas=0,
-    comprimento_cuba=0,
-    largura_cuba=0,
-    profundidade_cuba=0,
-    modelo_cuba="Normal",
-    cubas_valor_total=0,
-    tem_cooktop="Nao",
-    acessorios_valor_total=0,
-    acabamentos_valor_total=0,
-    saia_fronte_valor_total=0,
-    instalacao="Nao",
-    instalacao_valor=0,
-    rt="Nao",
-    rt_percentual=0,
-    profundidade_nicho=0,
-    tem_fundo="Nao",
-    tem_alisar="Nao",
-    largura_alisar=0,
-    cuba_valores=None,
-    cooktop_valor=COOKTOP_VALOR_PADRAO,
-    nicho_mao_obra=NICHO_MAO_OBRA_PADRAO,
-    nicho_sem_fundo_mao_obra=None,
-    minimo_medida_cm=MINIMO_MEDIDA_CM,
-    pedra_simples_margem=0,
-    soleira_margem=0,
-    ilharga_margem=0,
-    bancada_margem_ate_1000=30,
-    bancada_margem_ate_2000=15,
-    bancada_margem_acima_2000=10,
-    ilharga_bipolida_margem=15,
-    pedra_simples_com_saia_margem=0,
-    pedra_bipolida_com_saia_margem=15,
-    pedra_bipolida_margem=15,
-    pedra_box_adicional=30,
-    nicho_folga_cm=4,
-    saia_margem=0,
-    fronte_margem=0,
-    virada_margem=0,
-    alisar_margem=0,
-):
-    valor_material = _float(valor_material)
-    quantidade = max(_int(quantidade, 1), 1)
-    cuba_valores = cuba_valores or CUBA_VALORES_PADRAO
-
-    minimo_medida_cm = _float(minimo_medida_cm, MINIMO_MEDIDA_CM)
-    comprimento_cal = max(_float(comprimento), minimo_medida_cm)
-    largura_cal = max(_float(largura), minimo_medida_cm)
-    valor_base = valor_material * (comprimento_cal * largura_cal / 10000)
-    valor_base = aplicar_margem_material(
-        tipo_produto,
-        valor_material,
-        valor_base,
-        pedra_simples_margem,
-        soleira_margem,
-        ilharga_margem,
-        bancada_margem_ate_1000,
-        bancada_margem_ate_2000,
-        bancada_margem_acima_2000,
-        ilharga_bipolida_margem,
-        pedra_simples_com_saia_margem,
-        pedra_bipolida_com_saia_margem,
-        pedra_bipolida_margem,
-    )
-
-    total = valor_base
-
-    if tipo_produto == "Nicho":
-        area_nicho = calcular_area_nicho(
-            comprimento,
-            largura,
-            profundidade_nicho,
-            tem_fundo,
-            tem_alisar,
-            largura_alisar,
-            minimo_medida_cm,
-            nicho_folga_cm,
-            alisar_margem,
-        )
-        mao_obra_nicho = nicho_mao_obra
-        if tem_fundo != "Sim" and nicho_sem_fundo_mao_obra is not None:
-            mao_obra_nicho = nicho_sem_fundo_mao_obra
-        total = (area_nicho / 10000) * valor_material + _float(mao_obra_nicho, NICHO_MAO_OBRA_PADRAO)
-
-    total_saia_fronte_dinamico = _float(saia_fronte_valor_total)
-
-    if total_saia_fronte_dinamico <= 0 and tipo_produto in ["Ilharga", "Ilharga Bipolida", "Pedra Simples com Saia", "Pedra Bipolida com Saia", "Bancada", "Lavatorio"]:
-        comp_saia = _float(comprimento_saia)
-        larg_saia = _float(largura_saia)
-        if comp_saia > 0 and larg_saia > 0:
-            comp_saia_cal = medida_minima(comp_saia, minimo_medida_cm)
-            larg_saia_cal = medida_minima(larg_saia, minimo_medida_cm)
-            total += valor_material * (comp_saia_cal * larg_saia_cal / 10000)
-        total += (comp_saia / 100) * _float(saia_margem)
-
-    if total_saia_fronte_dinamico <= 0 and tipo_produto in ["Bancada", "Lavatorio"]:
-        comp_fronte = _float(comprimento_fronte)
-        larg_fronte = _float(largura_fronte)
-        if comp_fronte > 0 and larg_fronte > 0:
-            comp_fronte_cal = medida_minima(comp_fronte, minimo_medida_cm)
-            larg_fronte_cal = medida_minima(larg_fronte, minimo_medida_cm)
-            total += valor_material * (comp_fronte_cal * larg_fronte_cal / 10000)
-        total += (comp_fronte / 100) * _float(fronte_margem)
-
-    total += total_saia_fronte_dinamico
-
-    if tipo_produto == "Pedra de Box":
-        total = (valor_base * 2) + ((_float(comprimento) / 100) * _float(pedra_box_adicional, 30))
-
-    cubas_valor_total = _float(cubas_valor_total)
-    if cubas_valor_total > 0:
-        total += cubas_valor_total
-    elif tipo_cuba:
-        qtd_cubas = _int(quantidade_cubas, 0)
-        if tipo_cuba == "Esculpida":
-            qtd_esculpida = max(qtd_cubas, 1)
-            total += cuba_valores.get(tipo_cuba, 0) * qtd_esculpida
-            area_cuba = calcular_area_cuba_esculpida(
-                modelo_cuba,
-                comprimento_cuba,
-                largura_cuba,
-                profundidade_cuba,
-            )
-            total += area_cuba * valor_material * qtd_esculpida
-        else:
-            total += cuba_valores.get(tipo_cuba, 0) * qtd_cubas
+TIPOS_COM_SAIA = ("Ilharga", "Ilharga Bipolida", "Pedra Simples com Saia", "Pedra Bipolida com Saia", "Bancada", "Lavatorio")
+TIPOS_COM_FRONTE = ("Bancada", "Lavatorio")
+
+# Argumentos por item de calcular_valor_item e o valor usado quando não são informados
+COLUNAS_ITEM = {
+    "quantidade": 1,
+    "comprimento": 0,
+    "largura": 0,
+    "comprimento_saia": 0,
+    "largura_saia": 0,
+    "comprimento_fronte": 0,
+    "largura_fronte": 0,
+    "tipo_cuba": "",
+    "quantidade_cubas": 0,
+    "comprimento_cuba": 0,
+    "largura_cuba": 0,
+    "profundidade_cuba": 0,
+    "modelo_cuba": "Normal",
+    "cubas_valor_total": 0,
+    "tem_cooktop": "Nao",
+    "acessorios_valor_total": 0,
+    "acabamentos_valor_total": 0,
+    "saia_fronte_valor_total": 0,
+    "instalacao": "Nao",
+    "instalacao_valor": 0,
+    "rt": "Nao",
+    "rt_percentual": 0,
+    "profundidade_nicho": 0,
+    "tem_fundo": "Nao",
+    "tem_alisar": "Nao",
+    "largura_alisar": 0,
+}
 
-    total += _float(acessorios_valor_total)
-    total += _float(acabamentos_valor_total)
-    if tem_cooktop == "Sim" and _float(acessorios_valor_total) <= 0:
-        total += _float(cooktop_valor)
+# Opções da empresa aceitas por RegrasPrecificacao e o valor padrão de cada uma
+OPCOES_PRECIFICACAO = {
+    "cuba_valores": None,
+    "cooktop_valor": COOKTOP_VALOR_PADRAO,
+    "nicho_mao_obra": NICHO_MAO_OBRA_PADRAO,
+    "nicho_sem_fundo_mao_obra": None,
+    "minimo_medida_cm": MINIMO_MEDIDA_CM,
+    "pedra_simples_margem": 0,
+    "soleira_margem": 0,
+    "ilharga_margem": 0,
+    "bancada_margem_ate_1000": 30,
+    "bancada_margem_ate_2000": 15,
+    "bancada_margem_acima_2000": 10,
+    "ilharga_bipolida_margem": 15,
+    "pedra_simples_com_saia_margem": 0,
+    "pedra_bipolida_com_saia_margem": 15,
+    "pedra_bipolida_margem": 15,
+    "pedra_box_adicional": 30,
+    "nicho_folga_cm": 4,
+    "saia_margem": 0,
+    "fronte_margem": 0,
+    "virada_margem": 0,
+    "alisar_margem": 0,
+}
 
-    if instalacao == "Sim":
-        total += _float(instalacao_valor)
 
-    total *= quantidade
+def _sem_margem(valor_material, valor_base):
+    return valor_base
 
-    rt_percentual = _float(rt_percentual)
-    if rt == "Sim" and rt_percentual > 0:
-        total = total / (1 - rt_percentual / 100)
 
-    return round(total, 2)
+class RegrasPrecificacao:
+    """Regras de preço já resolvidas para um conjunto de opções da empresa.
+
+    É a única implementação das regras: calcular_valor_item e
+    calcular_valores_itens delegam para cá. As margens e valores da empresa são
+    convertidos uma vez e cada tipo de produto ganha a própria função, montada
+    só com as etapas que valem para ele (margem, nicho, saia, fronte, pedra de
+    box), sem testes de tipo_produto por item.
+    """
+
+    def __init__(
+        self,
+        cuba_valores=None,
+        cooktop_valor=COOKTOP_VALOR_PADRAO,
+        nicho_mao_obra=NICHO_MAO_OBRA_PADRAO,
+        nicho_sem_fundo_mao_obra=None,
+        minimo_medida_cm=MINIMO_MEDIDA_CM,
+        pedra_simples_margem=0,
+        soleira_margem=0,
+        ilharga_margem=0,
+        bancada_margem_ate_1000=30,
+        bancada_margem_ate_2000=15,
+        bancada_margem_acima_2000=10,
+        ilharga_bipolida_margem=15,
+        pedra_simples_com_saia_margem=0,
+        pedra_bipolida_com_saia_margem=15,
+        pedra_bipolida_margem=15,
+        pedra_box_adicional=30,
+        nicho_folga_cm=4,
+        saia_margem=0,
+        fronte_margem=0,
+        virada_margem=0,
+        alisar_margem=0,
+    ):
+        self.cuba_valores = cuba_valores or CUBA_VALORES_PADRAO
+        self.minimo = _float(minimo_medida_cm, MINIMO_MEDIDA_CM)
+        self.cooktop_valor = _float(cooktop_valor)
+        self.mao_obra_nicho = _float(nicho_mao_obra, NICHO_MAO_OBRA_PADRAO)
+        self.mao_obra_nicho_sem_fundo = (
+            self.mao_obra_nicho if nicho_sem_fundo_mao_obra is None
+            else _float(nicho_sem_fundo_mao_obra, NICHO_MAO_OBRA_PADRAO)
+        )
+        self.pedra_box_adicional = _float(pedra_box_adicional, 30)
+        self.saia_margem = _float(saia_margem)
+        self.fronte_margem = _float(fronte_margem)
+        self.nicho_folga_cm = nicho_folga_cm
+        self.alisar_margem = alisar_margem
+
+        def fator(margem):
+            return 1 + _float(margem) / 100
+
+        margem_soleira = soleira_margem if _float(soleira_margem) else pedra_simples_margem
+        margens = {
+            "Pedra Simples": self._margem_fixa(fator(pedra_simples_margem)),
+            "Soleira": self._margem_fixa(fator(margem_soleira)),
+            "Ilharga": self._margem_fixa(fator(ilharga_margem)),
+            "Pedra Simples com Saia": self._margem_fixa(fator(pedra_simples_com_saia_margem)),
+            "Ilharga Bipolida": self._margem_limitada(fator(ilharga_bipolida_margem)),
+            "Pedra Bipolida com Saia": self._margem_limitada(fator(pedra_bipolida_com_saia_margem)),
+            "Pedra Bipolida": self._margem_limitada(fator(pedra_bipolida_margem)),
+        }
+        margem_bancada = self._margem_bancada(
+            fator(bancada_margem_ate_1000),
+            fator(bancada_margem_ate_2000),
+            fator(bancada_margem_acima_2000),
+        )
+        for tipo_produto in TIPOS_COM_FRONTE:
+            margens[tipo_produto] = margem_bancada
+
+        self._acrescimos = self._compilar_acrescimos()
+        corpo_saia = self._corpo_saia_fronte(fronte=False)
+        corpo_saia_fronte = self._corpo_saia_fronte(fronte=True)
+        corpos = {tipo_produto: corpo_saia for tipo_produto in TIPOS_COM_SAIA}
+        corpos.update({tipo_produto: corpo_saia_fronte for tipo_produto in TIPOS_COM_FRONTE})
+        corpos["Nicho"] = self._corpo_nicho()
+        corpos["Pedra de Box"] = self._corpo_pedra_box()
+
+        self.funcoes = {
+            tipo_produto: self._compilar(margens.get(tipo_produto, _sem_margem), corpos.get(tipo_produto, self._corpo_simples))
+            for tipo_produto in set(margens) | set(corpos)
+        }
+        self._sem_regra = self._compilar(_sem_margem, self._corpo_simples)
+
+    @staticmethod
+    def _margem_fixa(fator):
+        def margem(valor_material, valor_base):
+            return valor_base * fator
+        return margem
+
+    @staticmethod
+    def _margem_bancada(fator_ate_1000, fator_ate_2000, fator_acima_2000):
+        def margem(valor_material, valor_base):
+            if valor_material < 1000:
+                return valor_base * fator_ate_1000
+            if valor_material < 2000:
+                return valor_base * fator_ate_2000
+            if valor_material < 1000000:
+                return valor_base * fator_acima_2000
+            return valor_base
+        return margem
+
+    @staticmethod
+    def _margem_limitada(fator):
+        def margem(valor_material, valor_base):
+            return valor_base * fator if valor_base < 1000000 else valor_base
+        return margem
+
+    # Corpos: total da peça a partir do valor_base já com a margem, antes dos acréscimos
+
+    @staticmethod
+    def _corpo_simples(valor_material, valor_base, item):
+        return valor_base + _float(item.get("saia_fronte_valor_total", 0))
+
+    def _corpo_saia_fronte(self, fronte):
+        minimo = self.minimo
+        saia_margem = self.saia_margem
+        fronte_margem = self.fronte_margem
+
+        def corpo(valor_material, valor_base, item):
+            medida = item.get
+            total = valor_base
+            saia_fronte = _float(medida("saia_fronte_valor_total", 0))
+            if saia_fronte > 0:
+                return total + saia_fronte
+            comp_saia = _float(medida("comprimento_saia", 0))
+            larg_saia = _float(medida("largura_saia", 0))
+            if comp_saia > 0 and larg_saia > 0:
+                comp_saia_cal = minimo if comp_saia < minimo else comp_saia
+                larg_saia_cal = minimo if larg_saia < minimo else larg_saia
+                total += valor_material * (comp_saia_cal * larg_saia_cal / 10000)
+            total += (comp_saia / 100) * saia_margem
+            if fronte:
+                comp_fronte = _float(medida("comprimento_fronte", 0))
+                larg_fronte = _float(medida("largura_fronte", 0))
+                if comp_fronte > 0 and larg_fronte > 0:
+                    comp_fronte_cal = minimo if comp_fronte < minimo else comp_fronte
+                    larg_fronte_cal = minimo if larg_fronte < minimo else larg_fronte
+                    total += valor_material * (comp_fronte_cal * larg_fronte_cal / 10000)
+                total += (comp_fronte / 100) * fronte_margem
+            return total + saia_fronte
+
+        return corpo
+
+    def _corpo_nicho(self):
+        def corpo(valor_material, valor_base, item):
+            medida = item.get
+            tem_fundo = medida("tem_fundo", "Nao")
+            area_nicho = calcular_area_nicho(
+                medida("comprimento", 0),
+                medida("largura", 0),
+                medida("profundidade_nicho", 0),
+                tem_fundo,
+                medida("tem_alisar", "Nao"),
+                medida("largura_alisar", 0),
+                self.minimo,
+                self.nicho_folga_cm,
+                self.alisar_margem,
+            )
+            mao_obra = self.mao_obra_nicho if tem_fundo == "Sim" else self.mao_obra_nicho_sem_fundo
+            return (area_nicho / 10000) * valor_material + mao_obra + _float(medida("saia_fronte_valor_total", 0))
+
+        return corpo
+
+    def _corpo_pedra_box(self):
+        adicional = self.pedra_box_adicional
+
+        def corpo(valor_material, valor_base, item):
+            # A pedra de box não soma saia/fronte: o valor é o dobro da peça mais o adicional por metro
+            return (valor_base * 2) + ((_float(item.get("comprimento", 0)) / 100) * adicional)
+
+        return corpo
+
+    def _compilar_acrescimos(self):
+        cuba_valores = self.cuba_valores
+        cooktop_valor = self.cooktop_valor
+
+        def acrescimos(total, valor_material, item):
+            """Cubas, acessórios, acabamentos, cooktop, instalação, quantidade e RT."""
+            medida = item.get
+            cubas_valor = _float(medida("cubas_valor_total", 0))
+            if cubas_valor > 0:
+                total += cubas_valor
+            else:
+                tipo_cuba = medida("tipo_cuba", "")
+                if tipo_cuba:
+                    qtd_cubas = _int(medida("quantidade_cubas", 0), 0)
+                    if tipo_cuba == "Esculpida":
+                        qtd_esculpida = max(qtd_cubas, 1)
+                        total += cuba_valores.get(tipo_cuba, 0) * qtd_esculpida
+                        area_cuba = calcular_area_cuba_esculpida(
+                            medida("modelo_cuba", "Normal"),
+                            medida("comprimento_cuba", 0),
+                            medida("largura_cuba", 0),
+                            medida("profundidade_cuba", 0),
+                        )
+                        total += area_cuba * valor_material * qtd_esculpida
+                    else:
+                        total += cuba_valores.get(tipo_cuba, 0) * qtd_cubas
+
+            acessorios_valor = _float(medida("acessorios_valor_total", 0))
+            total += acessorios_valor
+            total += _float(medida("acabamentos_valor_total", 0))
+            if acessorios_valor <= 0 and medida("tem_cooktop", "Nao") == "Sim":
+                total += cooktop_valor
+
+            if medida("instalacao", "Nao") == "Sim":
+                total += _float(medida("instalacao_valor", 0))
+
+            quantidade = _int(medida("quantidade", 1), 1)
+            if quantidade > 1:
+                total *= quantidade
+
+            rt_percentual = _float(medida("rt_percentual", 0))
+            if rt_percentual > 0 and medida("rt", "Nao") == "Sim":
+                total = total / (1 - rt_percentual / 100)
+
+            return round(total, 2)
+
+        return acrescimos
+
+    def _compilar(self, margem, corpo):
+        minimo = self.minimo
+        acrescimos = self._acrescimos
+
+        def calcular(valor_material, item):
+            medida = item.get
+            valor_material = _float(valor_material)
+            comprimento_cal = _float(medida("comprimento", 0))
+            if minimo > comprimento_cal:
+                comprimento_cal = minimo
+            largura_cal = _float(medida("largura", 0))
+            if minimo > largura_cal:
+                largura_cal = minimo
+            valor_base = margem(valor_material, valor_material * (comprimento_cal * largura_cal / 10000))
+            return acrescimos(corpo(valor_material, valor_base, item), valor_material, item)
+
+        return calcular
+
+    def funcao(self, tipo_produto):
+        """Função de preço do tipo de produto: calcular(valor_material, item), com `item`
+        um dict com os argumentos de COLUNAS_ITEM (os ausentes usam o valor padrão)."""
+        return self.funcoes.get(tipo_produto, self._sem_regra)
+
+    def calcular(self, *, tipo_produto, valor_material, **item):
+        return self.funcoes.get(tipo_produto, self._sem_regra)(valor_material, item)
+
+    def calcular_lote(self, colunas):
+        """Precifica vários itens de uma vez; veja calcular_valores_itens."""
+        tipos = colunas["tipo_produto"]
+        total_itens = len(tipos)
+        valores_material = _coluna(colunas, "valor_material", total_itens)
+        nomes = [nome for nome in COLUNAS_ITEM if nome in colunas]
+        linhas = zip(*[_coluna(colunas, nome, total_itens) for nome in nomes]) if nomes else [()] * total_itens
+        funcoes = self.funcoes
+        sem_regra = self._sem_regra
+        resultado = array("d", bytes(8 * total_itens))
+        for indice, (tipo_produto, valor_material, linha) in enumerate(zip(tipos, valores_material, linhas)):
+            resultado[indice] = funcoes.get(tipo_produto, sem_regra)(valor_material, dict(zip(nomes, linha)))
+        return resultado
+
+
+def _coluna(colunas, nome, total):
+    valores = colunas.get(nome)
+    if valores is None:
+        return [COLUNAS_ITEM.get(nome, 0)] * total
+    if len(valores) != total:
+        raise ValueError(f"Coluna {nome} tem {len(valores)} valores, esperado {total}")
+    return valores
+
+
+_regras_por_opcoes = {}
+_ultimas_regras = (None, None)  # (opções, regras) da última chamada
+
+
+def regras_para(**opcoes):
+    """RegrasPrecificacao das opções informadas, montada uma vez por conjunto de opções."""
+    global _ultimas_regras
+    ultimas_opcoes, regras = _ultimas_regras
+    if opcoes == ultimas_opcoes:
+        return regras
+    # Mesmas opções na mesma ordem dão a mesma chave; outra ordem só monta outra cópia
+    chave = tuple(
+        (nome, tuple(valor.items()) if isinstance(valor, dict) else valor)
+        for nome, valor in opcoes.items()
+    )
+    regras = _regras_por_opcoes.get(chave)
+    if regras is None:
+        if len(_regras_por_opcoes) >= 32:
+            _regras_por_opcoes.clear()
+        regras = _regras_por_opcoes[chave] = RegrasPrecificacao(**opcoes)
+    # Cópia dos dicts, para uma alteração posterior em cuba_valores não passar despercebida
+    _ultimas_regras = ({nome: dict(valor) if isinstance(valor, dict) else valor for nome, valor in opcoes.items()}, regras)
+    return regras
+
+
+def calcular_valor_item(*, tipo_produto, valor_material, **argumentos):
+    """Preço de um item. Aceita os argumentos de COLUNAS_ITEM e as opções de
+    OPCOES_PRECIFICACAO; quem precifica muitos itens com as mesmas opções deve
+    usar RegrasPrecificacao direto."""
+    opcoes = {nome: argumentos.pop(nome) for nome in OPCOES_PRECIFICACAO if nome in argumentos}
+    for nome in argumentos:
+        if nome not in COLUNAS_ITEM:
+            raise TypeError(f"calcular_valor_item() recebeu um argumento inesperado: {nome!r}")
+    return regras_para(**opcoes).funcao(tipo_produto)(valor_material, argumentos)
+
+
+def calcular_valores_itens(colunas, **opcoes):
+    """Precifica vários itens de uma vez, com o resultado idêntico ao de calcular_valor_item.
+
+    `colunas` mapeia o nome de cada argumento por item (tipo_produto, valor_material e
+    os de COLUNAS_ITEM) para uma sequência - lista, tupla ou array - com um valor por
+    item; `opcoes` são as de OPCOES_PRECIFICACAO. Devolve um array("d") com os totais
+    na ordem das colunas.
+    """
+    return regras_para(**opcoes).calcular_lote(colunas)
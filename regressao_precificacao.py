@@ -0,0 +1,171 @@
+"""Regressão de preços contra valores de referência gravados em regressao_precificacao.json.
+
+Para cada item de orcamentos_sinteticos e cada conjunto de OPCOES confere
+cubas_total, saia_fronte_total, acabamentos_total e calcular_valor_item contra o
+arquivo, e também se RegrasPrecificacao e calcular_valores_itens dão o mesmo valor
+que calcular_valor_item. Sai com código 1 se algo divergir.
+
+Uso: python regressao_precificacao.py [--atualizar]
+"""
+import json
+import os
+import sys
+import tempfile
+
+_pasta = tempfile.mkdtemp(prefix="regressao_precificacao_")
+os.environ["DATABASE_PATH"] = os.path.join(_pasta, "regressao.db")
+
+import app as aplicacao  # noqa: E402
+from orcamentos_sinteticos import SEMENTE_PADRAO, argumentos_calculo, gerar_itens  # noqa: E402
+from pricing import (  # noqa: E402
+    COLUNAS_ITEM,
+    CUBA_VALORES_PADRAO,
+    RegrasPrecificacao,
+    calcular_valor_item,
+    calcular_valores_itens,
+)
+
+ARQUIVO_REFERENCIA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regressao_precificacao.json")
+CAMPOS = ("cubas", "saia_fronte", "acabamentos", "valor")
+
+OPCOES = {
+    "padrao": dict(cuba_valores=dict(CUBA_VALORES_PADRAO)),
+    "empresa": dict(
+        cuba_valores=dict(CUBA_VALORES_PADRAO, Embutida=240, Esculpida=190.5, **{"Tanque Inox": 520}),
+        cooktop_valor=70,
+        nicho_mao_obra=180,
+        nicho_sem_fundo_mao_obra=120,
+        minimo_medida_cm=15,
+        pedra_simples_margem=5,
+        soleira_margem=8,
+        ilharga_margem=3,
+        pedra_simples_com_saia_margem=6,
+        bancada_margem_ate_1000=35,
+        bancada_margem_ate_2000=18,
+        bancada_margem_acima_2000=12,
+        ilharga_bipolida_margem=14,
+        pedra_bipolida_com_saia_margem=16,
+        pedra_bipolida_margem=17,
+        pedra_box_adicional=40,
+        nicho_folga_cm=3,
+        saia_margem=12,
+        fronte_margem=14,
+        virada_margem=9,
+        alisar_margem=10,
+    ),
+}
+
+
+def argumentos_itens(itens, opcoes):
+    """Argumentos de calcular_valor_item de cada item, com os totais calculados como no app."""
+    argumentos = []
+    for item in itens:
+        valor_material = item["valor_material"]
+        argumentos.append(argumentos_calculo(
+            item,
+            aplicacao.cubas_total(item["cubas"], valor_material, opcoes["cuba_valores"]),
+            aplicacao.saia_fronte_total(
+                item["saia_fronte"],
+                valor_material,
+                opcoes.get("minimo_medida_cm", 10),
+                opcoes.get("saia_margem", 0),
+                opcoes.get("fronte_margem", 0),
+                opcoes.get("virada_margem", 0),
+            ),
+            aplicacao.acabamentos_total(item["acabamentos"]),
+        ))
+    return argumentos
+
+
+def calcular_linhas(itens, opcoes):
+    linhas = []
+    for argumentos in argumentos_itens(itens, opcoes):
+        linhas.append([
+            argumentos["cubas_valor_total"],
+            argumentos["saia_fronte_valor_total"],
+            argumentos["acabamentos_valor_total"],
+            calcular_valor_item(**argumentos, **opcoes),
+        ])
+    return linhas
+
+
+def _conferir_caminhos(nome, itens, opcoes, linhas):
+    argumentos = argumentos_itens(itens, opcoes)
+    regras = RegrasPrecificacao(**opcoes)
+    colunas = {campo: [item.get(campo, padrao) for item in argumentos] for campo, padrao in COLUNAS_ITEM.items()}
+    colunas["tipo_produto"] = [item["tipo_produto"] for item in argumentos]
+    colunas["valor_material"] = [item["valor_material"] for item in argumentos]
+    lote = calcular_valores_itens(colunas, **opcoes)
+    erros = []
+    for indice, (item, linha) in enumerate(zip(argumentos, linhas)):
+        compilado = regras.calcular(**item)
+        if compilado != linha[3] or lote[indice] != linha[3]:
+            erros.append(f"{nome} #{indice} {item['tipo_produto']}: escalar {linha[3]!r}, "
+                         f"compilado {compilado!r}, lote {lote[indice]!r}")
+    return erros
+
+
+def _gravar(referencia):
+    # Uma linha por item para o diff do arquivo ficar legível
+    partes = [
+        "{",
+        f'  "semente": {referencia["semente"]},',
+        f'  "itens": {referencia["itens"]},',
+        f'  "campos": {json.dumps(list(CAMPOS))},',
+        '  "opcoes": {',
+    ]
+    blocos = []
+    for nome, linhas in referencia["opcoes"].items():
+        corpo = ",\n".join(f"      {json.dumps(linha)}" for linha in linhas)
+        blocos.append(f'    "{nome}": [\n{corpo}\n    ]')
+    partes.append(",\n".join(blocos))
+    partes.extend(["  }", "}"])
+    with open(ARQUIVO_REFERENCIA, "w", encoding="utf-8") as arquivo:
+        arquivo.write("\n".join(partes) + "\n")
+
+
+def main():
+    atualizar = "--atualizar" in sys.argv[1:]
+    itens = gerar_itens(semente=SEMENTE_PADRAO)
+    calculado = {nome: calcular_linhas(itens, opcoes) for nome, opcoes in OPCOES.items()}
+
+    erros = []
+    for nome, opcoes in OPCOES.items():
+        erros.extend(_conferir_caminhos(nome, itens, opcoes, calculado[nome]))
+
+    if atualizar:
+        if erros:
+            print("\n".join(erros[:20]))
+            sys.exit("Os caminhos de cálculo divergem; referência não gravada.")
+        _gravar({"semente": SEMENTE_PADRAO, "itens": len(itens), "opcoes": calculado})
+        print(f"Referência gravada: {len(itens)} itens x {len(OPCOES)} conjuntos de opções.")
+        return
+
+    with open(ARQUIVO_REFERENCIA, encoding="utf-8") as arquivo:
+        referencia = json.load(arquivo)
+    if referencia["semente"] != SEMENTE_PADRAO or referencia["itens"] != len(itens):
+        sys.exit("Referência gerada com outra semente ou quantidade de itens; rode com --atualizar.")
+    for nome, linhas in calculado.items():
+        esperadas = referencia["opcoes"].get(nome)
+        if esperadas is None:
+            erros.append(f"{nome}: conjunto de opções ausente na referência")
+            continue
+        for indice, (linha, esperada) in enumerate(zip(linhas, esperadas)):
+            for campo, valor, valor_esperado in zip(CAMPOS, linha, esperada):
+                if valor != valor_esperado:
+                    item = itens[indice]
+                    erros.append(
+                        f"{nome} #{indice} {item['tipo_produto']} / cuba {item['tipo_cuba'] or '-'} / "
+                        f"RT {item['rt']}: {campo} {valor!r}, esperado {valor_esperado!r}"
+                    )
+
+    if erros:
+        print("\n".join(erros[:50]))
+        if len(erros) > 50:
+            print(f"... e mais {len(erros) - 50} divergências")
+        sys.exit(1)
+    print(f"OK: {len(itens)} itens x {len(OPCOES)} conjuntos de opções iguais à referência.")
+
+
+if __name__ == "__main__":
+    main()
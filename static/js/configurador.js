@@ -1679,6 +1679,15 @@ document.addEventListener('keydown', function(event) {
     moverFocoParaProximoCampoAtual(el);
 });
 
+// O servidor devolve um ticket e grava o orçamento na fila; consulta até concluir
+function aguardarPedidoConfigurador(data) {
+    if (!data.success || data.status === 'concluido' || !data.status_url) return data;
+    return new Promise(resolve => setTimeout(resolve, 1000))
+        .then(() => fetch(data.status_url, {cache: 'no-store'}))
+        .then(r => r.json())
+        .then(aguardarPedidoConfigurador);
+}
+
 function finalizarOrcamento() {
     const btnNext = document.getElementById('btnNext');
     btnNext.textContent = 'Enviando...';
@@ -1691,6 +1700,7 @@ function finalizarOrcamento() {
         body: JSON.stringify(payload)
     })
     .then(r => r.json())
+    .then(aguardarPedidoConfigurador)
     .then(data => {
         if (data.success) {
             const sb = document.getElementById('sideBody');